@@ -1,12 +1,16 @@
 from logging import NullHandler, getLogger
 
-from .data_controller import (DataController, PostgresController,
-                              SqliteController)
-from .enums import Medium, Site
+from .data_controller import (DataController, MemoryCachedController,
+                              PostgresController, SqliteController,
+                              TTLPolicy)
+from .enums import BreakerState, Medium, Site
 from .logger import get_default_logger
+from .match_pool import MatchPool
 from .minoshiro import Minoshiro
 
 __all__ = ['DataController', 'PostgresController', 'SqliteController',
-           'get_default_logger', 'Site', 'Medium', 'Minoshiro']
+           'MemoryCachedController', 'TTLPolicy',
+           'get_default_logger', 'Site', 'Medium', 'BreakerState',
+           'MatchPool', 'Minoshiro']
 
 getLogger(__name__).addHandler(NullHandler())
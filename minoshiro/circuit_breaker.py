@@ -0,0 +1,161 @@
+"""
+Circuit breakers to stop calling sites that keep failing.
+"""
+from collections import deque
+from time import monotonic
+from typing import Optional
+
+from .enums import BreakerState
+
+__all__ = ['CircuitBreaker']
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker for one site.
+
+    The breaker starts closed and lets every call through. Once enough of
+    the recent calls failed or were too slow, it opens and rejects all calls.
+    After the probe interval it becomes half open and lets one call through,
+    which closes the breaker if it succeeds and opens it again if it fails.
+
+    Every allowed call gets a token for the state it was allowed in. Calls
+    that end after the state changed, such as calls that were already sent
+    when the breaker opened, don't count.
+    """
+    __slots__ = ('failure_rate', 'slow_call', 'window', 'min_calls',
+                 'probe_interval', '_clock', '_calls', '_state',
+                 '_opened_at', '_probing', '_epoch')
+
+    def __init__(self, *, failure_rate: float = 0.5, slow_call: float = None,
+                 window: int = 20, min_calls: int = 5,
+                 probe_interval: float = 30, clock=monotonic):
+        """
+        :param failure_rate:
+            The rate of failed calls in the window that opens the breaker.
+            Default is 0.5
+
+        :param slow_call:
+            Calls that take longer than this many seconds count as failed.
+            Default is None (latency is not checked).
+
+        :param window: the number of recent calls to look at. Default is 20.
+
+        :param min_calls:
+            The number of calls needed in the window before the breaker
+            can open. Default is 5.
+
+        :param probe_interval:
+            The number of seconds the breaker stays open before letting a
+            probe call through. Default is 30.
+
+        :param clock: a function that returns the current time in seconds.
+        """
+        assert 0 < failure_rate <= 1, (
+            'Param `failure_rate` must be in (0, 1].'
+        )
+        assert 0 < min_calls <= window, (
+            'Param `min_calls` must be in [1, window].'
+        )
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.window = window
+        self.min_calls = min_calls
+        self.probe_interval = probe_interval
+        self._clock = clock
+        self._calls = deque(maxlen=window)
+        self._state = BreakerState.CLOSED
+        self._opened_at = None
+        self._probing = False
+        self._epoch = 1
+
+    @property
+    def state(self) -> BreakerState:
+        """
+        :return: the current state of the breaker.
+        """
+        if (self._state == BreakerState.OPEN and
+                self._clock() - self._opened_at >= self.probe_interval):
+            self.__change(BreakerState.HALF_OPEN)
+        return self._state
+
+    def allow(self) -> Optional[int]:
+        """
+        Check if a call is allowed. A call that is allowed must be followed
+        by a call to ``record`` or ``release`` with its token.
+
+        :return: a token for the call if it's allowed, None otherwise.
+        """
+        state = self.state
+        if state == BreakerState.CLOSED:
+            return self._epoch
+        if state == BreakerState.HALF_OPEN and not self._probing:
+            self._probing = True
+            return self._epoch
+        return None
+
+    def record(self, success: bool, latency: float, token: int = None):
+        """
+        Record the outcome of a call.
+
+        The outcome is ignored if the state changed since the call was
+        allowed, or while the breaker is open. While the breaker is half
+        open, only the outcome of the probe counts.
+
+        :param success: True if the call did not raise an error.
+
+        :param latency: how long the call took in seconds.
+
+        :param token:
+            The token ``allow`` gave the call, None for a call that wasn't
+            allowed by the breaker.
+        """
+        state = self.state
+        if token is not None and token != self._epoch:
+            return
+        failed = not success or (
+            self.slow_call is not None and latency > self.slow_call
+        )
+        if state == BreakerState.HALF_OPEN:
+            if token is None:
+                return
+            if failed:
+                self.__open()
+            else:
+                self.__change(BreakerState.CLOSED)
+            return
+        if state == BreakerState.OPEN:
+            return
+        self._calls.append(failed)
+        if (len(self._calls) >= self.min_calls and
+                sum(self._calls) / len(self._calls) >= self.failure_rate):
+            self.__open()
+
+    def release(self, token: int):
+        """
+        Give back an allowed call that ended without an outcome, such as a
+        call that was never sent.
+
+        :param token: the token ``allow`` gave the call.
+        """
+        if self.state == BreakerState.HALF_OPEN and token == self._epoch:
+            self._probing = False
+
+    def __open(self):
+        """
+        Open the breaker.
+        """
+        self._opened_at = self._clock()
+        self.__change(BreakerState.OPEN)
+
+    def __change(self, state: BreakerState):
+        """
+        Change the state of the breaker, the tokens given out before don't
+        count anymore.
+
+        :param state: the new state.
+        """
+        self._state = state
+        self._epoch += 1
+        self._probing = False
+        self._calls.clear()
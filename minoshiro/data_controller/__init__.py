@@ -1,5 +1,8 @@
 from .abc import DataController
+from .memory_controller import MemoryCachedController
 from .postgres_controller import PostgresController
 from .sqlite_controller import SqliteController
+from .ttl import TTLPolicy
 
-__all__ = ['PostgresController', 'DataController', 'SqliteController']
+__all__ = ['PostgresController', 'DataController', 'SqliteController',
+           'MemoryCachedController', 'TTLPolicy']
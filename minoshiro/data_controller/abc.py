@@ -1,25 +1,55 @@
 from abc import ABCMeta, abstractmethod
-from json import loads
-from typing import Dict, Optional
+from math import log
+from random import random
+from time import time
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
 
 from aiohttp_wrapper import SessionManager
 
 from minoshiro.enums import Medium, Site
-from minoshiro.upstream import get_all_synonyms
-from .constants import convert_medium
+from minoshiro.upstream import get_synonyms
+from .ttl import TTLPolicy
+from .utils import parse_synonyms
 
 
 class DataController(metaclass=ABCMeta):
     """
     An ABC (abstract base class) that deals with database caching.
     """
-    __slots__ = ('logger',)
+    __slots__ = ('logger', 'ttl_policy', 'miss_ttl', 'max_stale',
+                 'early_refresh', 'refresh_callback')
 
-    def __init__(self, logger):
+    def __init__(self, logger, *, ttl_policy: TTLPolicy = None,
+                 miss_ttl: int = 3600, max_stale: int = 0,
+                 early_refresh: int = 600):
         """
         :param logger: the logger object to do logging with.
+
+        :param ttl_policy:
+            The policy that decides how long cached data stays fresh.
+            Default is a `TTLPolicy` with the default settings.
+
+        :param miss_ttl:
+            The number of seconds a site with no search results is skipped
+            for the same search query. Default is 3600.
+
+        :param max_stale:
+            The number of seconds expired data is still served for while it
+            is refreshed in the background. Default is 0 (expired data is
+            deleted and never served).
+
+        :param early_refresh:
+            Only used if ``max_stale`` is not 0. Data is refreshed before it
+            expires with a chance that grows as it gets closer to expiring,
+            this is about how many seconds early that starts.
+            Default is 600.
         """
         self.logger = logger
+        self.ttl_policy = ttl_policy or TTLPolicy()
+        self.miss_ttl = miss_ttl
+        self.max_stale = max_stale
+        self.early_refresh = early_refresh
+        self.refresh_callback = None
 
     @abstractmethod
     async def get_identifier(self, query: str,
@@ -132,6 +162,34 @@ class DataController(metaclass=ABCMeta):
         """
         raise NotImplementedError
 
+    async def set_identifiers_bulk(
+            self, rows: Iterable[Tuple[str, Medium, Site, str]]):
+        """
+        Set the identifiers for many names at once.
+
+        The default implementation calls ``set_identifier`` for every row,
+        subclasses should override this to write the whole batch in one go.
+
+        :param rows: (name, medium, site, identifier) tuples.
+        :type rows: Iterable[Tuple[str, Medium, Site, str]]
+        """
+        for name, medium, site, identifier in rows:
+            await self.set_identifier(name, medium, site, identifier)
+
+    async def set_medium_data_bulk(
+            self, rows: Iterable[Tuple[str, Medium, Site, dict]]):
+        """
+        Set the data for many ids at once.
+
+        The default implementation calls ``set_medium_data`` for every row,
+        subclasses should override this to write the whole batch in one go.
+
+        :param rows: (id, medium, site, data) tuples.
+        :type rows: Iterable[Tuple[str, Medium, Site, dict]]
+        """
+        for id_, medium, site, data in rows:
+            await self.set_medium_data(id_, medium, site, data)
+
     async def get_medium_data(self, query: str,
                               medium: Medium) -> Optional[dict]:
         """
@@ -146,35 +204,239 @@ class DataController(metaclass=ABCMeta):
         :return: the cached data, for all sites that has the data.
         :rtype: Optional[dict]
         """
-        id_dict = await self.get_identifier(query, medium)
+        data, id_dict = await self.resolve_cached(query, medium)
         if not id_dict:
             return
-        return {site: data for site, data in {
-            site: await self.medium_data_by_id(id_, medium, site)
-            for site, id_ in id_dict.items()
-        }.items() if data}
+        return data
+
+    async def resolve_cached(
+            self, query: str, medium: Medium
+    ) -> Tuple[Dict[Site, dict], Optional[Dict[Site, str]]]:
+        """
+        Get the cached data and identifiers for a search query.
+
+        The default implementation calls ``resolve_cached_many`` with the
+        one query, so it takes one round trip to the database if that does.
+
+        :param query: the search query.
+        :type query: str
+
+        :param medium: the medium type.
+        :type medium: Medium
+
+        :return:
+            A tuple of (cached data, cached identifiers), the identifiers
+            are None if nothing is found.
+        :rtype: Tuple[Dict[Site, dict], Optional[Dict[Site, str]]]
+        """
+        res = await self.resolve_cached_many((query,), medium)
+        return res.get(query, ({}, None))
+
+    async def resolve_cached_many(
+            self, queries: Iterable[str], medium: Medium
+    ) -> Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]]:
+        """
+        Get the cached data and identifiers for many search queries at once.
+
+        The default implementation calls ``get_identifier`` and
+        ``medium_data_by_id`` for every query, subclasses should override
+        this to read the whole batch in one go.
+
+        :param queries: the search queries.
+        :type queries: Iterable[str]
+
+        :param medium: the medium type.
+        :type medium: Medium
+
+        :return:
+            A dict of {query: (cached data, cached identifiers)}, queries
+            without any identifiers are not in the dict.
+        :rtype: Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]]
+        """
+        res = {}
+        for query in queries:
+            id_dict = await self.get_identifier(query, medium)
+            if not id_dict:
+                continue
+            data = {}
+            for site, id_ in id_dict.items():
+                medium_data = await self.medium_data_by_id(id_, medium, site)
+                if medium_data:
+                    data[site] = medium_data
+            res[query] = data, id_dict
+        return res
+
+    async def resolve_queries(
+            self, queries: Iterable[str], medium: Medium
+    ) -> Tuple[Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]],
+               Dict[str, Set[Site]]]:
+        """
+        Get everything cached for many search queries at once, the cached
+        data and identifiers, and the sites with no search results.
+
+        The default implementation calls ``resolve_cached_many`` and
+        ``get_misses``, subclasses should override this to read both in
+        one go.
+
+        :param queries: the search queries.
+        :type queries: Iterable[str]
+
+        :param medium: the medium type.
+        :type medium: Medium
+
+        :return:
+            A tuple of the return values of ``resolve_cached_many`` and
+            ``get_misses``
+        :rtype:
+            Tuple[Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]],
+            Dict[str, Set[Site]]]
+        """
+        queries = list(queries)
+        return (await self.resolve_cached_many(queries, medium),
+                await self.get_misses(queries, medium))
+
+    async def get_misses(self, queries: Iterable[str],
+                         medium: Medium) -> Dict[str, Set[Site]]:
+        """
+        Get the sites that recently had no search results for the given
+        search queries.
+
+        The default implementation does not cache misses, subclasses
+        should override this and ``set_miss`` to cache them.
+
+        :param queries: the search queries.
+        :type queries: Iterable[str]
+
+        :param medium: the medium type.
+        :type medium: Medium
+
+        :return:
+            A dict of {query: sites with no results}, queries without any
+            misses are not in the dict.
+        :rtype: Dict[str, Set[Site]]
+        """
+        return {}
+
+    async def set_miss(self, query: str, medium: Medium, site: Site):
+        """
+        Record that a site had no search results for a search query.
+
+        :param query: the search query.
+        :type query: str
+
+        :param medium: the medium type.
+        :type medium: Medium
+
+        :param site: the site.
+        :type site: Site
+        """
+        pass
+
+    async def get_synonyms_revision(self) -> Optional[int]:
+        """
+        Get the revision of the upstream synonyms imported last time.
+
+        The default implementation doesn't record the revision, so every
+        ``pre_cache`` imports all synonyms.
+
+        :return: the revision, None if it's not known.
+        :rtype: Optional[int]
+        """
+        return None
+
+    async def set_synonyms_revision(self, revision: int):
+        """
+        Record the revision of the upstream synonyms imported.
+
+        :param revision: the revision.
+        :type revision: int
+        """
+        pass
+
+    async def remove_synonyms(self, identifiers: Iterable[tuple],
+                              mal_titles: Iterable[tuple]):
+        """
+        Remove the identifiers and MAL titles of synonyms that were removed
+        upstream since the revision imported last time.
+
+        The default implementation doesn't remove them.
+
+        :param identifiers:
+            Rows of (name, medium, site, identifier), only removed if the
+            name is still cached with that identifier.
+        :type identifiers: Iterable[tuple]
+
+        :param mal_titles:
+            Rows of (MAL id, medium, MAL title), only removed if no name is
+            cached with that MAL id anymore.
+        :type mal_titles: Iterable[tuple]
+        """
+        pass
+
+    async def close(self):
+        """
+        Close the connections to the database.
+
+        The default implementation does nothing.
+        """
+        pass
+
+    def set_refresh_callback(self, callback: Optional[Callable]):
+        """
+        Set the function called with ``(id_, medium, site)`` when served
+        data is expired or about to expire, and should be refreshed.
+
+        :param callback: the function, or None to remove it.
+        """
+        self.refresh_callback = callback
+
+    def _check_fresh(self, id_: str, medium: Medium, site: Site,
+                     data: Optional[dict], cachetime: float) -> bool:
+        """
+        Check if cached data can be served, and ask for it to be refreshed
+        if it is expired or about to.
+
+        :param id_: the id.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+
+        :param data: the cached data.
+
+        :param cachetime: the unix time the data was cached.
+
+        :return: True if the data can be served.
+        """
+        ttl = self.ttl_policy.ttl(data, medium, site, cachetime)
+        age = time() - cachetime
+        if age > ttl + self.max_stale:
+            return False
+        # Expire early with a chance that grows exponentially towards the
+        # expiry, so hot entries cached together don't all expire together.
+        if age > ttl or (self.max_stale and self.early_refresh and
+                         age - self.early_refresh * log(1 - random()) >= ttl):
+            if self.refresh_callback:
+                self.refresh_callback(id_, medium, site)
+        return True
 
     async def pre_cache(self, session_manager: SessionManager):
         """
         Populate the lookup with synonyms.
 
+        Only the synonyms that changed since the revision imported last time
+        are imported, nothing is imported if the revision is current. The
+        synonyms removed since are removed with ``remove_synonyms``.
+
         :param session_manager: The Aiohttp SessionManager.
         """
-        rows = await get_all_synonyms(session_manager)
-        for name, type_, db_links in rows:
-            dict_ = loads(db_links)
-            mal_name, mal_id = dict_.get('mal', ('', ''))
-            anilist = dict_.get('ani')
-            ap = dict_.get('ap')
-            anidb = dict_.get('adb')
-            medium = convert_medium[type_]
-            if mal_name and mal_id:
-                await self.set_mal_title(str(mal_id), medium, str(mal_name))
-            await self.__precache_one(name, medium, Site.MAL, mal_id)
-            await self.__precache_one(name, medium, Site.ANILIST, anilist)
-            await self.__precache_one(name, medium, Site.ANIMEPLANET, ap)
-            await self.__precache_one(name, medium, Site.ANIDB, anidb)
-
-    async def __precache_one(self, name, medium, site, id_):
-        if name and (id_ or isinstance(id_, int)):
-            await self.set_identifier(str(name), medium, site, str(id_))
+        revision = await self.get_synonyms_revision()
+        current, rows, removed = await get_synonyms(session_manager, revision)
+        if removed:
+            await self.remove_synonyms(*parse_synonyms(removed))
+        identifiers, mal_titles = parse_synonyms(rows)
+        for id_, medium, title in mal_titles:
+            await self.set_mal_title(id_, medium, title)
+        await self.set_identifiers_bulk(identifiers)
+        if current is not None and current != revision:
+            await self.set_synonyms_revision(current)
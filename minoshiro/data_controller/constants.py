@@ -12,3 +12,6 @@ convert_medium = {
     'Manga': Medium.MANGA,
     'LN': Medium.LN
 }
+
+# The key in the meta table of the synonyms revision imported last time.
+synonyms_revision = 'synonyms_revision'
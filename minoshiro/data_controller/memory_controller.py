@@ -0,0 +1,550 @@
+"""
+An in-memory cache in front of another data controller.
+"""
+from collections import OrderedDict
+from json import dumps, loads
+from time import monotonic
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from aiohttp_wrapper import SessionManager
+
+from minoshiro.enums import Medium, Site
+from minoshiro.helpers import normalize_name
+from .abc import DataController
+
+__all__ = ['LRUCache', 'MemoryCachedController']
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A least recently used cache with expiring entries, bounded by both the
+    number of entries and their approximate size in bytes.
+
+    Values are stored as JSON, so every read returns a fresh copy.
+    """
+    __slots__ = ('max_entries', 'max_bytes', 'ttl', 'hits', 'misses',
+                 'evictions', 'size', '_entries', '_clock')
+
+    def __init__(self, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, ttl: float = 300,
+                 clock=monotonic):
+        """
+        :param max_entries: the max number of entries. Default is 10000.
+
+        :param max_bytes:
+            The max approximate size of all entries in bytes.
+            Default is 64 MiB.
+
+        :param ttl: the number of seconds an entry lives. Default is 300.
+
+        :param clock: a function that returns the current time in seconds.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._clock = clock
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get an entry, and mark it as recently used.
+
+        :param key: the key.
+
+        :param default: the value returned if the entry is not found.
+
+        :return: the value of the entry if found, else ``default``
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, _, value = entry
+            if expires > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return loads(value)
+            self.pop(key)
+        self.misses += 1
+        return default
+
+    def peek(self, key, default=None):
+        """
+        Get an entry without marking it as recently used, or counting it as
+        a hit or a miss.
+
+        :param key: the key.
+
+        :param default: the value returned if the entry is not found.
+
+        :return: the value of the entry if found, else ``default``
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            return default
+        return loads(entry[2])
+
+    def put(self, key, value):
+        """
+        Add or replace an entry, evicting the least recently used entries
+        if the cache is full.
+
+        :param key: the key.
+
+        :param value: the value, must be JSON serializable.
+        """
+        self.pop(key)
+        value = dumps(value)
+        size = len(value) + len(str(key))
+        if size > self.max_bytes:
+            return
+        self._entries[key] = self._clock() + self.ttl, size, value
+        self.size += size
+        while (len(self._entries) > self.max_entries or
+               self.size > self.max_bytes):
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def pop(self, key):
+        """
+        Remove an entry if it exists.
+
+        :param key: the key.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        """
+        :return:
+            A dict with the hit, miss and eviction counts, the number of
+            entries and their approximate size in bytes.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.size
+        }
+
+
+class MemoryCachedController(DataController):
+    """
+    Wraps any data controller with an in-memory LRU cache, which is
+    populated on reads and writes.
+    """
+    __slots__ = ('controller', 'cache')
+
+    def __init__(self, controller: DataController, **kwargs):
+        """
+        :param controller: the data controller to wrap.
+
+        :param kwargs: keyword arguments for `LRUCache`
+        """
+        self.controller = controller
+        self.cache = LRUCache(**kwargs)
+        super().__init__(controller.logger, miss_ttl=controller.miss_ttl)
+
+    def __getattr__(self, item):
+        return getattr(self.controller, item)
+
+    def stats(self) -> dict:
+        """
+        :return: the statistics of the cache, see `LRUCache.stats`
+        """
+        return self.cache.stats()
+
+    def set_refresh_callback(self, callback: Optional[Callable]):
+        """
+        Set the refresh callback of the wrapped controller.
+
+        :param callback: the function, or None to remove it.
+        """
+        self.controller.set_refresh_callback(callback)
+
+    async def close(self):
+        """
+        Close the wrapped controller.
+        """
+        await self.controller.close()
+
+    async def get_synonyms_revision(self) -> Optional[int]:
+        """
+        :return: the synonyms revision of the wrapped controller.
+        """
+        return await self.controller.get_synonyms_revision()
+
+    async def set_synonyms_revision(self, revision: int):
+        """
+        Set the synonyms revision of the wrapped controller.
+
+        :param revision: the revision.
+        """
+        await self.controller.set_synonyms_revision(revision)
+
+    async def remove_synonyms(self, identifiers: Iterable[tuple],
+                              mal_titles: Iterable[tuple]):
+        """
+        Remove synonyms from the wrapped controller, and clear the memory
+        cache.
+
+        :param identifiers: rows of (name, medium, site, identifier)
+
+        :param mal_titles: rows of (MAL id, medium, MAL title)
+        """
+        await self.controller.remove_synonyms(identifiers, mal_titles)
+        self.cache.clear()
+
+    async def get_identifier(self, query: str,
+                             medium: Medium) -> Optional[Dict[Site, str]]:
+        """
+        Get the identifier of a given search query.
+
+        :param query: the search query.
+
+        :param medium: the medium type.
+
+        :return:
+            A dict of all identifiers for this search query for all sites,
+            None if nothing is found.
+        """
+        key = _id_key(query, medium)
+        cached = self.cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return _load_ids(cached)
+        res = await self.controller.get_identifier(query, medium)
+        self.cache.put(key, _dump_ids(res))
+        return res
+
+    async def set_identifier(self, name: str, medium: Medium,
+                             site: Site, identifier: str):
+        """
+        Set the identifier for a given name.
+
+        :param name: the name.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+
+        :param identifier: the identifier.
+        """
+        await self.controller.set_identifier(name, medium, site, identifier)
+        self.__remember_identifier(name, medium, site, identifier)
+
+    async def set_identifiers_bulk(
+            self, rows: Iterable[Tuple[str, Medium, Site, str]]):
+        """
+        Set the identifiers for many names at once.
+
+        :param rows: (name, medium, site, identifier) tuples.
+        """
+        rows = list(rows)
+        await self.controller.set_identifiers_bulk(rows)
+        for row in rows:
+            self.__remember_identifier(*row)
+
+    def __remember_identifier(self, name: str, medium: Medium,
+                              site: Site, identifier: str):
+        """
+        Update the identifiers of a name if they are in memory.
+
+        :param name: the name.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+
+        :param identifier: the identifier.
+        """
+        key = _id_key(name, medium)
+        cached = self.cache.peek(key, _MISSING)
+        if cached is not _MISSING:
+            cached = cached or {}
+            cached[str(site.value)] = identifier
+            self.cache.put(key, cached)
+
+    async def get_mal_title(self, id_: str, medium: Medium) -> Optional[str]:
+        """
+        Get a MAL title by its id.
+
+        :param id_: th MAL id.
+
+        :param medium: the medium type.
+
+        :return: The MAL title if it's found.
+        """
+        key = 'mal', id_, medium.value
+        cached = self.cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        res = await self.controller.get_mal_title(id_, medium)
+        self.cache.put(key, res)
+        return res
+
+    async def set_mal_title(self, id_: str, medium: Medium, title: str):
+        """
+        Set the MAL title for a given id.
+
+        :param id_: the MAL id.
+
+        :param medium: The medium type.
+
+        :param title: The MAL title for the given id.
+        """
+        await self.controller.set_mal_title(id_, medium, title)
+        self.cache.put(('mal', id_, medium.value), title)
+
+    async def medium_data_by_id(self, id_: str, medium: Medium,
+                                site: Site) -> Optional[dict]:
+        """
+        Get data by id.
+
+        :param id_: the id.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+
+        :return: the data for that id if found.
+        """
+        key = _data_key(id_, medium, site)
+        cached = self.cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        res = await self.controller.medium_data_by_id(id_, medium, site)
+        self.cache.put(key, res)
+        return res
+
+    async def set_medium_data(self, id_: str, medium: Medium,
+                              site: Site, data: dict):
+        """
+        Set the data for a given id.
+
+        :param id_: the id.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+
+        :param data: the data for the id.
+        """
+        await self.controller.set_medium_data(id_, medium, site, data)
+        self.cache.put(_data_key(id_, medium, site), data)
+
+    async def set_medium_data_bulk(
+            self, rows: Iterable[Tuple[str, Medium, Site, dict]]):
+        """
+        Set the data for many ids at once.
+
+        :param rows: (id, medium, site, data) tuples.
+        """
+        rows = list(rows)
+        await self.controller.set_medium_data_bulk(rows)
+        for id_, medium, site, data in rows:
+            self.cache.put(_data_key(id_, medium, site), data)
+
+    async def resolve_cached_many(
+            self, queries: Iterable[str], medium: Medium
+    ) -> Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]]:
+        """
+        Get the cached data and identifiers for many search queries at once.
+
+        Queries with all their identifiers and data in memory are answered
+        from memory, the rest are read from the wrapped controller.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A dict of {query: (cached data, cached identifiers)}, queries
+            without any identifiers are not in the dict.
+        """
+        res, missed = self.__resolve_from_memory_many(queries, medium)
+        if missed:
+            found = await self.controller.resolve_cached_many(missed, medium)
+            res.update(self.__remember_cached(missed, medium, found))
+        return res
+
+    async def resolve_queries(
+            self, queries: Iterable[str], medium: Medium
+    ) -> Tuple[Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]],
+               Dict[str, Set[Site]]]:
+        """
+        Get everything cached for many search queries at once, the cached
+        data and identifiers, and the sites with no search results.
+
+        Misses are not kept in memory, they are read from the wrapped
+        controller along with the queries that are not in memory.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A tuple of the return values of ``resolve_cached_many`` and
+            ``get_misses``
+        """
+        queries = list(queries)
+        res, missed = self.__resolve_from_memory_many(queries, medium)
+        misses = {}
+        if missed:
+            found, misses = await self.controller.resolve_queries(
+                missed, medium
+            )
+            res.update(self.__remember_cached(missed, medium, found))
+        missed = set(missed)
+        resolved = [query for query in queries if query not in missed]
+        if resolved:
+            misses.update(
+                await self.controller.get_misses(resolved, medium)
+            )
+        return res, misses
+
+    async def get_misses(self, queries: Iterable[str],
+                         medium: Medium) -> Dict[str, Set[Site]]:
+        """
+        Get the sites that recently had no search results for the given
+        search queries.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A dict of {query: sites with no results}, queries without any
+            misses are not in the dict.
+        """
+        return await self.controller.get_misses(queries, medium)
+
+    async def set_miss(self, query: str, medium: Medium, site: Site):
+        """
+        Record that a site had no search results for a search query.
+
+        :param query: the search query.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+        """
+        await self.controller.set_miss(query, medium, site)
+
+    async def pre_cache(self, session_manager: SessionManager):
+        """
+        Populate the lookup with synonyms, and clear the memory cache.
+
+        :param session_manager: The Aiohttp SessionManager.
+        """
+        await self.controller.pre_cache(session_manager)
+        self.cache.clear()
+
+    def __resolve_from_memory_many(self, queries: Iterable[str],
+                                   medium: Medium) -> Tuple[dict, list]:
+        """
+        Get the cached data and identifiers for many search queries from
+        memory.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A tuple of ({query: (cached data, cached identifiers)}, queries
+            that are not in memory)
+        """
+        res = {}
+        missed = []
+        for query in queries:
+            cached = self.__resolve_from_memory(query, medium)
+            if cached is _MISSING:
+                missed.append(query)
+            elif cached:
+                res[query] = cached
+        return res, missed
+
+    def __remember_cached(self, queries: list, medium: Medium,
+                          found: dict) -> dict:
+        """
+        Keep the cached data and identifiers read from the wrapped
+        controller in memory.
+
+        :param queries: the search queries read.
+
+        :param medium: the medium type.
+
+        :param found: the return value of ``resolve_cached_many``
+
+        :return: ``found`` without the queries that have no identifiers.
+        """
+        res = {}
+        for query in queries:
+            data, id_dict = found.get(query, ({}, None))
+            self.cache.put(_id_key(query, medium), _dump_ids(id_dict))
+            for site, id_ in (id_dict or {}).items():
+                self.cache.put(_data_key(id_, medium, site), data.get(site))
+            if id_dict:
+                res[query] = data, id_dict
+        return res
+
+    def __resolve_from_memory(self, query: str, medium: Medium):
+        """
+        Get the cached data and identifiers for a search query from memory.
+
+        :param query: the search query.
+
+        :param medium: the medium type.
+
+        :return:
+            A tuple of (cached data, cached identifiers), None if the query
+            has no identifiers, ``_MISSING`` if anything is not in memory.
+        """
+        cached = self.cache.get(_id_key(query, medium), _MISSING)
+        if cached is _MISSING:
+            return _MISSING
+        if not cached:
+            return None
+        id_dict = _load_ids(cached)
+        data = {}
+        for site, id_ in id_dict.items():
+            site_data = self.cache.get(_data_key(id_, medium, site), _MISSING)
+            if site_data is _MISSING:
+                return _MISSING
+            if site_data:
+                data[site] = site_data
+        return data, id_dict
+
+
+def _id_key(query: str, medium: Medium) -> tuple:
+    return 'id', normalize_name(query), medium.value
+
+
+def _data_key(id_: str, medium: Medium, site: Site) -> tuple:
+    return 'data', id_, medium.value, site.value
+
+
+def _dump_ids(id_dict: Optional[Dict[Site, str]]) -> Optional[dict]:
+    return {str(site.value): id_ for site, id_ in id_dict.items()} \
+        if id_dict else None
+
+
+def _load_ids(cached: Optional[dict]) -> Optional[Dict[Site, str]]:
+    return {Site(int(site)): id_ for site, id_ in cached.items()} \
+        if cached else None
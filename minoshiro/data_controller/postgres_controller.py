@@ -1,6 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from json import dumps, loads
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional, Set, Tuple
 
 try:
     from asyncpg import InterfaceError, create_pool
@@ -12,10 +12,13 @@ except ImportError:
     create_pool = None
 
 from minoshiro.enums import Medium, Site
+from minoshiro.helpers import normalize_name
 from minoshiro.logger import get_default_logger
+from minoshiro.upstream import get_synonyms
 from .abc import DataController
-from .constants import tables
+from .constants import synonyms_revision, tables
 from .postgres_utils import make_tables, parse_record
+from .utils import parse_synonyms
 
 
 class PostgresController(DataController):
@@ -26,7 +29,8 @@ class PostgresController(DataController):
     """
     __slots__ = ('pool', 'schema')
 
-    def __init__(self, pool: Pool, logger, schema: str = 'minoshiro'):
+    def __init__(self, pool: Pool, logger, schema: str = 'minoshiro',
+                 **kwargs):
         """
         Init method. Create the instance with the `get_instance` method to make
         sure you have all the tables needed.
@@ -36,14 +40,17 @@ class PostgresController(DataController):
         :param logger: logger object used for logging.
 
         :param schema: the schema name, default is `minoshiro`
+
+        :param kwargs: keyword arguments for `DataController`
         """
         self.pool = pool
         self.schema = schema
-        super().__init__(logger)
+        super().__init__(logger, **kwargs)
 
     @classmethod
     async def get_instance(cls, logger=None, connect_kwargs: dict = None,
-                           pool: Pool = None, schema: str = 'minoshiro'):
+                           pool: Pool = None, schema: str = 'minoshiro',
+                           **kwargs):
         """
         Get a new instance of `PostgresController`
 
@@ -61,6 +68,8 @@ class PostgresController(DataController):
 
         :param schema: the schema name used. Defaults to `minoshiro`
 
+        :param kwargs: keyword arguments for `DataController`
+
         :return: a new instance of `PostgresController`
         """
         logger = logger or get_default_logger()
@@ -79,7 +88,173 @@ class PostgresController(DataController):
         logger.info('Creating tables...')
         await make_tables(pool, schema)
         logger.info('Tables created.')
-        return cls(pool, logger, schema)
+        return cls(pool, logger, schema, **kwargs)
+
+    async def pre_cache(self, session_manager):
+        """
+        Populate the lookup with synonyms.
+
+        The synonyms are copied into temporary staging tables, then merged
+        into the lookup and mal tables in one transaction. Only the synonyms
+        that changed since the revision imported last time are imported,
+        nothing is imported if the revision is current. The synonyms removed
+        since are removed in the same transaction.
+
+        :param session_manager: The Aiohttp SessionManager.
+        """
+        revision = await self.get_synonyms_revision()
+        current, rows, removed = await get_synonyms(session_manager, revision)
+        if not rows and not removed and current == revision:
+            return
+        identifiers, mal_titles = parse_synonyms(rows)
+        removed_identifiers, removed_titles = parse_synonyms(removed)
+        # One row per key, a merge can't update the same row twice.
+        lookup = {
+            (name, medium.value, site.value): id_
+            for name, medium, site, id_ in identifiers
+        }
+        mal = {(id_, medium.value): title
+               for id_, medium, title in mal_titles}
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                CREATE TEMP TABLE lookup_staging
+                (LIKE {0}.lookup) ON COMMIT DROP;
+                CREATE TEMP TABLE mal_staging
+                (LIKE {0}.mal) ON COMMIT DROP;
+                """.format(self.schema))
+                if removed:
+                    await self.__remove_synonyms(
+                        conn, removed_identifiers, removed_titles
+                    )
+                await conn.copy_records_to_table(
+                    'lookup_staging',
+                    records=((name, medium, site, id_, normalize_name(name))
+                             for (name, medium, site), id_ in lookup.items()),
+                    columns=('syname', 'medium', 'site', 'identifier',
+                             'norm_name')
+                )
+                await conn.copy_records_to_table(
+                    'mal_staging',
+                    records=((id_, medium, title)
+                             for (id_, medium), title in mal.items()),
+                    columns=('id', 'medium', 'title')
+                )
+                await conn.execute("""
+                INSERT INTO {}.lookup
+                (syname, medium, site, identifier, norm_name)
+                SELECT syname, medium, site, identifier, norm_name
+                FROM lookup_staging
+                ON CONFLICT (syname, medium, site) DO UPDATE
+                SET identifier=EXCLUDED.identifier,
+                norm_name=EXCLUDED.norm_name;
+                """.format(self.schema))
+                await conn.execute("""
+                INSERT INTO {}.mal (id, medium, title)
+                SELECT id, medium, title FROM mal_staging
+                ON CONFLICT (id, medium) DO UPDATE
+                SET title=EXCLUDED.title;
+                """.format(self.schema))
+                if current is not None:
+                    await conn.execute(
+                        self.__set_meta_sql(), synonyms_revision, str(current)
+                    )
+
+    async def remove_synonyms(self, identifiers: Iterable[tuple],
+                              mal_titles: Iterable[tuple]):
+        """
+        Remove the identifiers and MAL titles of synonyms that were removed
+        upstream, in one transaction.
+
+        :param identifiers: rows of (name, medium, site, identifier)
+
+        :param mal_titles: rows of (MAL id, medium, MAL title)
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await self.__remove_synonyms(conn, identifiers, mal_titles)
+
+    async def __remove_synonyms(self, conn, identifiers, mal_titles):
+        """
+        Remove synonyms through temporary tables, in the transaction of
+        the connection.
+
+        :param conn: the connection.
+
+        :param identifiers: rows of (name, medium, site, identifier)
+
+        :param mal_titles: rows of (MAL id, medium, MAL title)
+        """
+        await conn.execute("""
+        CREATE TEMP TABLE lookup_removed
+        (LIKE {0}.lookup) ON COMMIT DROP;
+        CREATE TEMP TABLE mal_removed
+        (LIKE {0}.mal) ON COMMIT DROP;
+        """.format(self.schema))
+        await conn.copy_records_to_table(
+            'lookup_removed',
+            records=((name, medium.value, site.value, id_)
+                     for name, medium, site, id_ in identifiers),
+            columns=('syname', 'medium', 'site', 'identifier')
+        )
+        await conn.copy_records_to_table(
+            'mal_removed',
+            records=((id_, medium.value, title)
+                     for id_, medium, title in mal_titles),
+            columns=('id', 'medium', 'title')
+        )
+        await conn.execute("""
+        DELETE FROM {}.lookup l USING lookup_removed r
+        WHERE l.syname=r.syname AND l.medium=r.medium AND l.site=r.site
+        AND l.identifier=r.identifier;
+        """.format(self.schema))
+        await conn.execute("""
+        DELETE FROM {0}.mal m USING mal_removed r
+        WHERE m.id=r.id AND m.medium=r.medium AND NOT EXISTS (
+          SELECT 1 FROM {0}.lookup l
+          WHERE l.site=$1 AND l.identifier=m.id AND l.medium=m.medium
+        );
+        """.format(self.schema), Site.MAL.value)
+
+    async def get_synonyms_revision(self) -> Optional[int]:
+        """
+        Get the revision of the upstream synonyms imported last time.
+
+        :return: the revision, None if it's not known.
+        """
+        sql = 'SELECT value FROM {}.meta WHERE key=$1;'.format(self.schema)
+        value = await self.pool.fetchval(sql, synonyms_revision)
+        return int(value) if value is not None else None
+
+    async def set_synonyms_revision(self, revision: int):
+        """
+        Record the revision of the upstream synonyms imported.
+
+        :param revision: the revision.
+        """
+        await self.pool.execute(
+            self.__set_meta_sql(), synonyms_revision, str(revision)
+        )
+
+    def __set_meta_sql(self) -> str:
+        """
+        :return: the SQL query to insert or update one meta row.
+        """
+        return """
+        INSERT INTO {}.meta VALUES ($1, $2)
+        ON CONFLICT (key) DO UPDATE SET value=$2;
+        """.format(self.schema)
+
+    async def __execute_many(self, statements: list):
+        """
+        Execute SQL queries for many rows in one transaction.
+
+        :param statements: a list of (SQL query, list of SQL parameters).
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for sql, params in statements:
+                    await conn.executemany(sql, params)
 
     def __get_table(self, medium: Medium) -> str:
         """
@@ -106,10 +281,10 @@ class PostgresController(DataController):
         """
         sql = """
         SELECT site, identifier FROM {}.lookup
-        WHERE LOWER(syname)=LOWER($1) AND medium=$2;
+        WHERE norm_name=$1 AND medium=$2;
         """.format(self.schema)
 
-        res = await self.pool.fetch(sql, query, medium.value)
+        res = await self.pool.fetch(sql, normalize_name(query), medium.value)
         if not res:
             return
         records = (parse_record(record) for record in res)
@@ -129,15 +304,36 @@ class PostgresController(DataController):
         :param identifier: the identifier.
         """
 
-        sql = """
-        INSERT INTO {}.lookup VALUES ($1, $2, $3, $4)
+        await self.pool.execute(
+            self.__set_identifier_sql(), name, medium.value, site.value,
+            identifier, normalize_name(name)
+        )
+
+    async def set_identifiers_bulk(
+            self, rows: Iterable[Tuple[str, Medium, Site, str]]):
+        """
+        Set the identifiers for many names in one transaction.
+
+        :param rows: (name, medium, site, identifier) tuples.
+        """
+        params = [
+            (name, medium.value, site.value, identifier, normalize_name(name))
+            for name, medium, site, identifier in rows
+        ]
+        if params:
+            await self.__execute_many([(self.__set_identifier_sql(), params)])
+
+    def __set_identifier_sql(self) -> str:
+        """
+        :return: the SQL query to insert or update one lookup row.
+        """
+        return """
+        INSERT INTO {}.lookup (syname, medium, site, identifier, norm_name)
+        VALUES ($1, $2, $3, $4, $5)
         ON CONFLICT (syname, medium, site)
-        DO UPDATE SET identifier=$4;
+        DO UPDATE SET identifier=$4, norm_name=$5;
         """.format(self.schema)
 
-        await self.pool.execute(sql, name, medium.value,
-                                site.value, identifier)
-
     async def get_mal_title(self, id_: str, medium: Medium) -> Optional[str]:
         """
         Get a MAL title by its id.
@@ -178,8 +374,9 @@ class PostgresController(DataController):
         """
         Get data by id.
 
-        Note that if the data cache is more than 1 day old this will delete
-        the row in the DB and return None.
+        Note that if the data cache is expired according to the TTL policy,
+        and past the ``max_stale`` seconds, this will delete the row in the
+        DB and return None.
 
         :param id_: the id.
 
@@ -196,8 +393,9 @@ class PostgresController(DataController):
         if not res:
             return
         data, cachetime = parse_record(res)
-        if (datetime.now() - cachetime).days < 1:
-            return loads(data) if data else None
+        data = loads(data) if data else None
+        if self._check_fresh(id_, medium, site, data, cachetime.timestamp()):
+            return data
         else:
             await self.delete_medium_data(id_, medium, site)
 
@@ -224,6 +422,26 @@ class PostgresController(DataController):
             sql, id_, site.value, dumps(data), datetime.now()
         )
 
+    async def set_medium_data_bulk(
+            self, rows: Iterable[Tuple[str, Medium, Site, dict]]):
+        """
+        Set the data for many ids in one transaction.
+
+        :param rows: (id, medium, site, data) tuples.
+        """
+        now = datetime.now()
+        params = {}
+        for id_, medium, site, data in rows:
+            params.setdefault(medium, []).append(
+                (id_, site.value, dumps(data), now)
+            )
+        await self.__execute_many([("""
+        INSERT INTO {} VALUES ($1, $2, $3, $4)
+        ON CONFLICT (id, site) DO UPDATE
+        SET dict=$3, cachetime=$4;
+        """.format(self.__get_table(medium)), lst)
+            for medium, lst in params.items()])
+
     async def delete_medium_data(self, id_: str, medium: Medium, site: Site):
         """
         Delete a row in medium data table.
@@ -242,3 +460,172 @@ class PostgresController(DataController):
             await self.pool.execute(sql, id_, site.value)
         except Exception as e:
             self.logger.warning(str(e))
+
+    async def resolve_cached_many(
+            self, queries: Iterable[str], medium: Medium
+    ) -> Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]]:
+        """
+        Get the cached data and identifiers for many search queries at once.
+
+        All queries are resolved with one query, data that can no longer be
+        served is left out of the result.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A dict of {query: (cached data, cached identifiers)}, queries
+            without any identifiers are not in the dict.
+        """
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return {}
+        sql = """
+        SELECT q.query, l.site, l.identifier, m.dict, m.cachetime
+        FROM unnest($1::VARCHAR[], $2::VARCHAR[]) AS q(query, norm)
+        JOIN {0}.lookup l
+        ON l.norm_name=q.norm AND l.medium=$3
+        LEFT JOIN {1} m
+        ON m.id=l.identifier AND m.site=l.site;
+        """.format(self.schema, self.__get_table(medium))
+        records = await self.pool.fetch(
+            sql, queries, [normalize_name(q) for q in queries], medium.value
+        )
+        return self.__parse_cached(map(parse_record, records), medium)
+
+    async def resolve_queries(
+            self, queries: Iterable[str], medium: Medium
+    ) -> Tuple[Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]],
+               Dict[str, Set[Site]]]:
+        """
+        Get everything cached for many search queries at once, the cached
+        data and identifiers, and the sites with no search results.
+
+        Both are read with one query.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A tuple of the return values of ``resolve_cached_many`` and
+            ``get_misses``
+        """
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return {}, {}
+        sql = """
+        SELECT q.query, l.site, l.identifier, m.dict, m.cachetime,
+        FALSE AS miss
+        FROM unnest($1::VARCHAR[], $2::VARCHAR[]) AS q(query, norm)
+        JOIN {0}.lookup l
+        ON l.norm_name=q.norm AND l.medium=$3
+        LEFT JOIN {1} m
+        ON m.id=l.identifier AND m.site=l.site
+        UNION ALL
+        SELECT q.query, x.site, NULL, NULL, NULL, TRUE
+        FROM unnest($1::VARCHAR[], $2::VARCHAR[]) AS q(query, norm)
+        JOIN {0}.miss x
+        ON x.query=q.norm AND x.medium=$3 AND x.cachetime>=$4;
+        """.format(self.schema, self.__get_table(medium))
+        since = datetime.now() - timedelta(seconds=self.miss_ttl)
+        records = await self.pool.fetch(
+            sql, queries, [normalize_name(q) for q in queries], medium.value,
+            since
+        )
+        rows, misses = [], {}
+        for *row, miss in map(parse_record, records):
+            if miss:
+                misses.setdefault(row[0], set()).add(Site(row[1]))
+            else:
+                rows.append(row)
+        return self.__parse_cached(rows, medium), misses
+
+    def __parse_cached(self, rows, medium: Medium) -> dict:
+        """
+        Parse the lookup rows joined with the medium data, data that can no
+        longer be served is left out.
+
+        :param rows: (query, site, identifier, data, cachetime) rows.
+
+        :param medium: the medium type.
+
+        :return: A dict of {query: (cached data, cached identifiers)}
+        """
+        res = {}
+        for query, site, id_, data, cachetime in rows:
+            if not id_:
+                continue
+            site = Site(site)
+            cached_data, id_dict = res.setdefault(query, ({}, {}))
+            id_dict[site] = id_
+            data = loads(data) if data else None
+            if data and self._check_fresh(
+                    id_, medium, site, data, cachetime.timestamp()):
+                cached_data[site] = data
+        return res
+
+    async def get_misses(self, queries: Iterable[str],
+                         medium: Medium) -> Dict[str, Set[Site]]:
+        """
+        Get the sites that recently had no search results for the given
+        search queries.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A dict of {query: sites with no results}, queries without any
+            misses are not in the dict.
+        """
+        normalized = {}
+        for query in queries:
+            normalized.setdefault(normalize_name(query), []).append(query)
+        if not normalized:
+            return {}
+        sql = """
+        SELECT query, site FROM {}.miss
+        WHERE medium=$1 AND cachetime>=$2
+        AND query = ANY($3::VARCHAR[]);
+        """.format(self.schema)
+        since = datetime.now() - timedelta(seconds=self.miss_ttl)
+        records = await self.pool.fetch(
+            sql, medium.value, since, list(normalized)
+        )
+        res = {}
+        for norm, site in map(parse_record, records):
+            for query in normalized[norm]:
+                res.setdefault(query, set()).add(Site(site))
+        return res
+
+    async def set_miss(self, query: str, medium: Medium, site: Site):
+        """
+        Record that a site had no search results for a search query, and
+        delete the misses that expired.
+
+        :param query: the search query.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+        """
+        delete = """
+        DELETE FROM {}.miss WHERE cachetime<$1;
+        """.format(self.schema)
+        sql = """
+        INSERT INTO {}.miss VALUES ($1, $2, $3, $4)
+        ON CONFLICT (query, medium, site)
+        DO UPDATE SET cachetime=$4;
+        """.format(self.schema)
+        now = datetime.now()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    delete, now - timedelta(seconds=self.miss_ttl)
+                )
+                await conn.execute(
+                    sql, normalize_name(query), medium.value, site.value,
+                    now
+                )
@@ -4,6 +4,8 @@ Database utility functions.
 
 from typing import Optional
 
+from minoshiro.helpers import normalize_name
+
 try:
     from asyncpg import Record
     from asyncpg.pool import Pool
@@ -43,6 +45,7 @@ async def make_tables(pool: Pool, schema: str):
       medium SMALLINT,
       site SMALLINT,
       identifier VARCHAR NOT NULL,
+      norm_name VARCHAR,
       PRIMARY KEY (syname, medium, site)
     );""".format(schema)
 
@@ -55,6 +58,23 @@ async def make_tables(pool: Pool, schema: str):
     );
     """.format(schema)
 
+    miss = """
+    CREATE TABLE IF NOT EXISTS {}.miss (
+      query VARCHAR,
+      medium SMALLINT,
+      site SMALLINT,
+      cachetime TIMESTAMP,
+      PRIMARY KEY (query, medium, site)
+    );
+    """.format(schema)
+
+    meta = """
+    CREATE TABLE IF NOT EXISTS {}.meta (
+      key VARCHAR PRIMARY KEY,
+      value VARCHAR
+    );
+    """.format(schema)
+
     tables = """
     CREATE TABLE IF NOT EXISTS {} (
       id VARCHAR,
@@ -65,6 +85,53 @@ async def make_tables(pool: Pool, schema: str):
     )
     """
     await pool.execute(lookup)
+    await __migrate_lookup(pool, schema)
     await pool.execute(mal)
+    await pool.execute(miss)
+    await pool.execute(
+        'CREATE INDEX IF NOT EXISTS miss_cachetime '
+        'ON {}.miss (cachetime);'.format(schema)
+    )
+    await pool.execute(meta)
     for name in ('anime', 'manga', 'ln', 'vn'):
         await pool.execute(tables.format(f'{schema}.{name}'))
+
+
+async def __migrate_lookup(pool: Pool, schema: str):
+    """
+    Add the normalized name column and its index to a lookup table made
+    before it existed, and fill in the normalized names.
+
+    The names are only filled in when the column is added, so later starts
+    don't scan the table.
+
+    :param pool: the connection pool.
+
+    :param schema: the schema name.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            exists = await conn.fetchval("""
+            SELECT EXISTS (
+              SELECT 1 FROM information_schema.columns
+              WHERE table_schema=$1 AND table_name='lookup'
+              AND column_name='norm_name'
+            );""", schema)
+            if not exists:
+                await conn.execute(
+                    'ALTER TABLE {}.lookup ADD COLUMN norm_name VARCHAR;'
+                    .format(schema)
+                )
+                records = await conn.fetch(
+                    'SELECT DISTINCT syname FROM {}.lookup;'.format(schema)
+                )
+                await conn.executemany(
+                    'UPDATE {}.lookup SET norm_name=$2 WHERE syname=$1;'
+                    .format(schema),
+                    [(r['syname'], normalize_name(r['syname']))
+                     for r in records]
+                )
+    await pool.execute(
+        'CREATE INDEX IF NOT EXISTS lookup_norm_name '
+        'ON {}.lookup (norm_name, medium);'.format(schema)
+    )
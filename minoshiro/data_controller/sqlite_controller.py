@@ -1,25 +1,48 @@
 from asyncio import get_event_loop
 from json import dumps, loads
 from pathlib import Path
-from sqlite3 import connect
 from time import time
-from typing import Dict, Optional, Union
+from typing import Dict, Iterable, Optional, Set, Tuple, Union
 
 from minoshiro.enums import Medium, Site
+from minoshiro.helpers import normalize_name
 from minoshiro.logger import get_default_logger
-from minoshiro.upstream import get_all_synonyms
+from minoshiro.upstream import get_synonyms, get_synonyms_paths
 from .abc import DataController
-from .constants import convert_medium, tables
-from .sqlite_utils import make_tables
+from .constants import synonyms_revision, tables
+from .sqlite_engine import SqliteEngine
+from .sqlite_utils import import_synonyms, make_tables
+from .utils import parse_synonyms
+
+# Keep well below SQLite's limit on the number of variables in a statement.
+_MAX_VARIABLES = 500
+
+_SET_IDENTIFIER = """
+REPLACE INTO lookup (syname, medium, site, identifier, norm_name)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+_REMOVE_IDENTIFIER = """
+DELETE FROM lookup WHERE syname=? AND medium=? AND site=? AND identifier=?
+"""
+
+_REMOVE_MAL_TITLE = """
+DELETE FROM mal WHERE id=? AND medium=? AND NOT EXISTS (
+  SELECT 1 FROM lookup
+  WHERE site=? AND identifier=mal.id AND medium=mal.medium
+)
+"""
 
 
 class SqliteController(DataController):
     """
     A SQLite3 data controller.
     """
-    __slots__ = ('path', '_loop')
+    __slots__ = ('path', '_loop', 'engine', 'attach_synonyms')
 
-    def __init__(self, path: Union[str, Path], logger, loop=None):
+    def __init__(self, path: Union[str, Path], logger, loop=None, *,
+                 pragmas: dict = None, readers: int = 4,
+                 attach_synonyms: bool = False, **kwargs):
         """
         Init method. Create the instance with the `get_instance` method to make
         sure you have all the tables needed.
@@ -33,14 +56,31 @@ class SqliteController(DataController):
         :param loop:
             The asyncio event loop.
             If None is provided will use the default event loop.
+
+        :param pragmas:
+            A dict of {pragma: value} set on every connection when it opens.
+            Default is `sqlite_engine.DEFAULT_PRAGMAS`, which turns on WAL.
+
+        :param readers: The number of reader connections. Default is 4.
+
+        :param attach_synonyms:
+            If True, `pre_cache` attaches the upstream sqlite db of synonyms
+            and populates the lookup with it in SQL, instead of reading
+            every synonym into Python. Default is False.
+
+        :param kwargs: keyword arguments for `DataController`
         """
         self.path = str(path)
         self._loop = loop
-        super().__init__(logger)
+        self.attach_synonyms = attach_synonyms
+        self.engine = SqliteEngine(
+            self.path, pragmas=pragmas, readers=readers, loop=loop
+        )
+        super().__init__(logger, **kwargs)
 
     @classmethod
     async def get_instance(cls, path: Union[str, Path], logger=None,
-                           loop=None):
+                           loop=None, **kwargs):
         """
         Get a new instance of `SqliteController`
 
@@ -56,13 +96,15 @@ class SqliteController(DataController):
             The asyncio event loop.
             If None is provided will use the default event loop.
 
+        :param kwargs: keyword arguments for `SqliteController`
+
         :return: A new instance of `SqliteController`
         """
         logger = logger or get_default_logger()
         logger.info('Creating tables...')
         await make_tables(path, loop or get_event_loop())
         logger.info('Tables created.')
-        return cls(path, logger, loop)
+        return cls(path, logger, loop, **kwargs)
 
     async def get_identifier(self, query: str,
                              medium: Medium) -> Optional[Dict[Site, str]]:
@@ -79,9 +121,9 @@ class SqliteController(DataController):
         """
         sql = """
         SELECT site, identifier FROM lookup
-        WHERE LOWER(syname)=LOWER(?) AND medium=?
+        WHERE norm_name=? AND medium=?
         """
-        rows = await self.fetchall(sql, (query, medium.value))
+        rows = await self.fetchall(sql, (normalize_name(query), medium.value))
         if not rows:
             return
         return {Site(site): id_ for site, id_ in rows if id_}
@@ -99,8 +141,35 @@ class SqliteController(DataController):
 
         :param identifier: the identifier.
         """
-        sql = 'REPLACE INTO lookup VALUES (?,?,?,?)'
-        await self.execute(sql, (name, medium.value, site.value, identifier))
+        await self.execute(_SET_IDENTIFIER, (
+            name, medium.value, site.value, identifier, normalize_name(name)
+        ))
+
+    async def set_identifiers_bulk(
+            self, rows: Iterable[Tuple[str, Medium, Site, str]]):
+        """
+        Set the identifiers for many names in one transaction.
+
+        :param rows: (name, medium, site, identifier) tuples.
+        """
+        params = [
+            (name, medium.value, site.value, identifier, normalize_name(name))
+            for name, medium, site, identifier in rows
+        ]
+        if params:
+            await self.execute_many([(_SET_IDENTIFIER, params)])
+
+    async def remove_synonyms(self, identifiers: Iterable[tuple],
+                              mal_titles: Iterable[tuple]):
+        """
+        Remove the identifiers and MAL titles of synonyms that were removed
+        upstream, in one transaction.
+
+        :param identifiers: rows of (name, medium, site, identifier)
+
+        :param mal_titles: rows of (MAL id, medium, MAL title)
+        """
+        await self.execute_many(_remove_synonyms(identifiers, mal_titles))
 
     async def get_mal_title(self, id_: str, medium: Medium) -> Optional[str]:
         """
@@ -136,8 +205,9 @@ class SqliteController(DataController):
         """
         Get data by id.
 
-        Note that if the data cache is more than 1 day old this will delete
-        the row in the DB and return None.
+        Note that if the data cache is expired according to the TTL policy,
+        and past the ``max_stale`` seconds, this will delete the row in the
+        DB and return None.
 
         :param id_: the id.
 
@@ -153,11 +223,11 @@ class SqliteController(DataController):
         if not row:
             return
         data, cachetime = row
-        now = int(time())
-        if now - cachetime > 86400:
+        data = loads(data) if data else None
+        if not self._check_fresh(id_, medium, site, data, cachetime):
             await self.delete_medium_data(id_, medium, site)
             return
-        return loads(data) if data else None
+        return data
 
     async def set_medium_data(self, id_: str, medium: Medium,
                               site: Site, data: dict):
@@ -175,6 +245,25 @@ class SqliteController(DataController):
         sql = f'REPLACE INTO {tables[medium]} VALUES (?, ?, ?, ?)'
         await self.execute(sql, (id_, site.value, dumps(data), int(time())))
 
+    async def set_medium_data_bulk(
+            self, rows: Iterable[Tuple[str, Medium, Site, dict]]):
+        """
+        Set the data for many ids in one transaction.
+
+        :param rows: (id, medium, site, data) tuples.
+        """
+        now = int(time())
+        params = {}
+        for id_, medium, site, data in rows:
+            params.setdefault(medium, []).append(
+                (id_, site.value, dumps(data), now)
+            )
+        if params:
+            await self.execute_many([
+                (f'REPLACE INTO {tables[medium]} VALUES (?, ?, ?, ?)', lst)
+                for medium, lst in params.items()
+            ])
+
     async def delete_medium_data(self, id_: str, medium: Medium, site: Site):
         """
         Delete a row in medium data table.
@@ -191,28 +280,274 @@ class SqliteController(DataController):
         except Exception as e:
             self.logger.warning(str(e))
 
+    async def resolve_cached_many(
+            self, queries: Iterable[str], medium: Medium
+    ) -> Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]]:
+        """
+        Get the cached data and identifiers for many search queries at once.
+
+        All queries are resolved on one connection, data that can no longer
+        be served is left out of the result.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A dict of {query: (cached data, cached identifiers)}, queries
+            without any identifiers are not in the dict.
+        """
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return {}
+        rows = await self.engine.read(self.__resolve_many, queries, medium)
+        return self.__parse_cached(rows, medium)
+
+    async def resolve_queries(
+            self, queries: Iterable[str], medium: Medium
+    ) -> Tuple[Dict[str, Tuple[Dict[Site, dict], Dict[Site, str]]],
+               Dict[str, Set[Site]]]:
+        """
+        Get everything cached for many search queries at once, the cached
+        data and identifiers, and the sites with no search results.
+
+        Both are read on one connection in one read.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A tuple of the return values of ``resolve_cached_many`` and
+            ``get_misses``
+        """
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return {}, {}
+        normalized = _normalize(queries)
+        rows, misses = await self.engine.read(
+            self.__resolve_queries, queries, list(normalized), medium,
+            int(time()) - self.miss_ttl
+        )
+        return (self.__parse_cached(rows, medium),
+                _parse_misses(misses, normalized))
+
+    @staticmethod
+    def __resolve_queries(conn, queries: list, normalized: list,
+                          medium: Medium, since: int) -> tuple:
+        """
+        Fetch the lookup rows joined with the medium data, and the misses
+        recorded after a point in time, for many queries.
+
+        :param conn: the connection.
+
+        :param queries: the search queries.
+
+        :param normalized: the normalized search queries.
+
+        :param medium: the medium type.
+
+        :param since: the unix time to fetch misses from.
+
+        :return: a tuple of (lookup rows, miss rows)
+        """
+        return (SqliteController.__resolve_many(conn, queries, medium),
+                SqliteController.__fetch_misses(
+                    conn, normalized, medium, since
+                ))
+
+    def __parse_cached(self, rows: list, medium: Medium) -> dict:
+        """
+        Parse the lookup rows joined with the medium data, data that can no
+        longer be served is left out.
+
+        :param rows: (query, site, identifier, data, cachetime) rows.
+
+        :param medium: the medium type.
+
+        :return: A dict of {query: (cached data, cached identifiers)}
+        """
+        res = {}
+        for query, site, id_, data, cachetime in rows:
+            if not id_:
+                continue
+            site = Site(site)
+            cached_data, id_dict = res.setdefault(query, ({}, {}))
+            id_dict[site] = id_
+            data = loads(data) if data else None
+            if data and self._check_fresh(id_, medium, site, data, cachetime):
+                cached_data[site] = data
+        return res
+
+    @staticmethod
+    def __resolve_many(conn, queries: list, medium: Medium) -> list:
+        """
+        Fetch the lookup rows joined with the medium data for many queries.
+
+        :param conn: the connection.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A list of (query, site, identifier, data, cachetime) rows.
+        """
+        rows = []
+        size = _MAX_VARIABLES // 2
+        for i in range(0, len(queries), size):
+            chunk = queries[i:i + size]
+            sql = f"""
+            WITH q(query, norm) AS (VALUES {','.join('(?,?)' for _ in chunk)})
+            SELECT q.query, l.site, l.identifier, m.dict, m.cachetime
+            FROM q JOIN lookup l
+            ON l.norm_name=q.norm AND l.medium=?
+            LEFT JOIN {tables[medium]} m
+            ON m.id=l.identifier AND m.site=l.site
+            """
+            params = [v for q in chunk for v in (q, normalize_name(q))]
+            rows.extend(conn.execute(sql, (*params, medium.value)))
+        return rows
+
+    async def get_misses(self, queries: Iterable[str],
+                         medium: Medium) -> Dict[str, Set[Site]]:
+        """
+        Get the sites that recently had no search results for the given
+        search queries.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :return:
+            A dict of {query: sites with no results}, queries without any
+            misses are not in the dict.
+        """
+        normalized = _normalize(queries)
+        if not normalized:
+            return {}
+        rows = await self.engine.read(
+            self.__fetch_misses, list(normalized), medium,
+            int(time()) - self.miss_ttl
+        )
+        return _parse_misses(rows, normalized)
+
+    @staticmethod
+    def __fetch_misses(conn, queries: list, medium: Medium,
+                       since: int) -> list:
+        """
+        Fetch the misses recorded after a point in time.
+
+        :param conn: the connection.
+
+        :param queries: the normalized search queries.
+
+        :param medium: the medium type.
+
+        :param since: the unix time to fetch misses from.
+
+        :return: A list of (query, site) rows.
+        """
+        rows = []
+        for i in range(0, len(queries), _MAX_VARIABLES):
+            chunk = queries[i:i + _MAX_VARIABLES]
+            sql = f"""
+            SELECT query, site FROM miss
+            WHERE medium=? AND cachetime>=?
+            AND query IN ({','.join('?' for _ in chunk)})
+            """
+            rows.extend(conn.execute(sql, (medium.value, since, *chunk)))
+        return rows
+
+    async def set_miss(self, query: str, medium: Medium, site: Site):
+        """
+        Record that a site had no search results for a search query, and
+        delete the misses that expired.
+
+        :param query: the search query.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+        """
+        await self.engine.write(
+            self.__set_miss, normalize_name(query), medium, site,
+            int(time()), self.miss_ttl
+        )
+
+    @staticmethod
+    def __set_miss(conn, query: str, medium: Medium, site: Site,
+                   now: int, ttl: int):
+        """
+        Record a miss and delete the misses that expired.
+
+        :param conn: the connection.
+
+        :param query: the normalized search query.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+
+        :param now: the unix time now.
+
+        :param ttl: the number of seconds a miss lives.
+        """
+        conn.execute('DELETE FROM miss WHERE cachetime<?', (now - ttl,))
+        conn.execute(
+            'REPLACE INTO miss VALUES (?, ?, ?, ?)',
+            (query, medium.value, site.value, now)
+        )
+
     async def pre_cache(self, session_manager):
         """
         Populate the lookup with synonyms.
 
+        Only the synonyms that changed since the revision imported last time
+        are imported, nothing is imported if the revision is current.
+
         :param session_manager: The Aiohttp SessionManager.
         """
-        rows = await get_all_synonyms(session_manager)
-        with connect(self.path) as conn:
-            for name, type_, db_links in rows:
-                dict_ = loads(db_links)
-                mal_name, mal_id = dict_.get('mal', ('', ''))
-                anilist = dict_.get('ani')
-                ap = dict_.get('ap')
-                anidb = dict_.get('adb')
-                medium = convert_medium[type_]
-                if mal_name and mal_id:
-                    _cache_mal(conn, str(mal_id), medium, str(mal_name))
-                _precache(conn, name, medium, Site.MAL, mal_id)
-                _precache(conn, name, medium, Site.ANILIST, anilist)
-                _precache(conn, name, medium, Site.ANIMEPLANET, ap)
-                _precache(conn, name, medium, Site.ANIDB, anidb)
-            conn.commit()
+        revision = await self.get_synonyms_revision()
+        if self.attach_synonyms:
+            current, path, previous = await get_synonyms_paths(
+                session_manager, revision
+            )
+            if path is not None:
+                await self.loop.run_in_executor(
+                    None, import_synonyms, self.path, path, previous, current
+                )
+            return
+        current, rows, removed = await get_synonyms(session_manager, revision)
+        if rows or removed or current != revision:
+            await self.engine.write(_pre_cache, rows, removed, current)
+
+    async def get_synonyms_revision(self) -> Optional[int]:
+        """
+        Get the revision of the upstream synonyms imported last time.
+
+        :return: the revision, None if it's not known.
+        """
+        row = await self.fetchone(
+            'SELECT value FROM meta WHERE key=?', (synonyms_revision,)
+        )
+        return int(row[0]) if row else None
+
+    async def set_synonyms_revision(self, revision: int):
+        """
+        Record the revision of the upstream synonyms imported.
+
+        :param revision: the revision.
+        """
+        await self.execute(
+            'REPLACE INTO meta VALUES (?, ?)', (synonyms_revision, revision)
+        )
+
+    async def close(self):
+        """
+        Finish the queued writes and close all connections.
+        """
+        await self.engine.close()
 
     @property
     def loop(self):
@@ -221,34 +556,57 @@ class SqliteController(DataController):
         """
         return self._loop or get_event_loop()
 
-    def __execute(self, sql: str, params=None):
+    @staticmethod
+    def __execute(conn, sql: str, params=None):
         """
-        Execute and commit and SQL query.
+        Execute an SQL query.
+
+        :param conn: the connection.
 
         :param sql: the SQL query.
 
         :param params: the SQL parameters.
         """
-        with connect(self.path) as conn:
-            conn.execute(sql, params)
-            conn.commit()
+        conn.execute(sql, params or ())
 
     async def execute(self, sql: str, params=None):
         """
-        Run `self.__execute` using an asyncio event loop.
+        Run `self.__execute` on the writer connection.
 
         :param sql: the SQL query.
 
         :param params: the SQL parameters.
         """
-        await self.loop.run_in_executor(
-            None, self.__execute, sql, params
-        )
+        await self.engine.write(self.__execute, sql, params)
 
-    def __fetch(self, all_: bool, sql: str, params=None):
+    @staticmethod
+    def __execute_many(conn, statements: list):
+        """
+        Execute SQL queries for many rows.
+
+        :param conn: the connection.
+
+        :param statements: a list of (SQL query, list of SQL parameters).
+        """
+        for sql, params in statements:
+            conn.executemany(sql, params)
+
+    async def execute_many(self, statements: list):
+        """
+        Run `self.__execute_many` on the writer connection, the statements
+        are written in one transaction.
+
+        :param statements: a list of (SQL query, list of SQL parameters).
+        """
+        await self.engine.write(self.__execute_many, statements)
+
+    @staticmethod
+    def __fetch(conn, all_: bool, sql: str, params=None):
         """
         Fetch results from a SQL query.
 
+        :param conn: the connection.
+
         :param all_: True to fetch all rows, False to fetch one row.
 
         :param sql: the SQL query.
@@ -257,16 +615,15 @@ class SqliteController(DataController):
 
         :return: The results fetched from the SQL query.
         """
-        with connect(self.path) as conn:
-            cur = conn.execute(sql, params)
-            if all_:
-                return cur.fetchall()
-            else:
-                return cur.fetchone()
+        cur = conn.execute(sql, params or ())
+        if all_:
+            return cur.fetchall()
+        else:
+            return cur.fetchone()
 
     async def fetchall(self, sql: str, params=None):
         """
-        Run `self.__fetch` using an asyncio event loop.
+        Run `self.__fetch` on a reader connection.
 
         :param sql: the SQL query.
 
@@ -274,13 +631,11 @@ class SqliteController(DataController):
 
         :return: All rows fetched from the SQL query.
         """
-        return await self.loop.run_in_executor(
-            None, self.__fetch, True, sql, params
-        )
+        return await self.engine.read(self.__fetch, True, sql, params)
 
     async def fetchone(self, sql: str, params=None):
         """
-        Run `self.__fetch` using an asyncio event loop.
+        Run `self.__fetch` on a reader connection.
 
         :param sql: the SQL query.
 
@@ -288,25 +643,80 @@ class SqliteController(DataController):
 
         :return: One row fetched from the SQL query.
         """
-        return await self.loop.run_in_executor(
-            None, self.__fetch, False, sql, params
-        )
+        return await self.engine.read(self.__fetch, False, sql, params)
 
 
-def _precache(conn, name, medium, site, id_):
+def _normalize(queries: Iterable[str]) -> Dict[str, list]:
     """
-    Cache id.
+    Group search queries by their normalized name.
+
+    :param queries: the search queries.
+
+    :return: A dict of {normalized name: queries}
     """
-    if name and (id_ or isinstance(id_, int)):
-        sql = 'REPLACE INTO lookup VALUES (?,?,?,?)'
-        conn.execute(
-            sql, (str(name), medium.value, site.value, str(id_))
-        )
+    normalized = {}
+    for query in queries:
+        normalized.setdefault(normalize_name(query), []).append(query)
+    return normalized
 
 
-def _cache_mal(conn, id_: str, medium: Medium, title: str):
+def _parse_misses(rows, normalized: Dict[str, list]) -> Dict[str, Set[Site]]:
     """
-    Cache mal title.
+    Parse the miss rows of normalized queries.
+
+    :param rows: (normalized query, site) rows.
+
+    :param normalized: A dict of {normalized name: queries}
+
+    :return: A dict of {query: sites with no results}
     """
-    sql = 'REPLACE INTO mal VALUES (?, ?, ?)'
-    conn.execute(sql, (id_, medium.value, title))
+    res = {}
+    for norm, site in rows:
+        for query in normalized[norm]:
+            res.setdefault(query, set()).add(Site(site))
+    return res
+
+
+def _remove_synonyms(identifiers: Iterable[tuple],
+                     mal_titles: Iterable[tuple]) -> list:
+    """
+    Make the statements that remove synonyms.
+
+    :param identifiers: rows of (name, medium, site, identifier)
+
+    :param mal_titles: rows of (MAL id, medium, MAL title)
+
+    :return: a list of (sql, params)
+    """
+    return [
+        (_REMOVE_IDENTIFIER, [
+            (name, medium.value, site.value, id_)
+            for name, medium, site, id_ in identifiers
+        ]),
+        (_REMOVE_MAL_TITLE, [
+            (id_, medium.value, Site.MAL.value)
+            for id_, medium, _ in mal_titles
+        ])
+    ]
+
+
+def _pre_cache(conn, rows, removed, revision):
+    """
+    Remove the ids and mal titles from the removed synonym rows, cache the
+    ids and mal titles from the synonym rows, and record the revision they
+    are from.
+    """
+    for sql, params in _remove_synonyms(*parse_synonyms(removed)):
+        conn.executemany(sql, params)
+    identifiers, mal_titles = parse_synonyms(rows)
+    conn.executemany(_SET_IDENTIFIER, (
+        (name, medium.value, site.value, id_, normalize_name(name))
+        for name, medium, site, id_ in identifiers
+    ))
+    conn.executemany('REPLACE INTO mal VALUES (?, ?, ?)', (
+        (id_, medium.value, title) for id_, medium, title in mal_titles
+    ))
+    if revision is not None:
+        conn.execute(
+            'REPLACE INTO meta VALUES (?, ?)', (synonyms_revision, revision)
+        )
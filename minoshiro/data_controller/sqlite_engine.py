@@ -0,0 +1,254 @@
+"""
+Long lived SQLite3 connections for the SQLite data controller.
+"""
+from asyncio import get_event_loop
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from sqlite3 import connect
+from threading import Lock, Thread, local
+
+__all__ = ['SqliteEngine', 'DEFAULT_PRAGMAS']
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,
+}
+
+_STOP = object()
+
+
+class SqliteEngine:
+    """
+    Run SQLite3 queries on long lived connections.
+
+    Writes are queued to one writer connection on its own thread, which runs
+    everything queued so far in one transaction. Reads run on a small pool
+    of reader threads with one connection each.
+    """
+    __slots__ = ('path', 'pragmas', 'max_batch', '_loop', '__writes',
+                 '__writer', '__readers', '__reader_count', '__local',
+                 '__connections', '__lock', '__error')
+
+    def __init__(self, path: str, *, pragmas: dict = None, readers: int = 4,
+                 max_batch: int = 100, loop=None):
+        """
+        :param path: Path to the database.
+
+        :param pragmas:
+            A dict of {pragma: value} set on every connection when it opens.
+            Default is `DEFAULT_PRAGMAS`.
+
+        :param readers: The number of reader connections. Default is 4.
+
+        :param max_batch:
+            The max number of queued writes to run in one transaction.
+            Default is 100.
+
+        :param loop:
+            The asyncio event loop.
+            If None is provided will use the default event loop.
+        """
+        assert readers > 0, 'Param `readers` must be positive.'
+        assert max_batch > 0, 'Param `max_batch` must be positive.'
+        self.path = path
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.max_batch = max_batch
+        self._loop = loop
+        self.__writes = Queue()
+        self.__writer = None
+        self.__readers = None
+        self.__reader_count = readers
+        self.__local = local()
+        self.__connections = []
+        self.__lock = Lock()
+        self.__error = None
+
+    @property
+    def loop(self):
+        """
+        :return: `self._loop` or a default event loop.
+        """
+        return self._loop or get_event_loop()
+
+    async def write(self, func, *args):
+        """
+        Run ``func(connection, *args)`` on the writer connection, inside a
+        transaction shared with the other queued writes.
+
+        If ``func`` raises, only its own changes are rolled back.
+
+        :param func: the function to run.
+
+        :param args: the arguments for the function.
+
+        :return: the return value of the function.
+
+        :raises Exception:
+            the error raised opening the writer connection, if it failed.
+        """
+        fut = self.loop.create_future()
+        with self.__lock:
+            if self.__error is not None:
+                raise self.__error
+            if self.__writer is None:
+                self.__writer = Thread(
+                    target=self.__write_loop, name='minoshiro-sqlite-writer',
+                    daemon=True
+                )
+                self.__writer.start()
+            self.__writes.put((fut, func, args))
+        return await fut
+
+    async def read(self, func, *args):
+        """
+        Run ``func(connection, *args)`` on a reader connection.
+
+        :param func: the function to run.
+
+        :param args: the arguments for the function.
+
+        :return: the return value of the function.
+        """
+        with self.__lock:
+            if self.__readers is None:
+                self.__readers = ThreadPoolExecutor(
+                    self.__reader_count, 'minoshiro-sqlite-reader'
+                )
+        return await self.loop.run_in_executor(
+            self.__readers, self.__read, func, args
+        )
+
+    async def close(self):
+        """
+        Finish the queued writes and close all connections.
+        """
+        with self.__lock:
+            writer, self.__writer = self.__writer, None
+            readers, self.__readers = self.__readers, None
+        if writer:
+            self.__writes.put(_STOP)
+            await self.loop.run_in_executor(None, writer.join)
+        if readers:
+            await self.loop.run_in_executor(None, readers.shutdown)
+        with self.__lock:
+            connections, self.__connections = self.__connections, []
+        for conn in connections:
+            conn.close()
+        self.__local = local()
+
+    def __connect(self):
+        """
+        Open a connection and set the pragmas on it.
+
+        :return: the connection.
+        """
+        conn = connect(self.path, isolation_level=None,
+                       check_same_thread=False)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {pragma}={value}')
+        with self.__lock:
+            self.__connections.append(conn)
+        return conn
+
+    def __read(self, func, args):
+        """
+        Run a function on the connection of the current reader thread.
+
+        :param func: the function to run.
+
+        :param args: the arguments for the function.
+
+        :return: the return value of the function.
+        """
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            conn = self.__local.conn = self.__connect()
+        return func(conn, *args)
+
+    def __write_loop(self):
+        """
+        Run queued writes until told to stop.
+
+        If the writer connection can't be opened, the queued writes fail
+        with the error, and so do the writes after them.
+        """
+        try:
+            conn = self.__connect()
+        except Exception as e:
+            with self.__lock:
+                self.__error = e
+                queued = []
+                while not self.__writes.empty():
+                    queued.append(self.__writes.get_nowait())
+            _resolve_all([(item[0], None, e) for item in queued
+                          if item is not _STOP])
+            return
+        stop = False
+        while not stop:
+            batch = [self.__writes.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.__writes.get_nowait())
+                except Empty:
+                    break
+            if _STOP in batch:
+                stop = True
+                batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self.__run_batch(conn, batch)
+
+    def __run_batch(self, conn, batch: list):
+        """
+        Run a batch of writes in one transaction, each in its own savepoint.
+
+        :param conn: the writer connection.
+
+        :param batch: a list of (future, function, arguments)
+        """
+        results = []
+        try:
+            conn.execute('BEGIN')
+            for fut, func, args in batch:
+                conn.execute('SAVEPOINT write')
+                try:
+                    res = func(conn, *args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write')
+                    results.append((fut, None, e))
+                else:
+                    results.append((fut, res, None))
+                conn.execute('RELEASE write')
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            results = [(fut, None, e) for fut, _, _ in batch]
+        _resolve_all(results)
+
+
+def _resolve_all(results: list):
+    """
+    Resolve futures from another thread.
+
+    :param results: a list of (future, result, exception)
+    """
+    for fut, res, exc in results:
+        try:
+            fut.get_loop().call_soon_threadsafe(_resolve, fut, res, exc)
+        except RuntimeError:
+            # The event loop of the caller is closed.
+            pass
+
+
+def _resolve(fut, res, exc):
+    """
+    Set the result or the exception of a future if it's not cancelled.
+    """
+    if fut.cancelled():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(res)
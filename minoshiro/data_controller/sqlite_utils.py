@@ -1,5 +1,10 @@
+from pathlib import Path
 from sqlite3 import connect
 
+from minoshiro.enums import Site
+from minoshiro.helpers import normalize_name
+from .constants import convert_medium, synonyms_revision
+
 
 async def make_tables(path, loop):
     """
@@ -26,9 +31,11 @@ def __make_tables(path):
               medium INT,
               site INT,
               identifier VARCHAR NOT NULL,
+              norm_name VARCHAR,
               PRIMARY KEY (syname, medium, site)
             )"""
         )
+        __migrate_lookup(connection)
 
         connection.execute(
             """
@@ -41,6 +48,30 @@ def __make_tables(path):
             """
         )
 
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS miss(
+              query VARCHAR,
+              medium INT,
+              site INT,
+              cachetime INT,
+              PRIMARY KEY (query, medium, site)
+            )
+            """
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS miss_cachetime ON miss(cachetime)'
+        )
+
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS meta(
+              key VARCHAR PRIMARY KEY,
+              value VARCHAR
+            )
+            """
+        )
+
         tables = """
         CREATE TABLE IF NOT EXISTS {} (
           id VARCHAR,
@@ -54,3 +85,152 @@ def __make_tables(path):
         for name in ('anime', 'manga', 'ln', 'vn'):
             connection.execute(tables.format(name))
         connection.commit()
+
+
+def __migrate_lookup(connection):
+    """
+    Add the normalized name column and its index to a lookup table made
+    before it existed, and fill in the normalized names.
+
+    The names are only filled in when the column is added, so later starts
+    don't scan the table.
+
+    :param connection: the connection.
+    """
+    columns = [
+        row[1] for row in connection.execute('PRAGMA table_info(lookup)')
+    ]
+    if 'norm_name' not in columns:
+        # Add and fill in the column in one transaction.
+        connection.execute('BEGIN')
+        connection.execute('ALTER TABLE lookup ADD COLUMN norm_name VARCHAR')
+        connection.create_function('normalize_name', 1, normalize_name)
+        connection.execute(
+            'UPDATE lookup SET norm_name=normalize_name(syname)'
+        )
+        connection.commit()
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS lookup_norm_name '
+        'ON lookup(norm_name, medium)'
+    )
+
+
+def import_synonyms(path, synonyms_path, previous_path=None,
+                    revision: int = None):
+    """
+    Populate the lookup and mal tables from the upstream sqlite db of
+    synonyms, which is attached read only so no rows go through Python.
+
+    :param path: Path to the database.
+
+    :param synonyms_path: Path to the sqlite db of synonyms.
+
+    :param previous_path:
+        Path to the sqlite db of synonyms imported last time, only the rows
+        that are not in it are imported, and the ids and MAL titles of its
+        rows that are removed since are removed.
+
+    :param revision: the revision of the synonyms to record, if any.
+    """
+    connection = connect(str(path), timeout=60, isolation_level=None,
+                         uri=True)
+    try:
+        connection.create_function(
+            'normalize_name', 1, normalize_name, deterministic=True
+        )
+        connection.execute(
+            'ATTACH DATABASE ? AS upstream',
+            (f'{Path(synonyms_path).resolve().as_uri()}?mode=ro',)
+        )
+        source = 'SELECT * FROM upstream.synonyms'
+        removed = None
+        if previous_path is not None:
+            connection.execute(
+                'ATTACH DATABASE ? AS previous',
+                (f'{Path(previous_path).resolve().as_uri()}?mode=ro',)
+            )
+            source += ' EXCEPT SELECT * FROM previous.synonyms'
+            removed = ('SELECT * FROM previous.synonyms '
+                       'EXCEPT SELECT * FROM upstream.synonyms')
+        # The columns are (name, type, db_links), look up their names.
+        name, type_, links = [
+            row[1] for row in
+            connection.execute('PRAGMA upstream.table_info(synonyms)')
+        ][:3]
+        mediums = ','.join(
+            f"('{key}', {medium.value})"
+            for key, medium in convert_medium.items()
+        )
+        sites = ','.join(
+            f"({site.value}, '{json_path}')" for site, json_path in (
+                (Site.MAL, '$.mal[1]'), (Site.ANILIST, '$.ani'),
+                (Site.ANIMEPLANET, '$.ap'), (Site.ANIDB, '$.adb')
+            )
+        )
+        template = f"""
+        WITH m(type, medium) AS (VALUES {mediums}),
+        k(site, path) AS (VALUES {sites}),
+        src AS ({{}}),
+        s(name, medium, links) AS (
+          SELECT CAST(src."{name}" AS TEXT), m.medium, src."{links}"
+          FROM src JOIN m ON m.type=src."{type_}"
+        )
+        """
+        synonyms = template.format(source)
+        # The rows and the revision they are from are written together.
+        connection.execute('BEGIN')
+        if removed is not None:
+            removed = template.format(removed)
+            connection.execute(removed + """
+            DELETE FROM lookup
+            WHERE (syname, medium, site, identifier) IN (
+              SELECT s.name, s.medium, k.site,
+              CAST(json_extract(s.links, k.path) AS TEXT)
+              FROM s CROSS JOIN k
+            )
+            """)
+            connection.execute(removed + f"""
+            DELETE FROM mal
+            WHERE (id, medium) IN (
+              SELECT CAST(json_extract(links, '$.mal[1]') AS TEXT), medium
+              FROM s
+            )
+            AND NOT EXISTS (
+              SELECT 1 FROM lookup WHERE site={Site.MAL.value}
+              AND identifier=mal.id AND medium=mal.medium
+            )
+            """)
+        connection.execute(synonyms + """
+        INSERT OR REPLACE INTO lookup
+        (syname, medium, site, identifier, norm_name)
+        SELECT name, medium, site, id, normalize_name(name)
+        FROM (
+          SELECT s.name, s.medium, k.site,
+          CAST(json_extract(s.links, k.path) AS TEXT) AS id
+          FROM s CROSS JOIN k
+        )
+        WHERE name!='' AND id IS NOT NULL AND id!=''
+        """)
+        connection.execute(synonyms + """
+        INSERT OR REPLACE INTO mal (id, medium, title)
+        SELECT id, medium, title FROM (
+          SELECT CAST(json_extract(links, '$.mal[1]') AS TEXT) AS id,
+          medium,
+          CAST(json_extract(links, '$.mal[0]') AS TEXT) AS title
+          FROM s
+        )
+        WHERE id IS NOT NULL AND id NOT IN ('', '0')
+        AND title IS NOT NULL AND title!=''
+        """)
+        if revision is not None:
+            connection.execute(
+                'REPLACE INTO meta VALUES (?, ?)',
+                (synonyms_revision, revision)
+            )
+        connection.execute('COMMIT')
+    except Exception:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
@@ -0,0 +1,83 @@
+"""
+How long cached data stays fresh.
+"""
+from typing import Dict, Optional
+
+from minoshiro.enums import Medium, Site
+
+__all__ = ['TTLPolicy']
+
+
+class TTLPolicy:
+    """
+    Decide how long cached data stays fresh, based on the data itself.
+
+    Anilist entries that finished airing or publishing live for
+    ``finished_ttl`` seconds, and entries that are airing live until a little
+    after their next episode airs. Everything else lives for the TTL of its
+    site, or of its medium, or ``default`` seconds in that order.
+
+    Subclass this and override ``ttl`` for a different policy.
+    """
+    __slots__ = ('default', 'site_ttls', 'medium_ttls', 'finished_ttl',
+                 'airing_delay', 'min_ttl')
+
+    def __init__(self, default: int = 86400,
+                 site_ttls: Dict[Site, int] = None,
+                 medium_ttls: Dict[Medium, int] = None,
+                 finished_ttl: int = 28 * 86400, airing_delay: int = 3600,
+                 min_ttl: int = 3600):
+        """
+        :param default: the TTL in seconds if nothing else applies.
+            Default is 86400 (1 day).
+
+        :param site_ttls: A dict of {Site: TTL in seconds}.
+
+        :param medium_ttls: A dict of {Medium: TTL in seconds}.
+
+        :param finished_ttl:
+            The TTL in seconds for entries that finished airing or
+            publishing, or were cancelled. Default is 4 weeks.
+
+        :param airing_delay:
+            The number of seconds after the next episode airs to refresh an
+            airing entry. Default is 3600.
+
+        :param min_ttl:
+            The min TTL in seconds for airing entries. Default is 3600.
+        """
+        self.default = default
+        self.site_ttls = site_ttls or {}
+        self.medium_ttls = medium_ttls or {}
+        self.finished_ttl = finished_ttl
+        self.airing_delay = airing_delay
+        self.min_ttl = min_ttl
+
+    def ttl(self, data: Optional[dict], medium: Medium, site: Site,
+            cachetime: float) -> float:
+        """
+        Get the TTL of cached data.
+
+        :param data: the cached data.
+
+        :param medium: the medium type.
+
+        :param site: the site.
+
+        :param cachetime: the unix time the data was cached.
+
+        :return: the number of seconds the data stays fresh after cachetime.
+        """
+        if site == Site.ANILIST and data:
+            status = data.get('status')
+            if status in ('FINISHED', 'CANCELLED'):
+                return self.finished_ttl
+            next_episode = data.get('nextAiringEpisode') or {}
+            airing_at = next_episode.get('airingAt')
+            if status == 'RELEASING' and airing_at:
+                return max(
+                    airing_at + self.airing_delay - cachetime, self.min_ttl
+                )
+        return self.site_ttls.get(
+            site, self.medium_ttls.get(medium, self.default)
+        )
@@ -0,0 +1,35 @@
+"""
+Utility functions shared by the data controllers.
+"""
+from json import loads
+from typing import List, Tuple
+
+from minoshiro.enums import Site
+from .constants import convert_medium
+
+
+def parse_synonyms(rows: list) -> Tuple[List[tuple], List[tuple]]:
+    """
+    Parse the rows from `upstream.get_all_synonyms`
+
+    :param rows: the synonym rows.
+
+    :return:
+        A tuple of (a list of (name, medium, site, identifier),
+        a list of (MAL id, medium, MAL title)).
+    """
+    identifiers = []
+    mal_titles = []
+    for name, type_, db_links in rows:
+        dict_ = loads(db_links)
+        mal_name, mal_id = dict_.get('mal', ('', ''))
+        medium = convert_medium[type_]
+        if mal_name and mal_id:
+            mal_titles.append((str(mal_id), medium, str(mal_name)))
+        for site, id_ in ((Site.MAL, mal_id),
+                          (Site.ANILIST, dict_.get('ani')),
+                          (Site.ANIMEPLANET, dict_.get('ap')),
+                          (Site.ANIDB, dict_.get('adb'))):
+            if name and (id_ or isinstance(id_, int)):
+                identifiers.append((str(name), medium, site, str(id_)))
+    return identifiers, mal_titles
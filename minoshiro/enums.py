@@ -1,6 +1,6 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
-__all__ = ['Site', 'Medium']
+__all__ = ['Site', 'Medium', 'BreakerState', 'Priority']
 
 
 class Site(Enum):
@@ -20,3 +20,14 @@ class Medium(Enum):
     MANGA = 2
     LN = 3
     VN = 4
+
+
+class BreakerState(Enum):
+    CLOSED = 1
+    OPEN = 2
+    HALF_OPEN = 3
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 1
+    BACKGROUND = 2
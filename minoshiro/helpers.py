@@ -1,3 +1,5 @@
+from unicodedata import category, normalize
+
 from .enums import Medium, Site
 
 
@@ -10,6 +12,26 @@ def filter_anime_manga(medium: Medium) -> str:
         raise ValueError('Only anime and managa are supported.')
 
 
+def normalize_name(name: str) -> str:
+    """
+    Normalize a name so the same name written in different ways compares
+    equal, used as the lookup key for cached identifiers.
+
+    :param name: the name.
+
+    :return:
+        The name NFKC normalized and casefolded, with runs of whitespace and
+        punctuation collapsed into one space. Names with nothing but
+        punctuation keep their punctuation.
+    """
+    name = normalize('NFKC', name).casefold()
+    words = ''.join(
+        ' ' if char.isspace() or category(char)[0] == 'P' else char
+        for char in name
+    ).split()
+    return ' '.join(words) or ' '.join(name.split())
+
+
 def get_synonyms(entry: dict, site: Site):
     """
     Yield all synonyms from an entry.
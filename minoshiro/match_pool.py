@@ -0,0 +1,171 @@
+"""
+Run CPU bound fuzzy matching in worker processes.
+"""
+from asyncio import CancelledError, get_event_loop, wrap_future
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import cpu_count
+from typing import Callable, Optional
+
+__all__ = ['MatchPool', 'run_match']
+
+
+class MatchPool:
+    """
+    A pool of worker processes for fuzzy matching, so matching doesn't hold
+    the GIL of the process that runs the event loop.
+
+    Calls made in the same event loop iteration are sent to the workers in
+    batches, spread over the workers.
+    """
+    __slots__ = ('processes', 'batch_size', '_loop', '__executor',
+                 '__pending')
+
+    def __init__(self, processes: int = None, *, batch_size: int = 16,
+                 loop=None):
+        """
+        :param processes:
+            The number of worker processes.
+            Default is the number of CPUs.
+
+        :param batch_size:
+            The max number of calls sent to a worker at once. Default is 16.
+
+        :param loop:
+            The asyncio event loop.
+            If None is provided will use the default event loop.
+        """
+        processes = processes or cpu_count() or 1
+        assert processes > 0, 'Param `processes` must be positive.'
+        assert batch_size > 0, 'Param `batch_size` must be positive.'
+        self.processes = processes
+        self.batch_size = batch_size
+        self._loop = loop
+        self.__executor = None
+        self.__pending = []
+
+    @property
+    def loop(self):
+        """
+        :return: `self._loop` or a default event loop.
+        """
+        return self._loop or get_event_loop()
+
+    async def run(self, func: Callable, *args):
+        """
+        Call ``func(*args)`` in a worker process.
+
+        ``func`` and ``args`` are pickled, so ``func`` must be defined at the
+        top level of a module. A `TitleIndex` loaded from a snapshot file is
+        sent as its path, and workers keep their own read only map of it.
+
+        :param func: the function.
+
+        :param args: the arguments for ``func``.
+
+        :return: the return value of ``func``.
+        """
+        if self.__executor is None:
+            self.__executor = ProcessPoolExecutor(self.processes)
+        fut = self.loop.create_future()
+        if not self.__pending:
+            self.loop.call_soon(self.__flush)
+        self.__pending.append((fut, func, args))
+        return await fut
+
+    async def close(self):
+        """
+        Shut down the worker processes.
+        """
+        executor, self.__executor = self.__executor, None
+        if executor:
+            await self.loop.run_in_executor(None, executor.shutdown)
+
+    def __flush(self):
+        """
+        Send the pending calls to the workers.
+        """
+        pending, self.__pending = self.__pending, []
+        if self.__executor is None:
+            for fut, _, _ in pending:
+                if not fut.done():
+                    fut.set_exception(RuntimeError('The pool is closed.'))
+            return
+        size = min(self.batch_size, -(-len(pending) // self.processes))
+        for i in range(0, len(pending), size):
+            batch = pending[i:i + size]
+            try:
+                res = wrap_future(self.__executor.submit(
+                    _run_batch, [(func, args) for _, func, args in batch]
+                ), loop=self.loop)
+            except Exception as e:
+                _resolve(batch, None, e)
+            else:
+                res.add_done_callback(partial(_finish, batch))
+
+
+async def run_match(pool: Optional[MatchPool], func: Callable, *args):
+    """
+    Call a matching function in a `MatchPool` if there's one, or else right
+    away.
+
+    :param pool: the `MatchPool` or None.
+
+    :param func: the function.
+
+    :param args: the arguments for ``func``.
+
+    :return: the return value of ``func``.
+    """
+    if pool is None:
+        return func(*args)
+    return await pool.run(func, *args)
+
+
+def _run_batch(calls: list) -> list:
+    """
+    Run a batch of calls in a worker process.
+
+    :param calls: a list of (function, arguments)
+
+    :return: a list of (return value, exception raised)
+    """
+    res = []
+    for func, args in calls:
+        try:
+            res.append((func(*args), None))
+        except Exception as e:
+            res.append((None, e))
+    return res
+
+
+def _finish(batch: list, res):
+    """
+    Set the results of a batch of calls once the worker is done with it.
+
+    :param batch: a list of (future, function, arguments)
+
+    :param res: the future of the `_run_batch` call.
+    """
+    exc = CancelledError() if res.cancelled() else res.exception()
+    _resolve(batch, None if exc else res.result(), exc)
+
+
+def _resolve(batch: list, results: Optional[list], exc):
+    """
+    Set the results of a batch of calls on their futures.
+
+    :param batch: a list of (future, function, arguments)
+
+    :param results: the results from `_run_batch`
+
+    :param exc: the exception raised sending the batch, if any.
+    """
+    for i, (fut, _, _) in enumerate(batch):
+        if fut.done():
+            continue
+        res, err = (None, exc) if exc is not None else results[i]
+        if err is not None:
+            fut.set_exception(err)
+        else:
+            fut.set_result(res)
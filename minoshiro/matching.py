@@ -0,0 +1,132 @@
+"""
+Fuzzy matching of search results to search queries, shared by all sites.
+"""
+from difflib import SequenceMatcher
+from typing import Iterable, Optional, Sequence, Tuple, TypeVar
+
+__all__ = ['closest', 'first_match']
+
+T = TypeVar('T')
+
+# A candidate is (the result, its names, the penalty taken off its ratio).
+Candidate = Tuple[T, Sequence[str], float]
+
+
+def closest(queries: Iterable[str], candidates: Iterable[Candidate],
+            threshold: float, *, stop_above: float = None,
+            normalized: bool = False) -> Optional[T]:
+    """
+    Find the candidate that best matches a search query.
+
+    A candidate's score is the highest `SequenceMatcher` ratio of its names
+    minus its penalty. The first candidate with the highest score of at
+    least ``threshold`` wins. The queries are tried in order until one of
+    them has a match.
+
+    Names that can't beat the best score so far are skipped by their upper
+    bounds before the full ratio is computed, and the search stops early
+    once a score can't be beaten, so the result is the same as comparing
+    every name.
+
+    :param queries: the search queries.
+
+    :param candidates: (result, names, penalty) tuples.
+
+    :param threshold: the lowest score that matches.
+
+    :param stop_above:
+        If set, the first candidate scoring above this is returned right
+        away, even if a later one scores higher.
+
+    :param normalized: True if the names are already lowercase.
+
+    :return: the result of the best candidate, None if nothing matches.
+    """
+    candidates = _normalize(candidates, normalized)
+    for query in queries:
+        query = query.lower()
+        size = len(query)
+        matcher = SequenceMatcher(b=query)
+        best, match = 0, None
+        for res, names, penalty in candidates:
+            for name in names:
+                # Upper bounds of the score, by length and by characters.
+                bound = _length_bound(len(name), size) - penalty
+                if bound < threshold or bound <= best:
+                    continue
+                matcher.set_seq1(name)
+                bound = matcher.quick_ratio() - penalty
+                if bound < threshold or bound <= best:
+                    continue
+                ratio = matcher.ratio() - penalty
+                if stop_above is not None and ratio > stop_above:
+                    return res
+                if ratio > best and ratio >= threshold:
+                    best, match = ratio, res
+                    if best >= 1:
+                        return match
+        if match is not None:
+            return match
+
+
+def first_match(queries: Iterable[str], candidates: Iterable[Candidate],
+                threshold: float, *, normalized: bool = False) -> Optional[T]:
+    """
+    Find the first candidate that matches a search query well enough.
+
+    :param queries: the search queries, tried in order.
+
+    :param candidates: (result, names, penalty) tuples.
+
+    :param threshold: the lowest score that matches, see `closest`.
+
+    :param normalized: True if the names are already lowercase.
+
+    :return: the result of the first match, None if nothing matches.
+    """
+    candidates = _normalize(candidates, normalized)
+    for query in queries:
+        query = query.lower()
+        size = len(query)
+        matcher = SequenceMatcher(b=query)
+        for res, names, penalty in candidates:
+            for name in names:
+                if _length_bound(len(name), size) - penalty < threshold:
+                    continue
+                matcher.set_seq1(name)
+                if matcher.quick_ratio() - penalty < threshold:
+                    continue
+                if matcher.ratio() - penalty >= threshold:
+                    return res
+
+
+def _normalize(candidates: Iterable[Candidate],
+               normalized: bool) -> Sequence[Candidate]:
+    """
+    Lowercase the names of candidates once for all queries.
+
+    :param candidates: (result, names, penalty) tuples.
+
+    :param normalized: True if the names are already lowercase.
+
+    :return: the candidates with lowercase names.
+    """
+    if normalized:
+        return candidates if isinstance(candidates, Sequence) \
+            else list(candidates)
+    return [(res, [name.lower() for name in names], penalty)
+            for res, names, penalty in candidates]
+
+
+def _length_bound(a: int, b: int) -> float:
+    """
+    The upper bound of the ratio of two strings by their lengths, the same
+    as `SequenceMatcher.real_quick_ratio`
+
+    :param a: the length of one string.
+
+    :param b: the length of the other string.
+
+    :return: the upper bound.
+    """
+    return 2.0 * min(a, b) / (a + b) if a + b else 1.0
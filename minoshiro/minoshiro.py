@@ -1,27 +1,62 @@
-from asyncio import get_event_loop
-from itertools import chain
+from asyncio import (FIRST_COMPLETED, CancelledError, Queue, Semaphore,
+                     TimeoutError, as_completed, ensure_future,
+                     get_event_loop, sleep, wait, wait_for)
 from pathlib import Path
 from traceback import format_exc
-from typing import Dict, Iterable, Union
+from typing import Dict, Iterable, Tuple, Union
 
 from aiohttp_wrapper import SessionManager
 
+from .circuit_breaker import CircuitBreaker
 from .data import data_path
-from .data_controller import (DataController, PostgresController,
-                              SqliteController)
-from .enums import Medium, Site
-from .helpers import get_synonyms
+from .data_controller import (DataController, MemoryCachedController,
+                              PostgresController, SqliteController)
+from .enums import BreakerState, Medium, Priority, Site
+from .helpers import get_synonyms, normalize_name
 from .logger import get_default_logger
+from .match_pool import MatchPool
 from .pre_cache import cache_top_pages
+from .rate_limit import RateLimitError, RateLimiter
+from .single_flight import SingleFlight
 from .upstream import download_anidb
 from .web_api import ani_db, ani_list, anime_planet, kitsu, lndb, mu, nu
 
 from warnings import warn
 
+# The mediums each site can search for.
+_SITE_MEDIUMS = {
+    Site.MAL: (),
+    Site.ANILIST: (Medium.ANIME, Medium.MANGA, Medium.LN),
+    Site.ANIMEPLANET: (Medium.ANIME, Medium.MANGA),
+    Site.ANIDB: (Medium.ANIME,),
+    Site.KITSU: (Medium.ANIME, Medium.MANGA, Medium.LN),
+    Site.MANGAUPDATES: (Medium.MANGA,),
+    Site.LNDB: (Medium.LN,),
+    Site.NOVELUPDATES: (Medium.LN,),
+    Site.VNDB: (),
+}
+
+# Sites whose results provide synonyms to other sites.
+_SYNONYM_SOURCES = frozenset((Site.ANILIST, Site.MAL, Site.ANIDB))
+
+# Sites that search with the synonyms found by ``_SYNONYM_SOURCES``.
+_SYNONYM_DEPENDENT = frozenset(
+    (Site.ANIMEPLANET, Site.MANGAUPDATES, Site.LNDB, Site.NOVELUPDATES)
+)
+
+
+class _Skipped(Exception):
+    """
+    Raised when a site is skipped without being searched, so no miss is
+    recorded for it.
+    """
+
 
 class Minoshiro:
     def __init__(self, db_controller: DataController,
-                 *, logger=None, loop=None):
+                 *, logger=None, loop=None, breaker_options: dict = None,
+                 rate_limits: dict = None, memory_cache: dict = None,
+                 anidb_refresh: int = 3600, match_pool: MatchPool = None):
         """
         Represents the search instance.
 
@@ -48,9 +83,48 @@ class Minoshiro:
         :param loop:
             An asyncio event loop. If not provided will use the default
             event loop.
+
+        :param breaker_options:
+            Keyword arguments for the ``CircuitBreaker`` of each site.
+            If not provided will use the ``CircuitBreaker`` defaults.
+
+        :param rate_limits:
+            A dict of {host: (requests per second, burst size)} for the HTTP
+            requests sent. If not provided will use
+            ``minoshiro.rate_limit.DEFAULT_RATE_LIMITS``.
+
+        :param memory_cache:
+            Keyword arguments for the ``LRUCache`` in
+            ``minoshiro.data_controller.memory_controller``. If provided,
+            ``db_controller`` is wrapped with a ``MemoryCachedController``
+            that keeps the most used cache entries in memory.
+            Default is None (no memory cache).
+
+        :param anidb_refresh:
+            The number of seconds between checks for a new anidb data dump,
+            which run in the background after ``pre_cache``. A new dump is
+            downloaded at most once a day. Default is 3600.
+
+        :param match_pool:
+            A ``minoshiro.match_pool.MatchPool`` to run the fuzzy matching
+            of search results in, so it doesn't hold up other searches.
+            The pool can be shared, and is not closed by ``close``.
+            Default is None (match on the event loop).
         """
-        self.session_manager = SessionManager()
+        assert anidb_refresh > 0, 'Param `anidb_refresh` must be positive.'
+        self.rate_limiter = RateLimiter(rate_limits, loop=loop)
+        session_manager = SessionManager()
+        self.session_manager = self.rate_limiter.session(
+            session_manager, Priority.INTERACTIVE
+        )
+        self.background_session = self.rate_limiter.session(
+            session_manager, Priority.BACKGROUND
+        )
 
+        if memory_cache is not None:
+            db_controller = MemoryCachedController(
+                db_controller, **memory_cache
+            )
         self.db_controller = db_controller
 
         self.kitsu = kitsu.Kitsu(
@@ -60,14 +134,24 @@ class Minoshiro:
         self.loop = loop or get_event_loop()
         self.logger = logger or get_default_logger()
 
+        self.anidb_refresh = anidb_refresh
+        self.match_pool = match_pool
         self.__anidb_list = None
         self.__anidb_time = None
+        self.__anidb_task = None
+        self.breakers = {
+            site: CircuitBreaker(**(breaker_options or {})) for site in Site
+        }
+        self.__flights = SingleFlight(self.loop)
+        self.__background = set()
+        self.__refreshing = set()
+        self.db_controller.set_refresh_callback(self.__schedule_refresh)
 
     @classmethod
     async def from_postgres(cls, db_config: dict = None,
                             pool=None, *, schema='minoshiro',
                             cache_pages: int = 0,
-                            logger=None, loop=None):
+                            logger=None, loop=None, **kwargs):
         """
         Get an instance of `minoshiro` with class `PostgresController` as the
         database controller.
@@ -102,6 +186,8 @@ class Minoshiro:
             An asyncio event loop. If not provided will use the default
             event loop.
 
+        :param kwargs: other keyword arguments for ``__init__``
+
         :return:
             Instance of `minoshiro` with class `PostgresController`
             as the database controller.
@@ -115,14 +201,14 @@ class Minoshiro:
         db_controller = await PostgresController.get_instance(
             logger, db_config, pool, schema=schema
         )
-        instance = cls(db_controller, logger=logger, loop=loop)
+        instance = cls(db_controller, logger=logger, loop=loop, **kwargs)
         await instance.pre_cache(cache_pages)
         return instance
 
     @classmethod
     async def from_sqlite(cls, path: Union[str, Path], *,
                           cache_pages: int = 0,
-                          logger=None, loop=None):
+                          logger=None, loop=None, **kwargs):
         """
         Get an instance of `minoshiro` with class `SqliteController` as the
         database controller.
@@ -150,6 +236,8 @@ class Minoshiro:
             An asyncio event loop. If not provided will use the default
             event loop.
 
+        :param kwargs: other keyword arguments for ``__init__``
+
         :return:
             Instance of `minoshiro` with class `PostgresController`
             as the database controller.
@@ -157,7 +245,7 @@ class Minoshiro:
         logger = logger or get_default_logger()
         db_controller = await SqliteController.get_instance(path, logger, loop)
         instance = cls(db_controller,
-                       logger=logger, loop=loop)
+                       logger=logger, loop=loop, **kwargs)
         await instance.pre_cache(cache_pages)
         return instance
 
@@ -171,7 +259,7 @@ class Minoshiro:
         """
         assert cache_pages >= 0, 'Param `cache_pages` must not be negative.'
         self.logger.info('Populating lookup...')
-        await self.db_controller.pre_cache(self.session_manager)
+        await self.db_controller.pre_cache(self.background_session)
         self.logger.info('Lookup populated.')
 
         self.logger.info('Populating data...')
@@ -179,15 +267,40 @@ class Minoshiro:
         for med in (Medium.ANIME, Medium.MANGA):
             if cache_pages:
                 await cache_top_pages(
-                    med, self.session_manager, self.db_controller,
+                    med, self.background_session, self.db_controller,
                     cache_pages, self.logger
                 )
 
         self.logger.info('Data populated.')
         await self.__fetch_anidb()
+        if self.__anidb_task is None:
+            self.__anidb_task = self.__run_in_background(
+                self.__refresh_anidb()
+            )
+
+    async def close(self):
+        """
+        Stop the background anidb refresh and close the database controller.
+        """
+        task, self.__anidb_task = self.__anidb_task, None
+        if task:
+            task.cancel()
+        await self.db_controller.close()
+
+    def breaker_states(self) -> Dict[Site, BreakerState]:
+        """
+        Get the circuit breaker state of every site.
+
+        Sites with an open breaker are not searched until the breaker lets
+        a probe request through, cached results are still served.
+
+        :return: A dict of {Site: BreakerState}
+        """
+        return {site: breaker.state for site, breaker in self.breakers.items()}
 
     async def yield_data(self, query: str, medium: Medium,
-                         sites: Iterable[Site] = None, *, timeout=3):
+                         sites: Iterable[Site] = None, *, timeout=3,
+                         concurrent=False, deadline=None):
         """
         Yield the data for the search query from all sites.
 
@@ -202,29 +315,33 @@ class Minoshiro:
         :param timeout:
             The timeout in seconds for each HTTP request. Defualt is 3.
 
+        :param concurrent:
+            If True, search all sites at the same time and yield the results
+            in the order they finish. Sites that search with synonyms
+            (Anime-Planet, MangaUpdates, LNDB and NovelUpdates) start after
+            the sites that provide synonyms are done. Default is False.
+
+        :param deadline:
+            The max number of seconds for the whole search, reading the
+            cache included. Once it has passed, stop yielding and leave the
+            unfinished sites running in the background so their results are
+            still cached. Best used with ``concurrent=True``.
+            Default is None (no limit).
+
         :return:
             an asynchronous generator that yields the site and data
             in a tuple for all sites requested.
         """
-        sites = sites if sites else list(Site)
-        cached_data, cached_id = await self._get_cached(query, medium)
-        to_be_cached = {}
-        names = []
-        for site in sites:
-            res, id_ = await self._get_result(
-                cached_data, cached_id, query, names, site, medium, timeout
-            )
-            if res:
-                yield site, res
-                for title in get_synonyms(res, site):
-                    names.append(title)
-            if id_:
-                to_be_cached[site] = id_
-        await self._cache(to_be_cached, names, medium)
+        sites = list(sites) if sites else list(Site)
+        results = self.__lookup(query, medium, sites, timeout, concurrent)
+        if deadline is not None:
+            results = self.__until(self.loop.time() + deadline, results)
+        async for site, res in results:
+            yield site, res
 
     async def get_data(self, query: str, medium: Medium,
-                       sites: Iterable[Site] = None, *,
-                       timeout=3) -> Dict[Site, dict]:
+                       sites: Iterable[Site] = None, *, timeout=3,
+                       concurrent=False, deadline=None) -> Dict[Site, dict]:
         """
         Get the data for the search query in a dict.
 
@@ -239,42 +356,401 @@ class Minoshiro:
         :param timeout:
             The timeout in seconds for each HTTP request. Defualt is 3.
 
+        :param concurrent:
+            If True, search all sites at the same time. Default is False.
+
+        :param deadline:
+            The max number of seconds for the whole search, only the sites
+            done by then are returned. Sites still running keep running in
+            the background so their results are still cached.
+            Default is None (no limit).
+
         :return: Data for all sites in a dict {Site: data}
         """
         return {site: val async for site, val in self.yield_data(
-            query, medium, sites, timeout=timeout
+            query, medium, sites, timeout=timeout,
+            concurrent=concurrent, deadline=deadline
         )}
 
-    async def _cache(self, to_be_cached, names, medium):
+    async def yield_data_many(self, queries: Iterable[str], medium: Medium,
+                              sites: Iterable[Site] = None, *, timeout=3,
+                              concurrency=10, concurrent=False):
         """
-        Cache search results into the db.
+        Yield the data for many search queries.
 
-        :param to_be_cached: items to be cached.
+        Queries with the same normalized name are only searched once, and
+        the cache is read once for the whole batch.
 
-        :param names: all names for the item.
+        :param queries: the search queries.
 
         :param medium: the medium type.
+
+        :param sites:
+            an iterable of sites desired. If None is provided, will
+            search all sites by default.
+
+        :param timeout:
+            The timeout in seconds for each HTTP request. Defualt is 3.
+
+        :param concurrency:
+            The max number of queries searched at the same time.
+            Default is 10.
+
+        :param concurrent:
+            If True, search all sites of a query at the same time.
+            Default is False.
+
+        :return:
+            an asynchronous generator that yields the query and its data
+            in a tuple, in the order the queries finish. The data is a dict
+            of {Site: data}.
         """
-        itere = set(chain(*names))
-        for site, id_ in to_be_cached.items():
-            await self.__cache_one(site, id_, medium, itere)
+        assert concurrency > 0, 'Param `concurrency` must be positive.'
+        sites = list(sites) if sites else list(Site)
+        batch = {}
+        for query in queries:
+            batch.setdefault(normalize_name(query), []).append(query)
+        first = [same[0] for same in batch.values()]
+        cached, misses = await self.db_controller.resolve_queries(
+            first, medium
+        )
+        semaphore = Semaphore(concurrency)
+
+        async def run(same):
+            query = same[0]
+            async with semaphore:
+                data = {site: res async for site, res in self.__yield_data(
+                    query, medium, sites, timeout, concurrent,
+                    cached.get(query, ({}, None)), misses.get(query, ())
+                )}
+            return same, data
+
+        tasks = [ensure_future(run(same), loop=self.loop)
+                 for same in batch.values()]
+        try:
+            for fut in as_completed(tasks):
+                same, data = await fut
+                for query in same:
+                    yield query, data
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    async def __cache_one(self, site, id_, medium, iterator):
+    async def get_data_many(self, queries: Iterable[str], medium: Medium,
+                            sites: Iterable[Site] = None, *, timeout=3,
+                            concurrency=10, concurrent=False
+                            ) -> Dict[str, Dict[Site, dict]]:
         """
-        Cache one id.
+        Get the data for many search queries in a dict.
+
+        :param queries: the search queries.
+
+        :param medium: the medium type.
+
+        :param sites:
+            an iterable of sites desired. If None is provided, will
+            search all sites by default.
+
+        :param timeout:
+            The timeout in seconds for each HTTP request. Defualt is 3.
+
+        :param concurrency:
+            The max number of queries searched at the same time.
+            Default is 10.
+
+        :param concurrent:
+            If True, search all sites of a query at the same time.
+            Default is False.
+
+        :return: Data for all queries in a dict {query: {Site: data}}
+        """
+        return {query: data async for query, data in self.yield_data_many(
+            queries, medium, sites, timeout=timeout,
+            concurrency=concurrency, concurrent=concurrent
+        )}
+
+    async def __lookup(self, query: str, medium: Medium, sites: list,
+                       timeout, concurrent: bool):
+        """
+        Read the cache for the search query, then yield the data for it
+        from all sites.
+
+        :param query: the search query.
+
+        :param medium: the medium type.
+
+        :param sites: the sites to search.
+
+        :param timeout:
+            The timeout in seconds for each HTTP request. Defualt is 3.
+
+        :param concurrent: True to search all sites at the same time.
+
+        :return:
+            an asynchronous generator that yields the site and data
+            in a tuple for all sites with data found.
+        """
+        cached, misses = await self.db_controller.resolve_queries(
+            (query,), medium
+        )
+        async for site, res in self.__yield_data(
+                query, medium, sites, timeout, concurrent,
+                cached.get(query, ({}, None)), misses.get(query, ())):
+            yield site, res
+
+    async def __yield_data(self, query: str, medium: Medium, sites: list,
+                           timeout, concurrent: bool, cached: Tuple,
+                           misses: Iterable[Site]):
+        """
+        Yield the data for the search query from all sites, then cache the
+        search results.
+
+        :param query: the search query.
+
+        :param medium: the medium type.
+
+        :param sites: the sites to search.
+
+        :param timeout:
+            The timeout in seconds for each HTTP request. Defualt is 3.
+
+        :param concurrent: True to search all sites at the same time.
+
+        :param cached: a tuple of (cached data, cached ids)
+
+        :param misses: sites that recently had no results for the query.
+
+        :return:
+            an asynchronous generator that yields the site and data
+            in a tuple for all sites with data found.
+        """
+        cached_data, cached_id = cached
+        sites = [site for site in sites if site not in misses]
+        to_be_cached = {}
+        names = []
+        search = self.__search_concurrent if concurrent else self.__search
+        async for site, res, id_ in search(
+                cached_data, cached_id, query, names, sites, medium, timeout):
+            if res:
+                yield site, res
+            if id_:
+                to_be_cached[site] = id_
+        await self._cache(to_be_cached, names, medium)
+
+    def __run_in_background(self, coro):
+        """
+        Run a coroutine in a task that is kept until it's done.
+
+        :param coro: the coroutine.
+
+        :return: the task.
+        """
+        task = ensure_future(coro, loop=self.loop)
+        self.__background.add(task)
+        task.add_done_callback(self.__background.discard)
+        return task
+
+    def __schedule_refresh(self, id_: str, medium: Medium, site: Site):
+        """
+        Refresh cached data in the background, called by the data controller
+        when it serves data that is expired or about to expire.
+
+        Only one refresh per entry runs at a time.
+
+        :param id_: the id.
+
+        :param medium: the medium type.
 
         :param site: the site.
+        """
+        key = id_, medium, site
+        if site != Site.ANILIST or key in self.__refreshing:
+            return
+        self.__refreshing.add(key)
+        task = self.__run_in_background(self.__refresh(id_, medium, site))
+        task.add_done_callback(lambda _: self.__refreshing.discard(key))
+
+    async def __refresh(self, id_: str, medium: Medium, site: Site):
+        """
+        Fetch an entry again and update its cached data.
 
         :param id_: the id.
 
         :param medium: the medium type.
 
-        :param iterator: an iterator for all names.
+        :param site: the site.
+        """
+        if self.breakers[site].state == BreakerState.OPEN:
+            return
+        try:
+            resp = await ani_list.get_entry_by_id(
+                self.background_session, medium, id_, timeout=10
+            )
+            if resp:
+                await self.db_controller.set_medium_data(
+                    id_, medium, site, resp
+                )
+        except Exception as e:
+            self.logger.warning(
+                f'Error raised when refreshing {site} data for {id_}: {e}'
+            )
+
+    async def __until(self, end: float, async_iter):
         """
-        for name in iterator:
-            if name:
-                await self.db_controller.set_identifier(
-                    name, medium, site, id_
+        Yield from an asynchronous iterator until a point in time.
+
+        The iterator is consumed by a background task, which keeps going
+        after the time has passed.
+
+        :param end: the loop time to stop at.
+
+        :param async_iter: the asynchronous iterator.
+
+        :return:
+            an asynchronous generator that yields the items from
+            ``async_iter`` that are ready before ``end``.
+        """
+        queue = Queue()
+
+        async def drain():
+            try:
+                async for item in async_iter:
+                    queue.put_nowait(item)
+            except Exception as e:
+                self.logger.warning(
+                    f'Error raised by a background search: {e}\n'
+                    f'{format_exc()}'
+                )
+            finally:
+                queue.put_nowait(None)
+
+        self.__run_in_background(drain())
+        while True:
+            if queue.empty():
+                try:
+                    item = await wait_for(
+                        queue.get(), end - self.loop.time()
+                    )
+                except TimeoutError:
+                    return
+            else:
+                item = queue.get_nowait()
+            if item is None:
+                return
+            yield item
+
+    async def __search(self, cached_data, cached_id, query, names,
+                       sites, medium, timeout):
+        """
+        Search the sites one after another.
+
+        :param cached_data: the cached data.
+
+        :param cached_id: the cached id.
+
+        :param query: the search query.
+
+        :param names: the list of synonyms found so far.
+
+        :param sites: the sites to search.
+
+        :param medium: the medium type.
+
+        :param timeout:
+            The timeout in seconds for each HTTP request. Defualt is 3.
+
+        :return:
+            an asynchronous generator that yields the site, data and id
+            in a tuple for all sites requested.
+        """
+        for site in sites:
+            res, id_ = await self.__get_result_shared(
+                cached_data, cached_id, query, names, site, medium, timeout
+            )
+            if res:
+                names.extend(get_synonyms(res, site))
+            yield site, res, id_
+
+    async def __search_concurrent(self, cached_data, cached_id, query, names,
+                                  sites, medium, timeout):
+        """
+        Search the sites at the same time.
+
+        Sites in ``_SYNONYM_DEPENDENT`` are started once all requested sites
+        in ``_SYNONYM_SOURCES`` are done, so they can search with the
+        synonyms found.
+
+        :param cached_data: the cached data.
+
+        :param cached_id: the cached id.
+
+        :param query: the search query.
+
+        :param names: the list of synonyms found so far.
+
+        :param sites: the sites to search.
+
+        :param medium: the medium type.
+
+        :param timeout:
+            The timeout in seconds for each HTTP request. Defualt is 3.
+
+        :return:
+            an asynchronous generator that yields the site, data and id
+            in a tuple in the order the sites finish.
+        """
+        def start(site):
+            return ensure_future(self.__get_result_shared(
+                cached_data, cached_id, query, list(names),
+                site, medium, timeout
+            ), loop=self.loop)
+
+        pending = {start(s): s for s in sites if s not in _SYNONYM_DEPENDENT}
+        waiting = [s for s in sites if s in _SYNONYM_DEPENDENT]
+        try:
+            while pending or waiting:
+                if waiting and _SYNONYM_SOURCES.isdisjoint(pending.values()):
+                    pending.update((start(s), s) for s in waiting)
+                    waiting = []
+                done, _ = await wait(pending, return_when=FIRST_COMPLETED)
+                for task in done:
+                    site = pending.pop(task)
+                    res, id_ = task.result()
+                    if res:
+                        names.extend(get_synonyms(res, site))
+                    yield site, res, id_
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _cache(self, to_be_cached, names, medium):
+        """
+        Cache search results into the db.
+
+        :param to_be_cached: items to be cached.
+
+        :param names: all names for the item.
+
+        :param medium: the medium type.
+        """
+        names = {name for name in names if name}
+        await self.db_controller.set_identifiers_bulk(
+            (name, medium, site, id_)
+            for site, id_ in to_be_cached.items() for name in names
+        )
+
+    async def __refresh_anidb(self):
+        """
+        Check for a new anidb data dump every ``anidb_refresh`` seconds, so
+        searches never have to.
+        """
+        while True:
+            await sleep(self.anidb_refresh)
+            try:
+                await self.__fetch_anidb()
+            except Exception as e:
+                self.logger.warning(
+                    f'Error raised when refreshing anidb data: {e}'
                 )
 
     async def __fetch_anidb(self):
@@ -282,11 +758,14 @@ class Minoshiro:
         Fetch data dump from anidb if one of the following is True:
             The data dump file is not found.
             The data dump file is more than a day old.
+
+        The title index is built in an executor, and replaces the current
+        one once it's ready.
         """
         dump_path = data_path.joinpath('anime-titles.xml')
         self.logger.info('Checking anidb conditions...')
         good, new_time = await download_anidb(
-            self.session_manager, self.__anidb_time
+            self.background_session, self.__anidb_time
         )
         if good:
             self.logger.info(
@@ -300,9 +779,9 @@ class Minoshiro:
         if not good or not self.__anidb_list:
             try:
                 self.logger.info('Reading anidb data from disk...')
-                with dump_path.open() as xml_file:
-                    xml = xml_file.read()
-                self.__anidb_list = ani_db.process_xml(xml)
+                self.__anidb_list = await self.loop.run_in_executor(
+                    None, ani_db.load_index, dump_path
+                )
                 self.logger.info('Anidb data read from disk.')
             except Exception as e:
                 self.logger.warn(f'Error loading anidb data from disk: {e}')
@@ -341,12 +820,15 @@ class Minoshiro:
         anilist_id = cached_ids.get(Site.ANILIST) if cached_ids else None
 
         if anilist_id:
-            resp = await ani_list.get_entry_by_id(
+            resp = await self.__call_site(
+                Site.ANILIST, ani_list.get_entry_by_id,
                 self.session_manager, medium, anilist_id, timeout
             )
         else:
-            resp = await ani_list.get_entry_details(
-                self.session_manager, medium, query, timeout
+            resp = await self.__call_site(
+                Site.ANILIST, ani_list.get_entry_details,
+                self.session_manager, medium, query, timeout,
+                match_pool=self.match_pool
             )
 
         id_ = str(resp['id']) if resp else None
@@ -398,7 +880,7 @@ class Minoshiro:
 
         resp = await mal.get_entry_details(
             self.session_manager, self.mal_headers, medium, query, mal_id,
-            timeout
+            timeout, match_pool=self.match_pool
         )
 
         id_ = str(resp['id']) if resp else None
@@ -421,7 +903,8 @@ class Minoshiro:
         Return the cached url if it's found.
 
         If no cached url is found, try search through the datadump,
-        return and cache the url if it's found.
+        return and cache the url if it's found. The search is skipped if
+        the datadump is not loaded yet.
 
         :param cached_ids: a dict of cached ids.
 
@@ -435,15 +918,22 @@ class Minoshiro:
         base_url = 'https://anidb.net/perl-bin/animedb.pl?show=anime&aid='
         if cached_id:
             return {'url': f'{base_url}{cached_id}'}, cached_id
-        await self.__fetch_anidb()
-        res = await self.loop.run_in_executor(
-            None, ani_db.get_animeani_db.get_anime, query, self.__anidb_list
-        )
+        if not self.__anidb_list:
+            raise _Skipped('anidb data is not loaded yet.')
+        if self.match_pool:
+            res = await self.__call_site(
+                Site.ANIDB, self.match_pool.run,
+                ani_db.get_anime, query, self.__anidb_list
+            )
+        else:
+            res = await self.__call_site(
+                Site.ANIDB, self.loop.run_in_executor,
+                None, ani_db.get_anime, query, self.__anidb_list
+            )
         if not res:
             return None, None
         id_ = res['id']
-        res['url'] = f'{base_url}{id_}'
-        return res, id_
+        return {**res, 'url': f'{base_url}{id_}'}, id_
 
     async def __find_ani_planet(self, cached_ids, medium: Medium,
                                 query: str, names: list, timeout):
@@ -463,21 +953,25 @@ class Minoshiro:
 
         if medium == Medium.ANIME:
             if ap_id:
-                return {'url': anime_planet.get_anime_url_by_id(
-                    cached_ids.get(Site.ANIMEPLANET))}, None
+                url = anime_planet.get_anime_url_by_id(ap_id)
             else:
-                return {'url': await anime_planet.get_anime_url(
-                    self.session_manager, query, names, timeout=timeout
-                )}, None
+                url = await self.__call_site(
+                    Site.ANIMEPLANET, anime_planet.get_anime_url,
+                    self.session_manager, query, names, timeout=timeout,
+                    match_pool=self.match_pool
+                )
+            return ({'url': url} if url else None), None
 
         if medium == Medium.MANGA:
             if ap_id:
-                return {'url': anime_planet.get_manga_url_by_id(
-                    cached_ids.get(Site.ANIMEPLANET))}, None
+                url = anime_planet.get_manga_url_by_id(ap_id)
             else:
-                return {'url': await anime_planet.get_manga_url(
-                    self.session_manager, query, names, timeout=timeout
-                )}, None
+                url = await self.__call_site(
+                    Site.ANIMEPLANET, anime_planet.get_manga_url,
+                    self.session_manager, query, names, timeout=timeout,
+                    match_pool=self.match_pool
+                )
+            return ({'url': url} if url else None), None
 
         return None, None
 
@@ -498,12 +992,14 @@ class Minoshiro:
             return None, None
         kitsu_id = cached_ids.get(Site.KITSU) if cached_ids else None
         if kitsu_id:
-            resp = await self.kitsu.get_entry_by_id(
+            resp = await self.__call_site(
+                Site.KITSU, self.kitsu.get_entry_by_id,
                 medium, kitsu_id, timeout
             )
         else:
-            resp = await self.kitsu.search_entries(
-                medium, query, timeout
+            resp = await self.__call_site(
+                Site.KITSU, self.kitsu.search_entries,
+                medium, query, timeout, match_pool=self.match_pool
             )
         id_ = str(resp['id']) if resp else None
         return resp, id_
@@ -529,8 +1025,10 @@ class Minoshiro:
                     mu_id
                 )}, None
             else:
-                return await mu.get_manga_url(
-                    self.session_manager, query, names, timeout
+                return await self.__call_site(
+                    Site.MANGAUPDATES, mu.get_manga_url,
+                    self.session_manager, query, names, timeout,
+                    match_pool=self.match_pool
                 ), None
 
         return None, None
@@ -555,8 +1053,10 @@ class Minoshiro:
                     lndb_id
                 )}, None
             else:
-                return await lndb.get_light_novel_url(
-                    self.session_manager, query, names, timeout), None
+                return await self.__call_site(
+                    Site.LNDB, lndb.get_light_novel_url,
+                    self.session_manager, query, names, timeout,
+                    match_pool=self.match_pool), None
         return None, None
 
     async def __find_novel_updates(self, cached_ids, medium,
@@ -579,8 +1079,10 @@ class Minoshiro:
                 return {'url': nu.get_light_novel_by_id(
                     nu_id
                 )}, None
-            return await nu.get_light_novel_url(
-                self.session_manager, query, names, timeout
+            return await self.__call_site(
+                Site.NOVELUPDATES, nu.get_light_novel_url,
+                self.session_manager, query, names, timeout,
+                match_pool=self.match_pool
             ), None
 
         return None, None
@@ -598,17 +1100,41 @@ class Minoshiro:
 
         :return: a tuple of (cached data, cached ids)
         """
-        identifiers = await self.db_controller.get_identifier(query, medium)
-        if not identifiers:
-            return {}, None
-        entry_resp = {}
-        for site, id_ in identifiers.items():
-            medium_data = await self.db_controller.medium_data_by_id(
-                id_, medium, site)
-            if medium_data:
-                entry_resp[site] = medium_data
+        return await self.db_controller.resolve_cached(query, medium)
+
+    async def __get_result_shared(self, cached_data, cached_id, query,
+                                  names, site: Site, medium: Medium,
+                                  timeout) -> tuple:
+        """
+        Get results from a site, concurrent lookups for the same query,
+        medium and site share one call to ``_get_result``.
+
+        Every caller gets the id back and caches it with the names it
+        found, so the results are still cached if the caller that made the
+        call is cancelled.
+
+        :param cached_data: the cached data.
 
-        return entry_resp, identifiers
+        :param cached_id: the cached id.
+
+        :param query: the search query.
+
+        :param names: the list of synonyms found so far.
+
+        :param site: the site.
+
+        :param medium: the medium type.
+
+        :param timeout:
+            The timeout in seconds for each HTTP request. Defualt is 3.
+
+        :return: Search results data and id in a tuple for that site.
+        """
+        res, _ = await self.__flights.do(
+            (normalize_name(query), medium, site), self._get_result,
+            cached_data, cached_id, query, names, site, medium, timeout
+        )
+        return res
 
     async def _get_result(self, cached_data, cached_id, query, names,
                           site: Site, medium: Medium, timeout) -> tuple:
@@ -631,53 +1157,121 @@ class Minoshiro:
         :return: Search results data and id in a tuple for that site.
         """
         try:
-            if site == Site.ANILIST:
-                return await self.__find_anilist(
-                    cached_data, cached_id, medium, query, timeout
-                )
+            res = await self.__find(
+                cached_data, cached_id, query, names, site, medium, timeout
+            )
+        except (RateLimitError, _Skipped) as e:
+            self.logger.debug(f'Skipped {site}: {e}')
+            return None, None
+        except Exception as e:
+            self.logger.warning(
+                f'Error raised when retriving data from {site}: {e}\n'
+                f'{format_exc()}'
+            )
+            return None, None
+        if not res[0] and medium in _SITE_MEDIUMS[site]:
+            try:
+                await self.db_controller.set_miss(query, medium, site)
+            except Exception as e:
+                self.logger.warning(f'Error caching miss for {site}: {e}')
+        return res
 
-            if site == Site.KITSU:
-                return await self.__find_kitsu(
-                    cached_id, medium, query, timeout
-                )
+    async def __call_site(self, site: Site, func, *args, **kwargs):
+        """
+        Search a site through its circuit breaker.
 
-            if site == site.MAL:
-                # 2018-10-05 Deprecating MAL
-                warn(
-                    "MyAnimeList functionality has been deprecated.",
-                    DeprecationWarning,
-                    stacklevel=2
-                )
-                pass
+        Only searches that reach the site are recorded by the breaker, so
+        cached results are still served while it's open.
 
-            if site == Site.ANIDB:
-                return await self.__find_anidb(cached_id, medium, query)
+        :param site: the site.
 
-            if site == Site.ANIMEPLANET:
-                return await self.__find_ani_planet(
-                    cached_id, medium, query, names, timeout
-                )
+        :param func: the coroutine function that searches the site.
 
-            if site == Site.MANGAUPDATES:
-                return await self.__find_manga_updates(
-                    cached_id, medium, query, names, timeout
-                )
+        :param args: the arguments for ``func``.
 
-            if site == Site.LNDB:
-                return await self.__find_lndb(
-                    cached_id, medium, query, names, timeout
-                )
+        :param kwargs: the keyword arguments for ``func``.
 
-            if site == Site.NOVELUPDATES:
-                return await self.__find_novel_updates(
-                    cached_id, medium, query, names, timeout
-                )
+        :return: the return value of ``func``.
 
-            if site == Site.VNDB:
-                return None, None
-        except Exception as e:
-            self.logger.warning(
-                f'Error raised when retriving data from {site}: {e}\n'
-                f'{format_exc()}'
+        :raises _Skipped: if the circuit breaker of the site is open.
+        """
+        breaker = self.breakers[site]
+        token = breaker.allow()
+        if token is None:
+            raise _Skipped('circuit breaker is open.')
+        start = self.loop.time()
+        try:
+            res = await func(*args, **kwargs)
+        except (RateLimitError, CancelledError):
+            breaker.release(token)
+            raise
+        except Exception:
+            breaker.record(False, self.loop.time() - start, token)
+            raise
+        breaker.record(True, self.loop.time() - start, token)
+        return res
+
+    async def __find(self, cached_data, cached_id, query, names,
+                     site: Site, medium: Medium, timeout) -> tuple:
+        """
+        Find the results from a site.
+
+        :param cached_data: the cached data.
+
+        :param cached_id: the cached id.
+
+        :param site: the site.
+
+        :param query: the search query.
+
+        :param medium: the medium type.
+
+        :param timeout:
+            The timeout in seconds for each HTTP request. Defualt is 3.
+
+        :return: Search results data and id in a tuple for that site.
+        """
+        if site == Site.ANILIST:
+            return await self.__find_anilist(
+                cached_data, cached_id, medium, query, timeout
+            )
+
+        if site == Site.KITSU:
+            return await self.__find_kitsu(
+                cached_id, medium, query, timeout
+            )
+
+        if site == site.MAL:
+            # 2018-10-05 Deprecating MAL
+            warn(
+                "MyAnimeList functionality has been deprecated.",
+                DeprecationWarning,
+                stacklevel=2
+            )
+            return None, None
+
+        if site == Site.ANIDB:
+            return await self.__find_anidb(cached_id, medium, query)
+
+        if site == Site.ANIMEPLANET:
+            return await self.__find_ani_planet(
+                cached_id, medium, query, names, timeout
             )
+
+        if site == Site.MANGAUPDATES:
+            return await self.__find_manga_updates(
+                cached_id, medium, query, names, timeout
+            )
+
+        if site == Site.LNDB:
+            return await self.__find_lndb(
+                cached_id, medium, query, names, timeout
+            )
+
+        if site == Site.NOVELUPDATES:
+            return await self.__find_novel_updates(
+                cached_id, medium, query, names, timeout
+            )
+
+        if site == Site.VNDB:
             return None, None
@@ -15,11 +15,9 @@ __all__ = ['cache_top_pages']
 
 
 async def cache_top_pages(medium: Medium, session_manager: SessionManager,
-                          db: DataController, mal_headers: dict,
-                          page_count: int, cache_mal_entries: int, logger):
+                          db: DataController, page_count: int, logger):
     """
-    Cache the top n pages of anime/manga from Anilist, and try to cache each
-    entry for MAL as well.
+    Cache the top n pages of anime/manga from Anilist.
 
     :param medium: The medium type.
 
@@ -27,50 +25,42 @@ async def cache_top_pages(medium: Medium, session_manager: SessionManager,
 
     :param db: the `DataController` instance.
 
-    :param mal_headers: dict of mal auth headers.
-
     :param page_count: the number of desired pages.
 
-    :param cache_mal_entries: The number of MAL entries to cache.
-
     :param logger: the logger object.
     """
     assert page_count > 0, 'Please enter a page count greater than 0.'
     await __cache(
         __n_popular_anilist(page_count, medium, session_manager, logger),
-        db, medium, logger
+        db, medium
     )
 
 
-async def __cache(async_iter, db, medium, mal_headers, session_manager,
-                  cache_mal_entries, logger):
+async def __cache(async_iter, db, medium):
     """
-    Cache entries from an `AsyncGenerator`
+    Cache entries from an `AsyncGenerator`, all entries are written to the
+    db in one go at the end.
 
     :param async_iter: the `AsyncGenerator`
 
     :param db: the `DataController` instance.
 
     :param medium: The medium type.
-
-    :param mal_headers: dict of mal auth headers.
-
-    :param session_manager: the `SessionManager` instance.
-
-    :param cache_mal_entries: The number of MAL entries to cache.
-
-    :param logger: the logger object.
     """
+    data_rows = []
+    id_rows = []
     async for entry in async_iter:
         anilist_id = str(entry['id'])
-        await db.set_medium_data(anilist_id, medium, Site.ANILIST, entry)
+        data_rows.append((anilist_id, medium, Site.ANILIST, entry))
         romanji_name = entry.get('title_romaji')
         english_name = entry.get('title_english')
         anime_name = romanji_name or english_name
         if not anime_name:
             continue
         for syn in get_synonyms(entry, Site.ANILIST):
-            await db.set_identifier(syn, medium, Site.ANILIST, anilist_id)
+            id_rows.append((syn, medium, Site.ANILIST, anilist_id))
+    await db.set_medium_data_bulk(data_rows)
+    await db.set_identifiers_bulk(id_rows)
 
 
 async def __n_popular_anilist(page_count: int, medium: Medium,
@@ -160,8 +150,10 @@ async def __cache_mal_entry(db, name, medium, mal_headers,
         return
     id_ = str(id_)
     title = mal_entry.get('title')
-    for syn in get_synonyms(mal_entry, Site.MAL):
-        await db.set_identifier(syn, medium, Site.MAL, id_)
+    await db.set_identifiers_bulk(
+        (syn, medium, Site.MAL, id_)
+        for syn in get_synonyms(mal_entry, Site.MAL)
+    )
     if title:
         await db.set_mal_title(id_, medium, title)
     await db.set_medium_data(id_, medium, Site.MAL, mal_entry)
@@ -0,0 +1,265 @@
+"""
+Pace outbound HTTP requests per host.
+"""
+from asyncio import TimeoutError, get_event_loop, wait_for
+from collections import deque
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+from aiohttp_wrapper import SessionManager
+
+from .enums import Priority
+
+__all__ = ['RateLimitError', 'RateLimiter', 'LimitedSession',
+           'DEFAULT_RATE_LIMITS']
+
+# {host: (requests per second, burst size)}
+DEFAULT_RATE_LIMITS = {
+    'graphql.anilist.co': (1.5, 10),
+    'kitsu.io': (5, 10),
+    'www.anime-planet.com': (1, 3),
+    'mangaupdates.com': (1, 3),
+    'lndb.info': (1, 3),
+    'www.novelupdates.com': (1, 3),
+}
+
+
+class RateLimitError(Exception):
+    """
+    Raised when a request can't be sent before its deadline.
+    """
+
+
+class _Host:
+    """
+    A token bucket and the queued requests for one host.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'lanes', 'handle')
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        self.lanes = {priority: deque() for priority in Priority}
+        self.handle = None
+
+    def refill(self, now: float):
+        """
+        Add the tokens earned since the last refill.
+
+        :param now: the current loop time.
+        """
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def ahead(self, priority: Priority) -> int:
+        """
+        :param priority: the priority of a new request.
+
+        :return:
+            The number of queued requests that go before a new request
+            with that priority.
+        """
+        return sum(len(self.lanes[p]) for p in Priority if p <= priority)
+
+
+class RateLimiter:
+    """
+    A token bucket rate limiter per host with two priority lanes.
+
+    Queued interactive requests always go before queued background requests.
+    """
+    __slots__ = ('limits', 'default', '_hosts', '_loop')
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]] = None,
+                 default: Tuple[float, int] = (5, 10), loop=None):
+        """
+        :param limits:
+            A dict of {host: (requests per second, burst size)}.
+            Defaults to ``DEFAULT_RATE_LIMITS``.
+
+        :param default: the limit for hosts not in ``limits``.
+
+        :param loop:
+            The asyncio event loop.
+            If None is provided will use the default event loop.
+        """
+        self.limits = DEFAULT_RATE_LIMITS if limits is None else limits
+        self.default = default
+        self._hosts = {}
+        self._loop = loop
+
+    @property
+    def loop(self):
+        """
+        :return: `self._loop` or a default event loop.
+        """
+        return self._loop or get_event_loop()
+
+    async def acquire(self, url: str, priority=Priority.INTERACTIVE,
+                      timeout: float = None):
+        """
+        Wait until a request to the host of the url can be sent.
+
+        :param url: the request url.
+
+        :param priority: the priority of the request.
+
+        :param timeout:
+            The max number of seconds to wait. If the request can't be sent
+            in time, fail at once instead of waiting. Default is None.
+
+        :raises RateLimitError: if the request can't be sent in time.
+        """
+        host = self.__host(urlsplit(str(url)).hostname or '')
+        host.refill(self.loop.time())
+        ahead = host.ahead(priority)
+        if not ahead and host.tokens >= 1:
+            host.tokens -= 1
+            return
+        wait_time = (ahead + 1 - host.tokens) / host.rate
+        if timeout is not None and wait_time > timeout:
+            raise RateLimitError(
+                f'Request to {url} can not be sent within {timeout} seconds.'
+            )
+        fut = self.loop.create_future()
+        host.lanes[priority].append(fut)
+        self.__schedule(host)
+        try:
+            await wait_for(fut, timeout)
+        except TimeoutError:
+            raise RateLimitError(
+                f'Request to {url} was not sent within {timeout} seconds.'
+            )
+        finally:
+            if fut in host.lanes[priority]:
+                host.lanes[priority].remove(fut)
+
+    def session(self, session_manager: SessionManager,
+                priority: Priority) -> 'LimitedSession':
+        """
+        Get a session manager that sends requests through this limiter.
+
+        :param session_manager: the `SessionManager` instance.
+
+        :param priority: the priority of the requests.
+
+        :return: the rate limited session manager.
+        """
+        return LimitedSession(session_manager, self, priority)
+
+    def __host(self, name: str) -> _Host:
+        """
+        Get the state for a host, create it if needed.
+
+        :param name: the host name.
+
+        :return: the host state.
+        """
+        host = self._hosts.get(name)
+        if not host:
+            rate, burst = self.limits.get(name, self.default)
+            host = self._hosts[name] = _Host(rate, burst, self.loop.time())
+        return host
+
+    def __schedule(self, host: _Host):
+        """
+        Wake up the queued requests of a host when it has a token.
+
+        :param host: the host state.
+        """
+        if host.handle:
+            return
+        host.refill(self.loop.time())
+        delay = max(0, (1 - host.tokens) / host.rate)
+        host.handle = self.loop.call_later(delay, self.__release, host)
+
+    def __release(self, host: _Host):
+        """
+        Hand out the tokens of a host to its queued requests,
+        in order of priority.
+
+        :param host: the host state.
+        """
+        host.handle = None
+        host.refill(self.loop.time())
+        for priority in sorted(Priority):
+            lane = host.lanes[priority]
+            while lane and host.tokens >= 1:
+                fut = lane.popleft()
+                if not fut.done():
+                    fut.set_result(None)
+                    host.tokens -= 1
+        if any(host.lanes.values()):
+            self.__schedule(host)
+
+
+class LimitedSession:
+    """
+    A `SessionManager` wrapper that sends requests through a `RateLimiter`.
+    """
+    __slots__ = ('session_manager', 'limiter', 'priority')
+
+    def __init__(self, session_manager: SessionManager,
+                 limiter: RateLimiter, priority: Priority):
+        """
+        :param session_manager: the `SessionManager` instance.
+
+        :param limiter: the `RateLimiter` instance.
+
+        :param priority: the priority of the requests.
+        """
+        self.session_manager = session_manager
+        self.limiter = limiter
+        self.priority = priority
+
+    def __getattr__(self, item):
+        return getattr(self.session_manager, item)
+
+    async def get(self, url, *args, **kwargs):
+        """
+        Make a rate limited HTTP GET request, see `SessionManager.get`
+        """
+        await self.__acquire(url, kwargs)
+        return await self.session_manager.get(url, *args, **kwargs)
+
+    async def post(self, url, *args, **kwargs):
+        """
+        Make a rate limited HTTP POST request, see `SessionManager.post`
+        """
+        await self.__acquire(url, kwargs)
+        return await self.session_manager.post(url, *args, **kwargs)
+
+    async def get_json(self, url, *args, **kwargs):
+        """
+        Get rate limited json content, see `SessionManager.get_json`
+        """
+        await self.__acquire(url, kwargs)
+        return await self.session_manager.get_json(url, *args, **kwargs)
+
+    async def __acquire(self, url, kwargs: dict):
+        """
+        Wait until a request can be sent, and take the time waited off the
+        timeout of the request.
+
+        :param url: the request url.
+
+        :param kwargs: the keyword arguments of the request.
+
+        :raises RateLimitError: if no time is left to send the request.
+        """
+        timeout = kwargs.get('timeout')
+        start = self.limiter.loop.time()
+        await self.limiter.acquire(url, self.priority, timeout)
+        waited = self.limiter.loop.time() - start
+        if timeout is None or waited <= 0:
+            return
+        if waited >= timeout:
+            raise RateLimitError(
+                f'Request to {url} has no time left after waiting '
+                f'{waited:.2f} seconds.'
+            )
+        kwargs['timeout'] = timeout - waited
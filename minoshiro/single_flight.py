@@ -0,0 +1,71 @@
+"""
+Coalesce concurrent identical lookups into one.
+"""
+from asyncio import ensure_future, shield
+from typing import Any, Callable, Hashable, Tuple
+
+__all__ = ['SingleFlight']
+
+
+class SingleFlight:
+    """
+    Make sure only one call for a given key is in flight at a time.
+
+    Callers that ask for a key while a call for that key is running wait for
+    that call instead of starting their own, and all of them get the same
+    result.
+    """
+    __slots__ = ('_flights', '_loop')
+
+    def __init__(self, loop=None):
+        """
+        :param loop:
+            The asyncio event loop.
+            If None is provided will use the default event loop.
+        """
+        self._flights = {}
+        self._loop = loop
+
+    def __len__(self):
+        """
+        :return: the number of calls in flight.
+        """
+        return len(self._flights)
+
+    async def do(self, key: Hashable, func: Callable,
+                 *args) -> Tuple[Any, bool]:
+        """
+        Call ``func(*args)`` unless a call for ``key`` is already in flight,
+        in which case wait for that call instead.
+
+        The call runs in its own task, so it keeps running if the caller that
+        started it is cancelled.
+
+        :param key: the key for the call.
+
+        :param func: a coroutine function.
+
+        :param args: the arguments for ``func``.
+
+        :return:
+            A tuple of (the result,
+            True if the call was started by another caller)
+        """
+        task = self._flights.get(key)
+        if task is not None:
+            return await shield(task), True
+        task = ensure_future(func(*args), loop=self._loop)
+        self._flights[key] = task
+        task.add_done_callback(lambda _: self.__land(key, task))
+        return await shield(task), False
+
+    def __land(self, key: Hashable, task):
+        """
+        Remove a finished call.
+
+        :param key: the key for the call.
+
+        :param task: the task for the call.
+        """
+        if self._flights.get(key) is task:
+            del self._flights[key]
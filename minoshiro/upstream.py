@@ -1,20 +1,32 @@
 """
 Pull synonyms data from upstream.
 """
+import os
+import zlib
+from json import dump, load
+from pathlib import Path
 from sqlite3 import connect
+from tempfile import mkstemp
 from time import time
-from typing import Tuple
+from typing import Optional, Tuple
 
 from aiohttp_wrapper import SessionManager
 
 from minoshiro.data import data_path
 
-__all__ = ['get_all_synonyms', 'download_anidb']
+__all__ = ['get_all_synonyms', 'get_synonyms', 'get_synonyms_paths',
+           'read_synonyms', 'download_anidb']
 
 __db_path = data_path.joinpath('synonyms.db')
 __revision_path = data_path.joinpath('revision')
+__prev_db_path = data_path.joinpath('synonyms.prev.db')
+__prev_revision_path = data_path.joinpath('revision.prev')
 __anidb_time_path = data_path.joinpath('.anidb_time')
 __anidb_xml_path = data_path.joinpath('anime-titles.xml')
+__anidb_headers_path = data_path.joinpath('.anidb_headers')
+
+_ANIDB_URL = 'http://anidb.net/api/anime-titles.xml.gz'
+_CHUNK_SIZE = 64 * 1024
 
 
 async def get_all_synonyms(session_manager) -> list:
@@ -31,20 +43,202 @@ async def get_all_synonyms(session_manager) -> list:
     return rows
 
 
+async def get_synonyms(
+        session_manager, revision: int = None
+) -> Tuple[Optional[int], list, list]:
+    """
+    Get the synonyms that changed since a revision.
+
+    :param session_manager: the `SessionManager` instance.
+
+    :param revision:
+        The revision of the synonyms imported last time, None for all.
+
+    :return:
+        A tuple of (the current revision, the synonyms, the synonyms
+        removed). The synonyms are empty if the revision is current, and
+        all synonyms if the changes since the revision are not known. A
+        synonym that changed is in both lists, its old row is removed.
+    """
+    current, path, previous = await get_synonyms_paths(
+        session_manager, revision
+    )
+    if path is None:
+        return current, [], []
+    return (current, *read_synonyms(path, previous))
+
+
+async def get_synonyms_paths(
+        session_manager, revision: int = None
+) -> Tuple[Optional[int], Optional[Path], Optional[Path]]:
+    """
+    Get the paths to the sqlite dbs of synonyms, download it if needed.
+
+    :param session_manager: the `SessionManager` instance.
+
+    :param revision:
+        The revision of the synonyms imported last time, None for all.
+
+    :return:
+        A tuple of (the current revision, the path to the current db,
+        the path to the db of ``revision``). The current db is None if the
+        revision is current, and the db of ``revision`` is None if it's
+        not kept.
+    """
+    await download_db(session_manager)
+    current = _read_revision(__revision_path)
+    if revision is not None and revision == current:
+        return current, None, None
+    if (revision is not None and __prev_db_path.is_file() and
+            _read_revision(__prev_revision_path) == revision):
+        return current, __db_path, __prev_db_path
+    return current, __db_path, None
+
+
+def read_synonyms(path: Path, previous: Path = None) -> Tuple[list, list]:
+    """
+    Read the synonyms from a sqlite db of synonyms.
+
+    :param path: the path to the db.
+
+    :param previous:
+        The path to an older db, only the rows that are not in it are read.
+
+    :return:
+        A tuple of (the synonyms, the rows of ``previous`` that are not in
+        the db anymore).
+    """
+    conn = connect(str(path))
+    try:
+        if previous is None:
+            return conn.execute('SELECT * FROM main.synonyms').fetchall(), []
+        conn.execute('ATTACH DATABASE ? AS previous', (str(previous),))
+        return conn.execute(
+            'SELECT * FROM main.synonyms '
+            'EXCEPT SELECT * FROM previous.synonyms'
+        ).fetchall(), conn.execute(
+            'SELECT * FROM previous.synonyms '
+            'EXCEPT SELECT * FROM main.synonyms'
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def _read_revision(path: Path) -> Optional[int]:
+    """
+    Read a revision file.
+
+    :param path: the path to the file.
+
+    :return: the revision, None if it can't be read.
+    """
+    try:
+        with path.open() as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
 async def download_anidb(session_manager: SessionManager, timestamp=None):
     """
+    Download the anidb data dump if it's missing or more than a day old.
+
+    The dump is decompressed while it's downloaded into a temporary file,
+    which replaces the dump only once it's complete, so readers never see a
+    partial dump. The request is conditional, an unchanged dump is not
+    downloaded again.
+
+    :param session_manager: the `SessionManager` instance.
+
+    :param timestamp: the time the dump was last checked if known.
 
-    :param session_manager:
-    :param timestamp:
     :return:
+        A tuple of (the dump on disk didn't change, the time the dump
+        was last checked)
     """
     good, new_time = check_anidb_download(timestamp)
-    if not good:
-        url = 'http://anidb.net/api/anime-titles.xml.gz'
-        async with await session_manager.get(url) as resp:
-            with __anidb_xml_path.open('wb') as f:
-                f.write(await resp.read())
-    return good, new_time
+    if good:
+        return good, new_time
+    headers = _read_anidb_headers() if __anidb_xml_path.is_file() else {}
+    async with await session_manager.get(
+            _ANIDB_URL, (200, 304), headers=headers) as resp:
+        if resp.status == 304:
+            changed = False
+        else:
+            await _save_anidb(resp)
+            changed = True
+    new_time = int(time())
+    with __anidb_time_path.open('w+') as f:
+        f.write(str(new_time))
+    return not changed, new_time
+
+
+async def _save_anidb(resp):
+    """
+    Stream an anidb data dump response into the dump file.
+
+    :param resp: the response.
+
+    :raises EOFError: if the dump in the response is incomplete.
+    """
+    decompressor = None
+    fd, tmp = mkstemp(prefix='.anime-titles.', dir=str(data_path))
+    try:
+        with open(fd, 'wb') as f:
+            async for chunk in resp.content.iter_chunked(_CHUNK_SIZE):
+                if decompressor is None:
+                    # The dump is gzipped, unless the server sent it with
+                    # a gzip content encoding that was already decoded.
+                    decompressor = (
+                        zlib.decompressobj(16 + zlib.MAX_WBITS)
+                        if chunk[:2] == b'\x1f\x8b' else _Identity()
+                    )
+                f.write(decompressor.decompress(chunk))
+            if decompressor is not None:
+                f.write(decompressor.flush())
+            if (decompressor is None or not decompressor.eof or
+                    decompressor.unused_data):
+                raise EOFError('The anidb data dump download is incomplete.')
+        os.replace(tmp, str(__anidb_xml_path))
+    except BaseException:
+        os.remove(tmp)
+        raise
+    headers = {
+        request: resp.headers[response] for request, response in (
+            ('If-None-Match', 'ETag'),
+            ('If-Modified-Since', 'Last-Modified')
+        ) if response in resp.headers
+    }
+    with __anidb_headers_path.open('w+') as f:
+        dump(headers, f)
+
+
+def _read_anidb_headers() -> dict:
+    """
+    Read the conditional request headers for the anidb data dump.
+
+    :return: a dict of {header: value}, empty if it can't be read.
+    """
+    try:
+        with __anidb_headers_path.open() as f:
+            return load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class _Identity:
+    """
+    A stand-in for a decompressor, for data that isn't compressed.
+    """
+    __slots__ = ()
+    eof = True
+    unused_data = b''
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
 
 
 async def check_revision(session_manager) -> Tuple[bool, int]:
@@ -80,28 +274,38 @@ async def download_db(session_manager):
            '/raw/master/synonyms.db')
     async with await session_manager.get(url) as resp:
         content = await resp.read()
+    save_db(content, new)
+
+
+def save_db(content: bytes, revision: int):
+    """
+    Save a downloaded database, and keep the one it replaces so only what
+    changed since has to be imported.
+
+    :param content: the database file content.
+
+    :param revision: the revision of the database.
+    """
+    if __db_path.is_file() and __revision_path.is_file():
+        __db_path.replace(__prev_db_path)
+        __revision_path.replace(__prev_revision_path)
     with __db_path.open('wb') as db, __revision_path.open('w+') as rev:
         db.write(content)
-        rev.write(str(new))
+        rev.write(str(revision))
 
 
 def check_anidb_download(timestamp=None):
     """
+    Check if the anidb data dump needs to be downloaded.
 
-    :param timestamp:
+    :param timestamp: the time the dump was last checked if known.
 
     :return:
+        A tuple of (the dump is good, the time the dump was last checked)
     """
-    now = int(time())
-    if not __db_path.is_file():
-        res, new = False, now
-    else:
-        res, new = check_time(timestamp)
-    if res:
-        return True, new
-    with __anidb_time_path.open('w+') as f:
-        f.write(str(now))
-    return False, now
+    if not __anidb_xml_path.is_file():
+        return False, timestamp
+    return check_time(timestamp)
 
 
 def check_time(timestamp=None):
@@ -1,75 +1,490 @@
 """
 Search AniDB for anime.
 """
-from difflib import SequenceMatcher
-from typing import Dict, Optional
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from gzip import GzipFile
+from io import BufferedReader, BytesIO
+from mmap import ACCESS_READ, mmap
+from pathlib import Path
+from struct import Struct
+from sys import byteorder, intern
+from tempfile import mkstemp
+from typing import (BinaryIO, Iterable, Iterator, List, Optional, Tuple,
+                    Union)
+from xml.etree.ElementTree import iterparse
 
-from xmltodict import parse
+from minoshiro.matching import closest
 
+_GZIP_MAGIC = b'\x1f\x8b'
 
-def process_xml(xml_string: str) -> Dict[str, dict]:
+_SNAPSHOT_MAGIC = b'MNANIDB\x00'
+_SNAPSHOT_VERSION = 1
+# magic, version, byte order, dump mtime in ns, dump size
+_HEADER = Struct('<8sIIqq')
+# names, lengths, order, anime, ids, title starts, titles, grams, posting
+# starts, postings, each string table is a blob and its offsets.
+_SECTIONS = ('name_offsets', 'names', 'lengths', 'order', 'anime',
+             'id_offsets', 'ids', 'title_starts', 'title_offsets', 'titles',
+             'gram_offsets', 'grams', 'posting_starts', 'postings')
+_TABLE = Struct(f'<{len(_SECTIONS) * 2}Q')
+_LITTLE = byteorder == 'little'
+
+# The snapshots mapped by `_open_snapshot`, by path.
+_snapshots = {}
+
+
+class _Strings:
+    """
+    A read only sequence of the strings in a blob of utf-8, with the
+    offsets of every string in another buffer.
+    """
+    __slots__ = ('blob', 'offsets')
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+
+class AnimeTitles:
+    """
+    The titles from the anidb data dump, every anime is a row in flat
+    columns and every lowercase title maps to the position of its anime.
+    """
+    __slots__ = ('ids', 'titles', 'positions')
+
+    def __init__(self):
+        self.ids = []
+        self.titles = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def add(self, id_: str, titles: Iterable[str]):
+        """
+        Add an anime.
+
+        :param id_: the anime id.
+
+        :param titles: the titles of the anime.
+        """
+        position = len(self.ids)
+        titles = tuple(intern(title) for title in titles)
+        self.ids.append(intern(id_))
+        self.titles.append(titles)
+        for title in titles:
+            self.positions[intern(title.lower())] = position
+
+    def anime(self, position: int) -> dict:
+        """
+        Get an anime.
+
+        :param position: the position of the anime.
+
+        :return: a dict {"id": the anime id, "titles": the list of titles}
+        """
+        return {'id': self.ids[position],
+                'titles': list(self.titles[position])}
+
+    def get(self, name: str) -> Optional[dict]:
+        """
+        Get the anime of a title.
+
+        :param name: the lowercase title.
+
+        :return: see `anime`, None if the title isn't found.
+        """
+        position = self.positions.get(name)
+        return None if position is None else self.anime(position)
+
+
+class TitleIndex:
+    """
+    A fuzzy index over the titles from the anidb data dump, it finds the few
+    titles that could match a search query so only those are compared.
+
+    A title can only reach a ratio of 0.85 with the query if their lengths
+    are close enough, and if they share enough character trigrams: with M
+    matching characters in k blocks, the blocks share at least M - 2k
+    trigrams, and the gaps between blocks hold at least k - 1 of the
+    T - 2M characters that don't match. That puts a lower bound of
+    T / 8 - 2 on the shared trigrams, T being the sum of both lengths.
+
+    The index is stored in flat arrays in one buffer, which is either built
+    in memory or memory mapped from a snapshot file, see `load_index`.
+    """
+    __slots__ = ('key', 'path', '__buffer', '__names', '__lengths', '__order',
+                 '__anime', '__ids', '__title_starts', '__titles', '__grams',
+                 '__posting_starts', '__postings')
+
+    def __init__(self, buffer, path: str = None):
+        """
+        :param buffer: the snapshot, as bytes or a memory map.
+
+        :param path: the path to the snapshot file if it's memory mapped.
+
+        :raises ValueError: if the buffer isn't a snapshot.
+        """
+        view = memoryview(buffer)
+        if len(view) < _HEADER.size + _TABLE.size:
+            raise ValueError('Truncated anidb index snapshot.')
+        magic, version, little, mtime, size = _HEADER.unpack_from(view)
+        if (magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION or
+                bool(little) != _LITTLE):
+            raise ValueError('Incompatible anidb index snapshot.')
+        table = _TABLE.unpack_from(view, _HEADER.size)
+        sections = {}
+        for i, name in enumerate(_SECTIONS):
+            start, length = table[2 * i], table[2 * i + 1]
+            if start + length > len(view):
+                raise ValueError('Truncated anidb index snapshot.')
+            section = view[start:start + length]
+            sections[name] = section if name in (
+                'names', 'ids', 'titles', 'grams'
+            ) else section.cast('I')
+        self.key = mtime, size
+        self.path = path
+        self.__buffer = buffer
+        self.__names = _Strings(sections['names'], sections['name_offsets'])
+        self.__lengths = sections['lengths']
+        self.__order = sections['order']
+        self.__anime = sections['anime']
+        self.__ids = _Strings(sections['ids'], sections['id_offsets'])
+        self.__title_starts = sections['title_starts']
+        self.__titles = _Strings(sections['titles'],
+                                 sections['title_offsets'])
+        self.__grams = _Strings(sections['grams'], sections['gram_offsets'])
+        self.__posting_starts = sections['posting_starts']
+        self.__postings = sections['postings']
+
+    @classmethod
+    def from_titles(cls, titles: AnimeTitles, key=(0, 0)):
+        """
+        Build the index in memory.
+
+        :param titles: the titles from `load_titles`
+
+        :param key: the (mtime in ns, size) of the data dump.
+
+        :return: the `TitleIndex`
+        """
+        return cls(_build_snapshot(titles, key))
+
+    def __len__(self):
+        return len(self.__names)
+
+    def __reduce__(self):
+        # A memory mapped index is pickled as its path, so other processes
+        # map the same file instead of getting a copy.
+        if self.path is None:
+            return TitleIndex, (bytes(self.__buffer),)
+        return _open_snapshot, (self.path, self.key)
+
+    def find(self, name: str) -> Optional[int]:
+        """
+        Find a title.
+
+        :param name: the lowercase title.
+
+        :return: the position of the title in the index if found.
+        """
+        lo = bisect_left(self.__lengths, len(name))
+        hi = bisect_right(self.__lengths, len(name), lo)
+        i = bisect_left(self.__names, name, lo, hi)
+        if i < hi and self.__names[i] == name:
+            return i
+
+    def anime(self, i: int) -> dict:
+        """
+        Get the anime of a title.
+
+        :param i: the position of the title in the index.
+
+        :return: a dict {"id": the anime id, "titles": the list of titles}
+        """
+        anime = self.__anime[i]
+        start, end = self.__title_starts[anime:anime + 2]
+        return {
+            'id': self.__ids[anime],
+            'titles': [self.__titles[j] for j in range(start, end)]
+        }
+
+    def candidates(self, query: str) -> List[Tuple[int, str]]:
+        """
+        Get the titles that could match a search query with a ratio of at
+        least 0.85.
+
+        :param query: the lowercase search query.
+
+        :return:
+            A list of (position in the index, title), in the order of the
+            titles in the data dump.
+        """
+        size = len(query)
+        # 2 * min(a, b) / (a + b) >= 0.85
+        lo = bisect_left(self.__lengths, (size * 85 + 114) // 115)
+        hi = bisect_right(self.__lengths, size * 115 // 85)
+        shared = Counter()
+        for gram in _trigrams(query):
+            i = bisect_left(self.__grams, gram)
+            if i == len(self.__grams) or self.__grams[i] != gram:
+                continue
+            posting = self.__postings[
+                self.__posting_starts[i]:self.__posting_starts[i + 1]
+            ]
+            shared.update(posting[bisect_left(posting, lo):
+                                  bisect_left(posting, hi)])
+        found = {
+            i for i, count in shared.items()
+            if 8 * (count + 2) >= self.__lengths[i] + size
+        }
+        # Short enough titles can match without sharing any trigram.
+        found.update(range(
+            lo, max(lo, min(hi, bisect_right(self.__lengths, 16 - size)))
+        ))
+        return [(i, self.__names[i])
+                for i in sorted(found, key=self.__order.__getitem__)]
+
+
+def load_titles(source: Union[str, Path, BinaryIO]) -> AnimeTitles:
+    """
+    Build the title index from the anidb data dump, the dump is parsed as a
+    stream so it's never all in memory at once.
+
+    :param source:
+        The path to the data dump or a binary file object of it, either can
+        be gzip compressed.
+
+    :return: the `AnimeTitles`
+    """
+    if isinstance(source, (str, Path)):
+        with open(source, 'rb') as f:
+            return load_titles(f)
+    if not hasattr(source, 'peek'):
+        source = BufferedReader(source)
+    if source.peek(2)[:2] == _GZIP_MAGIC:
+        source = GzipFile(fileobj=source)
+    res = AnimeTitles()
+    root = None
+    for event, elem in iterparse(source, ('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end' or elem.tag != 'anime':
+            continue
+        id_ = elem.get('aid')
+        titles = [title.text for title in elem.iter('title') if title.text]
+        if id_ and titles:
+            res.add(id_, titles)
+        # Drop the parsed elements so memory use stays flat.
+        root.clear()
+    return res
+
+
+def load_index(source: Union[str, Path, BinaryIO]) -> TitleIndex:
+    """
+    Get the fuzzy title index of the anidb data dump.
+
+    For a data dump on disk, the index is memory mapped from the snapshot
+    file next to it, so processes on the same host share it. The snapshot
+    is rebuilt if the data dump changed since it was written.
+
+    :param source: see `load_titles`
+
+    :return: the `TitleIndex`
+    """
+    if not isinstance(source, (str, Path)):
+        return TitleIndex.from_titles(load_titles(source))
+    source = Path(source)
+    snapshot = source.with_name(source.name + '.idx')
+    stat = source.stat()
+    key = stat.st_mtime_ns, stat.st_size
+    try:
+        index = _map_snapshot(snapshot)
+        if index.key == key:
+            return index
+    except (OSError, ValueError):
+        pass
+    buffer = _build_snapshot(load_titles(source), key)
+    fd, tmp = mkstemp(prefix=snapshot.name + '.', dir=str(source.parent))
+    try:
+        with open(fd, 'wb') as f:
+            f.write(buffer)
+        os.replace(tmp, str(snapshot))
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return _map_snapshot(snapshot)
+
+
+def process_xml(xml_string: str) -> AnimeTitles:
     """
     Process the xml string from the anidb data dump.
 
     :param xml_string: the xml string.
 
-    :return: A list of dict with keys "id" and "titles".
+    :return: the `AnimeTitles`
     """
-    parsed = parse(xml_string)
-    lst = parsed['animetitles']['anime']
-    res = {}
-    for anime in (__format_anime(entry) for entry in lst):
-        for name in anime['titles']:
-            res[name.lower()] = anime
-    return res
+    return load_titles(BytesIO(xml_string.encode()))
 
 
-def get_anime(query: str, anime_list: dict) -> Optional[dict]:
+def get_anime(query: str,
+              anime_list: Union[AnimeTitles, TitleIndex]) -> Optional[dict]:
     """
     Get an anime url from a list of animes.
 
     :param query: the search query.
 
-    :param anime_list: the list of animes.
+    :param anime_list:
+        the list of animes, a `TitleIndex` only compares the titles that
+        could match.
 
-    :return: the anime id if found, else None.
+    :return:
+        A new dict {"id": the anime id, "titles": the list of titles} if
+        found, else None.
     """
-    anime = anime_list.get(query.lower())
-    if anime:
-        return anime
-    max_ratio, match = 0, None
-    matcher = SequenceMatcher(b=query.lower())
-    for name, anime in anime_list.items():
-        matcher.set_seq1(name.lower())
-        ratio = matcher.ratio()
-        if ratio > 0.99:
-            return anime
-        if ratio > max_ratio and ratio >= 0.85:
-            max_ratio = ratio
-            match = anime
-    if match:
-        return match
+    query = query.lower()
+    if isinstance(anime_list, TitleIndex):
+        found = anime_list.find(query)
+        if found is None:
+            names = anime_list.candidates(query)
+    else:
+        found = anime_list.positions.get(query)
+        names = ((position, name)
+                 for name, position in anime_list.positions.items())
+    if found is None:
+        found = closest(
+            (query,), ((key, (name,), 0) for key, name in names), 0.85,
+            stop_above=0.99, normalized=True
+        )
+    return None if found is None else anime_list.anime(found)
 
 
-def __format_anime(anime_dict: dict) -> Optional[dict]:
+def _trigrams(name: str) -> Iterator[str]:
     """
-    Format an anime entry from the parsed xml string to a dict.
+    Yield the character trigrams of a name, a trigram that occurs more than
+    once is numbered so a set of them counts every occurrence.
 
-    :param anime_dict: the input anime dict.
+    :param name: the name.
 
-    :return: a dict {"id": the anime id, "titles": the list of titles}
+    :return: a generator that yields the trigrams.
     """
-    id_ = anime_dict.get('@aid')
-    titles = anime_dict.get('title')
-    if not titles or not id_:
-        return
-    try:
-        title_text = [t.get('#text') for t in titles]
-    except AttributeError:
-        _title = titles.get('#text')
-        if not _title:
-            return
-        title_text = [_title]
-    if not title_text:
-        return
-    return {'id': id_, 'titles': title_text}
+    seen = {}
+    for i in range(len(name) - 2):
+        gram = name[i:i + 3]
+        count = seen.get(gram, 0)
+        seen[gram] = count + 1
+        yield f'{gram}\x00{count}' if count else gram
+
+
+def _build_snapshot(titles: AnimeTitles, key) -> bytes:
+    """
+    Lay out the fuzzy title index in flat arrays.
+
+    :param titles: the titles from `load_titles`
+
+    :param key: the (mtime in ns, size) of the data dump.
+
+    :return: the snapshot.
+    """
+    names = sorted(
+        (len(name), name, order, anime)
+        for order, (name, anime) in enumerate(titles.positions.items())
+    )
+    postings = {}
+    for i, (_, name, _, _) in enumerate(names):
+        for gram in _trigrams(name):
+            postings.setdefault(gram, array('I')).append(i)
+    title_starts = array('I', [0])
+    titles_flat = []
+    for anime_titles in titles.titles:
+        titles_flat.extend(anime_titles)
+        title_starts.append(len(titles_flat))
+    grams = sorted(postings)
+    posting_starts = array('I', [0])
+    posting_column = array('I')
+    for gram in grams:
+        posting_column.extend(postings[gram])
+        posting_starts.append(len(posting_column))
+    name_offsets, name_blob = _string_table(row[1] for row in names)
+    id_offsets, id_blob = _string_table(titles.ids)
+    title_offsets, title_blob = _string_table(titles_flat)
+    gram_offsets, gram_blob = _string_table(grams)
+    sections = (
+        name_offsets, name_blob, array('I', (row[0] for row in names)),
+        array('I', (row[2] for row in names)),
+        array('I', (row[3] for row in names)), id_offsets,
+        id_blob, title_starts, title_offsets, title_blob, gram_offsets,
+        gram_blob, posting_starts, posting_column
+    )
+    out = bytearray(_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION,
+                                 _LITTLE, *key))
+    out.extend(bytes(_TABLE.size))
+    table = []
+    for section in sections:
+        data = section.tobytes() if isinstance(section, array) else section
+        # Keep the arrays aligned so they can be cast in place.
+        out.extend(bytes(-len(out) % 8))
+        table.extend((len(out), len(data)))
+        out.extend(data)
+    _TABLE.pack_into(out, _HEADER.size, *table)
+    return bytes(out)
+
+
+def _string_table(strings: Iterable[str]) -> Tuple[array, bytes]:
+    """
+    Pack strings into a blob of utf-8.
+
+    :param strings: the strings.
+
+    :return: a tuple of (the offsets of every string, the blob)
+    """
+    offsets = array('I', [0])
+    blob = bytearray()
+    for string in strings:
+        blob.extend(string.encode())
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def _map_snapshot(path: Path) -> TitleIndex:
+    """
+    Memory map a snapshot file.
+
+    :param path: the path to the snapshot.
+
+    :return: the `TitleIndex`
+    """
+    with path.open('rb') as f:
+        return TitleIndex(mmap(f.fileno(), 0, access=ACCESS_READ), str(path))
+
+
+def _open_snapshot(path: str, key) -> TitleIndex:
+    """
+    Get a memory mapped snapshot, the map is kept for the next call with
+    the same key.
+
+    :param path: the path to the snapshot.
+
+    :param key: the (mtime in ns, size) of the data dump.
+
+    :return: the `TitleIndex`
+    """
+    index = _snapshots.get(path)
+    if index is None or index.key != key:
+        index = _snapshots[path] = _map_snapshot(Path(path))
+    return index
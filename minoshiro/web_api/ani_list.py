@@ -1,10 +1,11 @@
-from difflib import SequenceMatcher
 from typing import List, Optional
 
 from aiohttp_wrapper import SessionManager
 
 from minoshiro.enums import Medium
 from minoshiro.helpers import filter_anime_manga
+from minoshiro.match_pool import run_match
+from minoshiro.matching import closest
 
 __escape_table = {
     '&': ' ',
@@ -40,45 +41,28 @@ def get_closest(query: str, thing_list: List[dict]) -> dict:
     :return: Closest matching anime by search query if found
                 else an empty dict.
     """
-    max_ratio, match = 0, None
-    matcher = SequenceMatcher(b=query.lower().strip())
-    for thing in thing_list:
-        ratio = match_max(thing, matcher)
-        if ratio > max_ratio and ratio >= 0.90:
-            max_ratio = ratio
-            match = thing
-    return match or {}
+    candidates = (__candidate(thing) for thing in thing_list)
+    return closest((query.strip(),), candidates, 0.90) or {}
 
 
-def match_max(thing: dict, matcher: SequenceMatcher) -> float:
+def __candidate(thing: dict) -> tuple:
     """
-    Get the max matched ratio for a given thing.
+    Get the names of a thing to match it by.
 
     :param thing: the thing.
 
-    :param matcher: the `SequenceMatcher` with the search query as seq2.
-
-    :return: the max matched ratio.
+    :return:
+        A tuple of (the thing, its names, the penalty for one shots),
+        see `minoshiro.matching.closest`
     """
-    thing_name_list = []
-    max_ratio = 0
-    if 'title' in thing and thing['title'] is not None:
-        for title in thing['title']:
-            if thing['title'][title]:
-                thing_name_list.append(thing['title'][title].lower())
-
+    names = []
+    if thing.get('title') is not None:
+        names.extend(title for title in thing['title'].values() if title)
     if 'synonyms' in thing:
-        for synonym in thing['synonyms']:
-            thing_name_list.append(synonym.lower())
-
-    for name in thing_name_list:
-        matcher.set_seq1(name.lower())
-        ratio = matcher.ratio()
-        if 'one shot' in thing['type'].lower():
-            ratio = ratio - .05
-        if ratio > max_ratio:
-            max_ratio = ratio
-    return max_ratio
+        names.extend(thing['synonyms'])
+    if names and 'one shot' in thing['type'].lower():
+        return thing, names, .05
+    return thing, names, 0
 
 
 async def get_entry_by_id(session_manager: SessionManager,
@@ -114,7 +98,7 @@ async def get_entry_by_id(session_manager: SessionManager,
 
 async def get_entry_details(session_manager: SessionManager,
                             medium: Medium, query: str,
-                            timeout=3) -> Optional[dict]:
+                            timeout=3, match_pool=None) -> Optional[dict]:
     """
     Get the details of an thing by search query.
 
@@ -127,6 +111,9 @@ async def get_entry_details(session_manager: SessionManager,
     :param timeout:
         The timeout in seconds for each HTTP request. Defualt is 3.
 
+    :param match_pool:
+        The `MatchPool` to match the results in, None to match them here.
+
     :return: dict with thing info.
     """
     if medium not in (Medium.ANIME, Medium.MANGA, Medium.LN):
@@ -141,7 +128,9 @@ async def get_entry_details(session_manager: SessionManager,
     async with await session_manager.post(
             __base_url, headers=headers, json=data, timeout=timeout) as resp:
         thing = await resp.json()
-    closest_entry = get_closest(query, thing['data']['Page']['media'])
+    closest_entry = await run_match(
+        match_pool, get_closest, query, thing['data']['Page']['media']
+    )
     return closest_entry
 
 
@@ -2,13 +2,15 @@
 Retrieve anime info from AnimePlanet.
 """
 from collections import deque
-from difflib import SequenceMatcher
 from itertools import chain
 from typing import List, Optional
 from urllib.parse import quote
 
 from pyquery import PyQuery
 
+from minoshiro.match_pool import run_match
+from minoshiro.matching import first_match
+
 
 def sanitize_search_text(text: str) -> str:
     """
@@ -20,7 +22,7 @@ def sanitize_search_text(text: str) -> str:
 
 
 async def get_anime_url(session_manager, query, names: list,
-                        timeout=3) -> Optional[str]:
+                        timeout=3, match_pool=None) -> Optional[str]:
     """
     Get anime url by search query.
 
@@ -33,6 +35,9 @@ async def get_anime_url(session_manager, query, names: list,
     :param timeout:
         The timeout in seconds for each HTTP request. Defualt is 3.
 
+    :param match_pool:
+        The `MatchPool` to match the results in, None to match them here.
+
     :return: the anime url if it's found.
     """
     query = sanitize_search_text(query)
@@ -53,13 +58,16 @@ async def get_anime_url(session_manager, query, names: list,
                         f'{PyQuery(entry).find("a").attr("href")}')
             }
             anime_list.append(anime)
-        return __get_closest(query, anime_list, names).get('url')
+        closest = await run_match(
+            match_pool, __get_closest, query, anime_list, names
+        )
+        return closest.get('url')
     return ap.find("meta[property='og:url']").attr('content')
 
 
 async def get_manga_url(session_manager, query,
                         names: list, author_name=None,
-                        timeout=3) -> Optional[str]:
+                        timeout=3, match_pool=None) -> Optional[str]:
     """
     Get manga url by search query.
 
@@ -74,6 +82,9 @@ async def get_manga_url(session_manager, query,
     :param timeout:
         The timeout in seconds for each HTTP request. Defualt is 3.
 
+    :param match_pool:
+        The `MatchPool` to match the results in, None to match them here.
+
     :return: the anime url if it's found.
     """
     params = {
@@ -121,7 +132,10 @@ async def get_manga_url(session_manager, query,
                     manga['title'] = manga['title'].replace('(', '')
                     manga['title'] = manga['title'].replace(')', '').strip()
 
-        return __get_closest(query, manga_list, names).get('url')
+        closest = await run_match(
+            match_pool, __get_closest, query, manga_list, names
+        )
+        return closest.get('url')
     else:
         return ap.find("meta[property='og:url']").attr('content')
 
@@ -161,11 +175,5 @@ def __get_closest(query: str, anime_list: List[dict], names) -> dict:
     :return:
         Closest matching anime by search query if found else an empty dict.
     """
-    for name in chain((query,), names):
-        matcher = SequenceMatcher(b=name.lower())
-        for anime in anime_list:
-            matcher.set_seq1(anime['title'].lower())
-            ratio = matcher.ratio()
-            if ratio >= 0.85:
-                return anime
-    return {}
+    candidates = [(anime, (anime['title'],), 0) for anime in anime_list]
+    return first_match(chain((query,), names), candidates, 0.85) or {}
@@ -1,13 +1,14 @@
 """
 Handles all Kitsu api calls
 """
-from difflib import SequenceMatcher
 from typing import List, Optional
 from urllib.parse import quote
 
 from aiohttp_wrapper import SessionManager
 
 from minoshiro.enums import Medium
+from minoshiro.match_pool import run_match
+from minoshiro.matching import closest
 
 
 def get_closest(query: str, thing_list: List[dict]) -> dict:
@@ -21,50 +22,33 @@ def get_closest(query: str, thing_list: List[dict]) -> dict:
     :return: Closest matching anime by search query if found
                 else an empty dict.
     """
-    max_ratio, match = 0, None
-    matcher = SequenceMatcher(b=query.lower().strip())
-    for thing in thing_list:
-        ratio = match_max(thing, matcher)
-        if ratio == 1.0:
-            return thing
-        if ratio > max_ratio and ratio >= 0.90:
-            max_ratio = ratio
-            match = thing
-    return match
-
-
-def match_max(thing: dict, matcher: SequenceMatcher) -> float:
+    candidates = (__candidate(thing) for thing in thing_list)
+    return closest((query.strip(),), candidates, 0.90)
+
+
+def __candidate(thing: dict) -> tuple:
     """
-    Get the max matched ratio for a given thing.
+    Get the names of a thing to match it by.
 
     :param thing: the thing.
 
-    :param matcher: the `SequenceMatcher` with the search query as seq2.
-
-    :return: the max matched ratio.
+    :return:
+        A tuple of (the thing, its names, the penalty for one shots),
+        see `minoshiro.matching.closest`
     """
     attributes = thing['attributes']
-    thing_name_list = []
-    max_ratio = 0
+    names = []
     if 'canonicalTitle' in attributes:
-        thing_name_list.append(attributes['canonicalTitle'].lower())
-
-    if 'titles' in attributes and attributes['titles'] is not None:
-        for title in attributes['titles']:
-            if attributes['titles'][title]:
-                thing_name_list.append(attributes['titles'][title].lower())
-
+        names.append(attributes['canonicalTitle'])
+    if attributes.get('titles') is not None:
+        names.extend(
+            title for title in attributes['titles'].values() if title
+        )
     if attributes.get('abbreviatedTitles'):
-        for title in attributes['abbreviatedTitles']:
-            thing_name_list.append(title.lower())
-    for name in thing_name_list:
-        matcher.set_seq1(name.lower())
-        ratio = matcher.ratio()
-        if 'one shot' in thing['type'].lower():
-            ratio = ratio - .05
-        if ratio > max_ratio:
-            max_ratio = ratio
-    return max_ratio
+        names.extend(attributes['abbreviatedTitles'])
+    if names and 'one shot' in thing['type'].lower():
+        return thing, names, .05
+    return thing, names, 0
 
 
 class Kitsu:
@@ -84,8 +68,9 @@ class Kitsu:
         self.session_manager = session_manager
         self.base_url = 'https://kitsu.io/api/edge/'
 
-    async def search_entries(self, medium: Medium,
-                             query: str, timeout: int = 3) -> Optional[dict]:
+    async def search_entries(self, medium: Medium, query: str,
+                             timeout: int = 3,
+                             match_pool=None) -> Optional[dict]:
         """
         Get the details of an thing by search query.
 
@@ -96,6 +81,10 @@ class Kitsu:
         :param timeout:
             The timeout in seconds for each HTTP request. Defualt is 3.
 
+        :param match_pool:
+            The `MatchPool` to match the results in, None to match them
+            here.
+
         :return: dict with thing info.
         """
         medium_str = 'anime' if medium == Medium.ANIME else 'manga'
@@ -109,7 +98,9 @@ class Kitsu:
             url, headers=headers, timeout=timeout
         )
         if js:
-            closest_entry = get_closest(query, js['data'])
+            closest_entry = await run_match(
+                match_pool, get_closest, query, js['data']
+            )
             if closest_entry:
                 closest_entry['url'] = (
                     f'https://kitsu.io/{medium_str}/'
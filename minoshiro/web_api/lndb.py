@@ -1,16 +1,19 @@
 """
 Search LNDB for anime.
 """
-from difflib import SequenceMatcher
+from itertools import chain
 from typing import List, Optional
 
 from aiohttp_wrapper import SessionManager
 from pyquery import PyQuery
 
+from minoshiro.match_pool import run_match
+from minoshiro.matching import closest
+
 
 async def get_light_novel_url(
         session_manager: SessionManager,
-        query, names, timeout=3) -> Optional[dict]:
+        query, names, timeout=3, match_pool=None) -> Optional[dict]:
     """
     Get ln url by search query.
 
@@ -23,6 +26,9 @@ async def get_light_novel_url(
     :param timeout:
         The timeout in seconds for each HTTP request. Defualt is 3.
 
+    :param match_pool:
+        The `MatchPool` to match the results in, None to match them here.
+
     :return: the ln url if it's found.
     """
     query = query.replace(' ', '+')
@@ -46,7 +52,7 @@ async def get_light_novel_url(
                 'url': PyQuery(thing).find('a').attr('href')
             }
             ln_list.append(data)
-    return __get_closest(query, ln_list, names)
+    return await run_match(match_pool, __get_closest, query, ln_list, names)
 
 
 def get_light_novel_by_id(ln_id) -> str:
@@ -73,18 +79,5 @@ def __get_closest(query: str, ln_list: List[dict], names) -> dict:
     :return:
         Closest matching novel by search query if found else an empty dict.
     """
-    synonyms_list = names
-    synonyms_list.insert(0, query)
-    match = None
-    for name in synonyms_list:
-        max_ratio = 0
-        matcher = SequenceMatcher(b=name.lower())
-        for ln in ln_list:
-            matcher.set_seq1(ln['title'].lower())
-            ratio = matcher.ratio()
-            if ratio > max_ratio and ratio >= 0.85:
-                max_ratio = ratio
-                match = ln
-        if match:
-            break
-    return match or {}
+    candidates = [(ln, (ln['title'],), 0) for ln in ln_list]
+    return closest(chain((query,), names), candidates, 0.85) or {}
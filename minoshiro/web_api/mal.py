@@ -3,16 +3,18 @@ Search MAL for anime/manga/lightnovels.
 """
 
 import xml.etree.cElementTree as ET
-from difflib import SequenceMatcher
 from typing import List, Optional
 from urllib.parse import quote
 
 from minoshiro.enums import Medium
+from minoshiro.match_pool import run_match
+from minoshiro.matching import closest
 
 
 async def get_entry_details(session_manager, header_info: dict,
                             medium: Medium, query: str,
-                            thing_id: str = None, timeout=3) -> Optional[dict]:
+                            thing_id: str = None, timeout=3,
+                            match_pool=None) -> Optional[dict]:
     """
     Get the details of an thing by search query.
 
@@ -29,6 +31,9 @@ async def get_entry_details(session_manager, header_info: dict,
     :param timeout:
         The timeout in seconds for each HTTP request. Defualt is 3.
 
+    :param match_pool:
+        The `MatchPool` to match the results in, None to match them here.
+
     :return: dict with thing info.
     """
     medium_str = 'anime' if medium == Medium.ANIME else 'manga'
@@ -83,7 +88,9 @@ async def get_entry_details(session_manager, header_info: dict,
     if thing_id:
         return __get_thing_by_id(thing_id, thing_list)
     else:
-        return __get_closest(query.strip(), thing_list)
+        return await run_match(
+            match_pool, __get_closest, query.strip(), thing_list
+        )
 
 
 def __get_closest(query: str, thing_list: List[dict]) -> dict:
@@ -97,38 +104,11 @@ def __get_closest(query: str, thing_list: List[dict]) -> dict:
     :return: Closest matching anime by search query if found
                 else an empty dict.
     """
-    max_ratio, match = 0, None
-    matcher = SequenceMatcher(b=query.lower().strip())
-    for thing in thing_list:
-        ratio = __match_max(thing, matcher)
-        if ratio > max_ratio and ratio >= 0.90:
-            max_ratio = ratio
-            match = thing
-    return match or {}
-
-
-def __match_max(thing: dict, matcher: SequenceMatcher) -> float:
-    """
-    Get the max matched ratio for a given thing.
-
-    :param thing: the thing.
-
-    :param matcher: the `SequenceMatcher` with the search query as seq2.
-
-    :return: the max matched ratio.
-    """
-    max_ratio = 0
-    matcher.set_seq1(thing['title'].lower())
-    ratio = matcher.ratio()
-    if ratio > max_ratio:
-        max_ratio = ratio
-    if thing['synonyms']:
-        for synonym in thing['synonyms']:
-            matcher.set_seq1(synonym.lower())
-            ratio = matcher.ratio()
-            if ratio > max_ratio:
-                max_ratio = ratio
-    return max_ratio
+    candidates = (
+        (thing, [thing['title'], *(thing['synonyms'] or ())], 0)
+        for thing in thing_list
+    )
+    return closest((query.strip(),), candidates, 0.90) or {}
 
 
 def __get_thing_by_id(thing_id: str,
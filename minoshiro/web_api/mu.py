@@ -2,15 +2,18 @@
 MU.py
 Handles all MangaUpdates information
 """
-from difflib import SequenceMatcher
+from itertools import chain
 from typing import List
 from urllib.parse import quote
 
 from pyquery import PyQuery
 
+from minoshiro.match_pool import run_match
+from minoshiro.matching import closest
+
 
 async def get_manga_url(session_manager, query,
-                        names: list, timeout=3) -> dict:
+                        names: list, timeout=3, match_pool=None) -> dict:
     """
     Get manga url by search query.
 
@@ -23,6 +26,9 @@ async def get_manga_url(session_manager, query,
     :param timeout:
         The timeout in seconds for each HTTP request. Defualt is 3.
 
+    :param match_pool:
+        The `MatchPool` to match the results in, None to match them here.
+
     :return: the manga url if it's found.
     """
     params = {
@@ -46,7 +52,7 @@ async def get_manga_url(session_manager, query,
                 'rating': PyQuery(thing).find('.col4').text()
             }
             manga_list.append(data)
-    return __get_closest(query, manga_list, names)
+    return await run_match(match_pool, __get_closest, query, manga_list, names)
 
 
 def get_manga_url_by_id(manga_id) -> str:
@@ -73,18 +79,5 @@ def __get_closest(query: str, manga_list: List[dict], names) -> dict:
     :return:
         Closest matching manga by search query if found else an empty dict.
     """
-    synonyms_list = names
-    synonyms_list.insert(0, query)
-    match = None
-    for name in synonyms_list:
-        max_ratio = 0
-        matcher = SequenceMatcher(b=name.lower())
-        for manga in manga_list:
-            matcher.set_seq1(manga['title'].lower())
-            ratio = matcher.ratio()
-            if ratio > max_ratio and ratio >= 0.85:
-                max_ratio = ratio
-                match = manga
-        if match:
-            break
-    return match or {}
+    candidates = [(manga, (manga['title'],), 0) for manga in manga_list]
+    return closest(chain((query,), names), candidates, 0.85) or {}
@@ -2,9 +2,13 @@ from json import load
 from pathlib import Path
 from sqlite3 import connect
 
+import pytest
 from asyncpg import create_pool
 
-__all__ = ['test_data_path', 'get_pool', 'SCHEMA', 'clear_sqlite']
+from minoshiro import upstream
+
+__all__ = ['test_data_path', 'get_pool', 'SCHEMA', 'clear_sqlite',
+           'synonyms']
 
 test_data_path = Path(Path(__file__).parent.joinpath('test_data'))
 SCHEMA = 'robotesting'
@@ -48,8 +52,49 @@ def clear_sqlite(path):
     with connect(path) as conn:
         conn.execute('DROP TABLE lookup')
         conn.execute('DROP TABLE mal')
+        conn.execute('DROP TABLE miss')
+        conn.execute('DROP TABLE meta')
         conn.execute('DROP TABLE anime')
         conn.execute('DROP TABLE manga')
         conn.execute('DROP TABLE ln')
         conn.execute('DROP TABLE vn')
         conn.commit()
+
+
+@pytest.fixture()
+def synonyms(monkeypatch):
+    """
+    Keep the upstream synonyms db in the test data folder instead of
+    downloading it.
+
+    :return: a function that publishes a list of synonym rows as a revision.
+    """
+    paths = {
+        name: test_data_path.joinpath(file) for name, file in (
+            ('__db_path', 'synonyms.db'),
+            ('__revision_path', 'revision'),
+            ('__prev_db_path', 'synonyms.prev.db'),
+            ('__prev_revision_path', 'revision.prev')
+        )
+    }
+    for name, path in paths.items():
+        monkeypatch.setattr(upstream, name, path)
+
+    async def download_db(session_manager):
+        pass
+
+    def publish(rows, revision):
+        path = test_data_path.joinpath('synonyms.tmp.db')
+        conn = connect(str(path))
+        conn.execute('CREATE TABLE synonyms(name, type, dblinks)')
+        conn.executemany('INSERT INTO synonyms VALUES (?, ?, ?)', rows)
+        conn.commit()
+        conn.close()
+        upstream.save_db(path.read_bytes(), revision)
+        path.unlink()
+
+    monkeypatch.setattr(upstream, 'download_db', download_db)
+    yield publish
+    for path in paths.values():
+        if path.exists():
+            path.unlink()
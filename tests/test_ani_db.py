@@ -0,0 +1,106 @@
+from gzip import compress
+from io import BytesIO
+
+from minoshiro.web_api.ani_db import (
+    AnimeTitles, TitleIndex, get_anime, load_index, load_titles, process_xml
+)
+
+XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<animetitles>
+  <anime aid="1">
+    <title xml:lang="x-jat" type="main">Seikai no Monshou</title>
+    <title xml:lang="en" type="official">Crest of the Stars</title>
+  </anime>
+  <anime aid="2">
+    <title xml:lang="x-jat" type="main">Steins;Gate</title>
+  </anime>
+  <anime aid="3"></anime>
+</animetitles>
+"""
+
+
+def test_load_titles():
+    """
+    Test the title index is the same from plain and gzip data dumps.
+    """
+    res = load_titles(BytesIO(XML))
+    crest = {'id': '1', 'titles': ['Seikai no Monshou', 'Crest of the Stars']}
+    assert {name: res.get(name) for name in res} == {
+        'seikai no monshou': crest,
+        'crest of the stars': crest,
+        'steins;gate': {'id': '2', 'titles': ['Steins;Gate']},
+    }
+    assert res.positions['seikai no monshou'] == res.positions[
+        'crest of the stars'
+    ]
+    gzipped = load_titles(BytesIO(compress(XML)))
+    assert gzipped.positions == res.positions
+    assert gzipped.titles == res.titles
+    assert process_xml(XML.decode()).ids == res.ids
+    assert get_anime('Crest of the Star', res) == crest
+
+
+def test_fresh_results():
+    """
+    Test changing a result doesn't change the titles.
+    """
+    res = load_titles(BytesIO(XML))
+    index = TitleIndex.from_titles(res)
+    for titles in (res, index):
+        anime = get_anime('Steins;Gate', titles)
+        anime['url'] = 'https://anidb.net'
+        anime['titles'].append('Steins Gate')
+        assert get_anime('Steins;Gate', titles) == {
+            'id': '2', 'titles': ['Steins;Gate']
+        }
+
+
+def test_title_index():
+    """
+    Test the fuzzy title index finds the same matches as comparing every
+    title.
+    """
+    titles = AnimeTitles()
+    for i, name in enumerate((
+            'Seikai no Monshou', 'Seikai no Senki', 'Steins;Gate',
+            'Steins;Gate 0', 'Crest of the Stars', 'Banner of the Stars',
+            'Gate', 'K', 'Kanon', 'Kanon (2006)', 'Cowboy Bebop',
+            'Cowboy Bebop: Tengoku no Tobira')):
+        titles.add(str(i), [name])
+    index = TitleIndex.from_titles(titles)
+    assert len(index) == len(titles)
+    for query in ('Seikai no Monshoe', 'Seikai no Senk', 'Steins Gate',
+                  'Steins;Gate 1', 'Crest of the Star', 'Banner of Stars',
+                  'Gat', 'Kanon 2006', 'Kanno', 'Cowboy Bebop Tengoku',
+                  'Cowboy Bebo', 'K', 'Q', 'Nothing like it at all'):
+        assert get_anime(query, index) == get_anime(query, titles)
+    assert get_anime('Cowboy Bebo', index)['id'] == '10'
+    assert get_anime('Nothing like it at all', index) is None
+
+
+def test_load_index(tmp_path):
+    """
+    Test the index snapshot is written next to the data dump, mapped on
+    later loads, and rebuilt when the data dump changes.
+    """
+    dump = tmp_path.joinpath('anime-titles.xml')
+    dump.write_bytes(compress(XML))
+    index = load_index(dump)
+    snapshot = tmp_path.joinpath('anime-titles.xml.idx')
+    assert snapshot.is_file()
+    assert len(index) == 3
+    assert get_anime('steins;gate', index) == {
+        'id': '2', 'titles': ['Steins;Gate']
+    }
+    assert get_anime('Crest of the Star', load_index(dump)) == {
+        'id': '1', 'titles': ['Seikai no Monshou', 'Crest of the Stars']
+    }
+    assert load_index(dump).key == index.key
+
+    dump.write_bytes(XML.replace(b'Steins;Gate', b'Steins;Gate 0'))
+    index = load_index(dump)
+    assert get_anime('steins;gate 0', index)['id'] == '2'
+    assert get_anime('Nothing like it', index) is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'anime-titles.xml', 'anime-titles.xml.idx'
+    ]
@@ -0,0 +1,93 @@
+from minoshiro.circuit_breaker import CircuitBreaker
+from minoshiro.enums import BreakerState
+from tests.utils import Clock
+
+
+def test_open_on_failures():
+    """
+    Test the breaker opens once the failure rate is reached, and rejects
+    calls while open.
+    """
+    clock = Clock()
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4,
+                             probe_interval=10, clock=clock)
+    for success in (True, False, True):
+        assert breaker.allow()
+        breaker.record(success, 0.1)
+    assert breaker.state == BreakerState.CLOSED
+    breaker.record(False, 0.1)
+    assert breaker.state == BreakerState.OPEN
+    assert not breaker.allow()
+
+
+def test_slow_calls():
+    """
+    Test slow calls count as failures.
+    """
+    breaker = CircuitBreaker(slow_call=1, window=2, min_calls=2)
+    breaker.record(True, 2)
+    breaker.record(True, 3)
+    assert breaker.state == BreakerState.OPEN
+
+
+def test_half_open():
+    """
+    Test the breaker lets one probe through after the probe interval,
+    and closes or opens again based on the probe result.
+    """
+    clock = Clock()
+    breaker = CircuitBreaker(window=1, min_calls=1, probe_interval=10,
+                             clock=clock)
+    breaker.record(False, 0)
+    clock.now = 10
+    assert breaker.state == BreakerState.HALF_OPEN
+    token = breaker.allow()
+    assert token
+    assert not breaker.allow()
+    breaker.record(False, 0, token)
+    assert breaker.state == BreakerState.OPEN
+
+    clock.now = 20
+    token = breaker.allow()
+    assert token
+    breaker.record(True, 0, token)
+    assert breaker.state == BreakerState.CLOSED
+    assert breaker.allow()
+
+
+def test_late_calls():
+    """
+    Test calls that end after the state changed don't count.
+    """
+    clock = Clock()
+    breaker = CircuitBreaker(window=2, min_calls=2, probe_interval=10,
+                             clock=clock)
+    first, second, late = breaker.allow(), breaker.allow(), breaker.allow()
+    breaker.record(False, 0, first)
+    breaker.record(False, 0, second)
+    assert breaker.state == BreakerState.OPEN
+
+    # Calls sent while closed that end after the breaker opened don't
+    # keep it open for longer.
+    clock.now = 5
+    breaker.record(False, 0, late)
+    breaker.record(False, 0)
+
+    # Calls sent while closed that end while half open, and a call that
+    # wasn't the probe.
+    clock.now = 10
+    assert breaker.state == BreakerState.HALF_OPEN
+    probe = breaker.allow()
+    breaker.record(True, 0, late)
+    breaker.record(False, 0, first)
+    breaker.record(False, 0)
+    breaker.release(late)
+    assert not breaker.allow()
+    assert breaker.state == BreakerState.HALF_OPEN
+    breaker.record(True, 0, probe)
+    assert breaker.state == BreakerState.CLOSED
+
+    # The probe's outcome doesn't count again once it closed the breaker.
+    breaker.record(False, 0, probe)
+    breaker.record(False, 0, probe)
+    assert breaker.state == BreakerState.CLOSED
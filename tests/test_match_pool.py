@@ -0,0 +1,62 @@
+from asyncio import gather
+from gzip import compress
+from pickle import dumps
+
+import pytest
+
+from minoshiro.match_pool import MatchPool, run_match
+from minoshiro.web_api import ani_db, ani_list
+from .test_ani_db import XML
+
+pytestmark = pytest.mark.asyncio
+
+MEDIA = [
+    {'title': {'romaji': 'Steins;Gate', 'english': None},
+     'synonyms': [], 'type': 'ANIME'},
+    {'title': {'romaji': 'Steins;Gate 0', 'english': None},
+     'synonyms': ['SG0'], 'type': 'ANIME'},
+]
+
+
+async def test_run():
+    """
+    Test calls made together are batched to the workers, and give the same
+    results as calling the functions here.
+    """
+    pool = MatchPool(2, batch_size=2)
+    queries = ['Steins;Gate', 'Steins Gate 0', 'sg0', 'Nothing']
+    try:
+        res = await gather(*(
+            pool.run(ani_list.get_closest, query, MEDIA) for query in queries
+        ))
+        assert res == [ani_list.get_closest(query, MEDIA)
+                       for query in queries]
+        with pytest.raises(ZeroDivisionError):
+            await pool.run(divmod, 1, 0)
+    finally:
+        await pool.close()
+    assert await run_match(None, divmod, 7, 2) == (3, 1)
+
+
+async def test_anidb_index(tmp_path):
+    """
+    Test a memory mapped anidb index is sent to the workers as its path.
+    """
+    dump = tmp_path.joinpath('anime-titles.xml')
+    dump.write_bytes(compress(XML))
+    index = ani_db.load_index(dump)
+    assert index.path == str(tmp_path.joinpath('anime-titles.xml.idx'))
+    assert len(dumps(index)) < 1024
+    pool = MatchPool(1)
+    try:
+        res = await gather(*(
+            pool.run(ani_db.get_anime, query, index)
+            for query in ('Crest of the Star', 'steins;gate', 'Nothing')
+        ))
+    finally:
+        await pool.close()
+    assert res == [
+        {'id': '1', 'titles': ['Seikai no Monshou', 'Crest of the Stars']},
+        {'id': '2', 'titles': ['Steins;Gate']},
+        None
+    ]
@@ -0,0 +1,46 @@
+from difflib import SequenceMatcher
+
+from minoshiro.matching import closest, first_match
+from minoshiro.web_api import mu
+
+TITLES = ['Steins;Gate', 'Steins;Gate 0', 'Sword Art Online', 'One Piece',
+          'Kimi no Na wa.', 'Gate', '']
+
+
+def _closest(query, candidates, threshold):
+    """
+    Compare every name, the way the sites did it before.
+    """
+    best, match = 0, None
+    for res, names, penalty in candidates:
+        for name in names:
+            ratio = SequenceMatcher(
+                b=query.lower(), a=name.lower()).ratio() - penalty
+            if ratio > best and ratio >= threshold:
+                best, match = ratio, res
+    return match
+
+
+def test_closest():
+    """
+    Test pruning doesn't change which candidate is the closest.
+    """
+    candidates = [(i, (title, title[::-1]), 0.05 * (i % 2))
+                  for i, title in enumerate(TITLES)]
+    for query in TITLES + ['steins gate', 'GATE', 'one pice', 'xyz']:
+        for threshold in (0.5, 0.85, 0.9):
+            assert closest((query,), candidates, threshold) == \
+                _closest(query, candidates, threshold)
+    assert closest(('nothing', 'one piece'), candidates, 0.85) == 3
+    assert first_match(('gate',), candidates, 0.5) == 0
+
+
+def test_names_unchanged():
+    """
+    Test the known names aren't changed by matching.
+    """
+    names = ['Steins Gate']
+    manga = [{'title': title} for title in TITLES]
+    res = getattr(mu, '__get_closest')('nothing', manga, names)
+    assert res == {'title': 'Steins;Gate'}
+    assert names == ['Steins Gate']
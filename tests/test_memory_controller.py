@@ -0,0 +1,83 @@
+from random import randint
+
+import pytest
+
+from minoshiro.data_controller import MemoryCachedController, SqliteController
+from minoshiro.data_controller.memory_controller import LRUCache
+from minoshiro.enums import Medium, Site
+from tests import clear_sqlite, test_data_path
+from tests.utils import *
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+async def memory_controller():
+    path = str(test_data_path.joinpath('test_db'))
+    res = MemoryCachedController(await SqliteController.get_instance(path))
+    yield res
+    await res.close()
+    clear_sqlite(path)
+
+
+async def test_lru():
+    """
+    Test entries are evicted by count, by size and by age.
+    """
+    clock = Clock()
+    cache = LRUCache(max_entries=2, max_bytes=100, ttl=10, clock=clock)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    cache.put('d', 'x' * 96)
+    assert len(cache) == 1 and cache.size <= 100
+    stats = cache.stats()
+    assert cache.peek('d') == 'x' * 96 and cache.peek('a') is None
+    assert cache.stats() == stats
+    clock.now = 10
+    assert cache.peek('d') is None
+    assert cache.get('d') is None
+    assert cache.stats()['evictions'] == 3
+
+
+async def test_read_through(memory_controller: MemoryCachedController):
+    """
+    Test reads and writes populate the memory cache, and reads are served
+    from memory after that.
+    """
+    ids = set(random_str() for _ in range(randint(5, 15)))
+    for id_ in ids:
+        name = f'name {id_}'
+        sites = random_sites()
+        tmp = {}
+        for site in sites:
+            tmp[site] = random_dict()
+            await memory_controller.set_identifier(name, Medium.ANIME,
+                                                   site, id_)
+            await memory_controller.set_medium_data(id_, Medium.ANIME,
+                                                    site, tmp[site])
+        assert await memory_controller.get_medium_data(
+            name, Medium.ANIME
+        ) == tmp
+        hits = memory_controller.stats()['hits']
+        assert await memory_controller.get_medium_data(
+            name, Medium.ANIME
+        ) == tmp
+        assert memory_controller.stats()['hits'] == hits + len(sites) + 1
+        stats = memory_controller.stats()
+        await memory_controller.set_identifier(name, Medium.ANIME,
+                                               sites[0], id_)
+        assert memory_controller.stats()['hits'] == stats['hits']
+        assert memory_controller.stats()['misses'] == stats['misses']
+        assert await memory_controller.resolve_cached_many(
+            [name], Medium.ANIME
+        ) == {name: (tmp, {site: id_ for site in sites})}
+        await memory_controller.set_miss(name, Medium.ANIME, Site.KITSU)
+        assert await memory_controller.resolve_queries(
+            [name, 'not cached'], Medium.ANIME
+        ) == ({name: (tmp, {site: id_ for site in sites})},
+              {name: {Site.KITSU}})
@@ -0,0 +1,271 @@
+from asyncio import ensure_future, sleep
+
+import pytest
+
+from minoshiro import Minoshiro
+from minoshiro.circuit_breaker import CircuitBreaker
+from minoshiro.data_controller import SqliteController
+from minoshiro.enums import BreakerState, Medium, Site
+from minoshiro import minoshiro as client
+from minoshiro.web_api import ani_list, anime_planet
+from tests import clear_sqlite, test_data_path
+from tests.utils import Clock
+from .test_ani_db import XML
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+async def minoshiro():
+    path = str(test_data_path.joinpath('test_db'))
+    res = Minoshiro(await SqliteController.get_instance(path))
+    yield res
+    await res.close()
+    clear_sqlite(path)
+
+
+def fake_find(delays: dict = None, calls: list = None):
+    """
+    Make a fake site search that finds every query on every site, with the
+    query as the title.
+
+    :param delays: a dict of {site: seconds the search takes}
+
+    :param calls: a list to append the (query, names, site) searched to.
+
+    :return: the fake ``Minoshiro.__find``
+    """
+    async def find(self, cached_data, cached_id, query, names,
+                   site, medium, timeout):
+        if calls is not None:
+            calls.append((query, list(names), site))
+        await sleep((delays or {}).get(site, 0))
+        return {'title_romaji': query, 'site': site.value}, str(site.value)
+
+    return find
+
+
+async def test_deadline(minoshiro: Minoshiro, monkeypatch):
+    """
+    Test sites done after the deadline are left out, but still cached once
+    they are done.
+    """
+    monkeypatch.setattr(
+        Minoshiro, '_Minoshiro__find', fake_find({Site.KITSU: 0.5})
+    )
+    res = await minoshiro.get_data(
+        'Steins;Gate', Medium.ANIME, [Site.ANILIST, Site.KITSU],
+        concurrent=True, deadline=0.2
+    )
+    assert list(res) == [Site.ANILIST]
+    await sleep(0.5)
+    assert await minoshiro.db_controller.get_identifier(
+        'Steins;Gate', Medium.ANIME
+    ) == {Site.ANILIST: str(Site.ANILIST.value),
+          Site.KITSU: str(Site.KITSU.value)}
+
+
+async def test_deadline_cache(minoshiro: Minoshiro, monkeypatch):
+    """
+    Test the deadline covers reading the cache.
+    """
+    resolve_queries = SqliteController.resolve_queries
+
+    async def slow(self, queries, medium):
+        await sleep(0.5)
+        return await resolve_queries(self, queries, medium)
+
+    monkeypatch.setattr(SqliteController, 'resolve_queries', slow)
+    monkeypatch.setattr(Minoshiro, '_Minoshiro__find', fake_find())
+    start = minoshiro.loop.time()
+    assert not await minoshiro.get_data(
+        'Steins;Gate', Medium.ANIME, [Site.ANILIST], deadline=0.2
+    )
+    assert minoshiro.loop.time() - start < 0.4
+    await sleep(0.5)
+    assert await minoshiro.db_controller.get_identifier(
+        'Steins;Gate', Medium.ANIME
+    ) == {Site.ANILIST: str(Site.ANILIST.value)}
+
+
+async def test_breaker_cached(minoshiro: Minoshiro, monkeypatch):
+    """
+    Test cached results are served while a breaker is open, and only
+    searches that reach a site count towards its breaker.
+    """
+    db = minoshiro.db_controller
+    data = {'id': 9253, 'title_romaji': 'Steins;Gate'}
+    await db.set_identifiers_bulk([
+        ('Steins;Gate', Medium.ANIME, Site.ANILIST, '9253'),
+        ('Steins;Gate', Medium.ANIME, Site.ANIMEPLANET, 'steins-gate')
+    ])
+    await db.set_medium_data('9253', Medium.ANIME, Site.ANILIST, data)
+    calls = []
+
+    async def search(*args, **kwargs):
+        calls.append(args)
+
+    monkeypatch.setattr(ani_list, 'get_entry_details', search)
+    clock = Clock()
+    for site in (Site.ANILIST, Site.ANIMEPLANET):
+        breaker = minoshiro.breakers[site] = CircuitBreaker(
+            window=1, min_calls=1, probe_interval=10, clock=clock
+        )
+        breaker.record(False, 0)
+    assert await minoshiro.get_data(
+        'Steins;Gate', Medium.ANIME, [Site.ANILIST, Site.ANIMEPLANET]
+    ) == {Site.ANILIST: data, Site.ANIMEPLANET: {
+        'url': anime_planet.get_anime_url_by_id('steins-gate')
+    }}
+    assert not await minoshiro.get_data(
+        'Nothing', Medium.ANIME, [Site.ANILIST]
+    )
+    assert not calls
+    assert not await db.get_misses(['Nothing'], Medium.ANIME)
+
+    # Cache hits don't use up the probe of a half open breaker.
+    clock.now = 10
+    await minoshiro.get_data('Steins;Gate', Medium.ANIME, [Site.ANILIST])
+    assert minoshiro.breakers[Site.ANILIST].state == BreakerState.HALF_OPEN
+    await minoshiro.get_data('Nothing', Medium.ANIME, [Site.ANILIST])
+    assert len(calls) == 1
+    assert minoshiro.breakers[Site.ANILIST].state == BreakerState.CLOSED
+
+
+async def test_anidb_refresh(minoshiro: Minoshiro, monkeypatch, tmp_path):
+    """
+    Test anidb is skipped without recording a miss until the data dump is
+    loaded, and a new data dump is loaded in the background.
+    """
+    downloads = []
+
+    async def download_anidb(session_manager, timestamp=None):
+        downloads.append(timestamp)
+        return False, len(downloads)
+
+    async def pre_cache(self, session_manager):
+        pass
+
+    monkeypatch.setattr(client, 'data_path', tmp_path)
+    monkeypatch.setattr(client, 'download_anidb', download_anidb)
+    monkeypatch.setattr(SqliteController, 'pre_cache', pre_cache)
+    db = minoshiro.db_controller
+    assert not await minoshiro.get_data(
+        'Steins;Gate', Medium.ANIME, [Site.ANIDB]
+    )
+    assert not await db.get_misses(['Steins;Gate'], Medium.ANIME)
+
+    dump = tmp_path.joinpath('anime-titles.xml')
+    dump.write_bytes(XML)
+    minoshiro.anidb_refresh = 0.05
+    await minoshiro.pre_cache(0)
+    res = await minoshiro.get_data('Steins;Gate', Medium.ANIME, [Site.ANIDB])
+    assert res[Site.ANIDB]['id'] == '2'
+
+    dump.write_bytes(XML.replace(b'<anime aid="3"></anime>', b"""
+    <anime aid="3">
+      <title xml:lang="x-jat" type="main">Shingeki no Kyojin</title>
+    </anime>"""))
+    await sleep(0.5)
+    assert len(downloads) > 1 and downloads[1] == 1
+    res = await minoshiro.get_data(
+        'Shingeki no Kyojin', Medium.ANIME, [Site.ANIDB]
+    )
+    assert res[Site.ANIDB]['id'] == '3'
+
+
+async def test_data_many(minoshiro: Minoshiro, monkeypatch):
+    """
+    Test queries with the same normalized name are searched once, and each
+    query gets the results.
+    """
+    calls = []
+    monkeypatch.setattr(Minoshiro, '_Minoshiro__find', fake_find(calls=calls))
+    queries = ['Steins;Gate', 'steins gate', ' STEINS;GATE ', 'Berserk']
+    res = await minoshiro.get_data_many(
+        queries, Medium.MANGA, [Site.ANILIST, Site.KITSU]
+    )
+    assert sorted((query, site.value) for query, _, site in calls) == [
+        (query, site.value) for query in ('Berserk', 'Steins;Gate')
+        for site in sorted((Site.ANILIST, Site.KITSU), key=lambda s: s.value)
+    ]
+    assert set(res) == set(queries)
+    for query in queries:
+        title = 'Berserk' if query == 'Berserk' else 'Steins;Gate'
+        assert res[query] == {
+            site: {'title_romaji': title, 'site': site.value}
+            for site in (Site.ANILIST, Site.KITSU)
+        }
+
+
+async def test_cached_names(minoshiro: Minoshiro, monkeypatch):
+    """
+    Test the ids found are cached with every synonym found as a whole name.
+    """
+    async def find(self, cached_data, cached_id, query, names,
+                   site, medium, timeout):
+        return {'title_romaji': 'Steins;Gate', 'title_english': 'Steins Gate',
+                'synonyms': ['Shutainzu Geeto', '']}, '9253'
+
+    monkeypatch.setattr(Minoshiro, '_Minoshiro__find', find)
+    await minoshiro.get_data('sg', Medium.ANIME, [Site.ANILIST])
+    assert sorted(await minoshiro.db_controller.fetchall(
+        'SELECT syname, site, identifier FROM lookup'
+    )) == [(name, Site.ANILIST.value, '9253')
+           for name in ('Shutainzu Geeto', 'Steins Gate', 'Steins;Gate')]
+
+
+async def test_shared_cancelled(minoshiro: Minoshiro, monkeypatch):
+    """
+    Test a search that joined a lookup of another search still caches the
+    results if the other search is cancelled.
+    """
+    calls = []
+    monkeypatch.setattr(Minoshiro, '_Minoshiro__find', fake_find(
+        {Site.ANILIST: 0.2}, calls
+    ))
+    first = ensure_future(minoshiro.get_data(
+        'Steins;Gate', Medium.ANIME, [Site.ANILIST]
+    ))
+    await sleep(0.05)
+    second = ensure_future(minoshiro.get_data(
+        'steins gate', Medium.ANIME, [Site.ANILIST]
+    ))
+    await sleep(0.05)
+    first.cancel()
+    assert await second == {Site.ANILIST: {
+        'title_romaji': 'Steins;Gate', 'site': Site.ANILIST.value
+    }}
+    assert len(calls) == 1
+    assert await minoshiro.db_controller.get_identifier(
+        'Steins;Gate', Medium.ANIME
+    ) == {Site.ANILIST: str(Site.ANILIST.value)}
+
+
+async def test_concurrent(minoshiro: Minoshiro, monkeypatch):
+    """
+    Test searching the sites at the same time gives the same results as
+    searching them one after another, and the sites that search with
+    synonyms start after the sites that provide them are done.
+    """
+    calls = []
+    monkeypatch.setattr(Minoshiro, '_Minoshiro__find', fake_find(
+        {Site.ANILIST: 0.1, Site.KITSU: 0.2}, calls
+    ))
+    sites = [Site.ANILIST, Site.KITSU, Site.ANIMEPLANET, Site.MANGAUPDATES]
+    res = [site async for site, _ in minoshiro.yield_data(
+        'Berserk', Medium.MANGA, sites, concurrent=True
+    )]
+    assert res[0] == Site.ANILIST and res[-1] == Site.KITSU
+    assert set(res[1:-1]) == {Site.ANIMEPLANET, Site.MANGAUPDATES}
+    names = {site: names for _, names, site in calls}
+    assert names[Site.ANIMEPLANET] == names[Site.MANGAUPDATES] == ['Berserk']
+
+    calls.clear()
+    for query in ('Steins;Gate', 'Berserk'):
+        assert await minoshiro.get_data(
+            query, Medium.MANGA, sites, concurrent=True
+        ) == await minoshiro.get_data(query, Medium.MANGA, sites)
+    for query, names, site in calls:
+        if site in (Site.ANIMEPLANET, Site.MANGAUPDATES):
+            assert names == [query]
@@ -6,8 +6,8 @@ import pytest
 
 from minoshiro import get_default_logger
 from minoshiro.data_controller import PostgresController
-from minoshiro.enums import Medium
-from tests import SCHEMA, get_pool
+from minoshiro.enums import Medium, Site
+from tests import SCHEMA, get_pool, synonyms
 from tests.utils import *
 
 pytestmark = pytest.mark.asyncio
@@ -83,3 +83,252 @@ async def test_data(postgres: PostgresController):
         )
         new_data = await postgres.get_medium_data(name, Medium.ANIME)
         assert not new_data or updated_site not in new_data
+
+
+async def test_resolve_cached_many(postgres: PostgresController):
+    """
+    Test getting cached data and identifiers for many queries at once.
+    """
+    ids = set(random_str() for _ in range(randint(5, 15)))
+    names = [f'name {i} {random_str()}' for i in ids]
+    expected = {}
+    for id_, name in zip(ids, names):
+        data, id_dict = {}, {}
+        for site in random_sites():
+            id_dict[site] = id_
+            await postgres.set_identifier(name, Medium.ANIME, site, id_)
+            if choice((True, False)):
+                data[site] = random_dict()
+                await postgres.set_medium_data(
+                    id_, Medium.ANIME, site, data[site]
+                )
+        expected[name.upper()] = data, id_dict
+    res = await postgres.resolve_cached_many(
+        [*expected, 'not cached'], Medium.ANIME
+    )
+    assert res == expected
+
+
+async def test_misses(postgres: PostgresController):
+    """
+    Test recording sites with no search results.
+    """
+    names = set(random_str() for _ in range(randint(5, 15)))
+    expected = {}
+    for name in names:
+        sites = set(random_sites())
+        for site in sites:
+            await postgres.set_miss(name, Medium.MANGA, site)
+        expected[f' {name.upper()} '] = sites
+    assert await postgres.get_misses(expected, Medium.MANGA) == expected
+    assert not await postgres.get_misses(expected, Medium.ANIME)
+
+    await postgres.pool.execute(
+        'UPDATE robotesting.miss SET cachetime=$1',
+        datetime.fromtimestamp(time() - postgres.miss_ttl - 1)
+    )
+    assert not await postgres.get_misses(expected, Medium.MANGA)
+
+    # Misses are keyed like the lookup, and expired misses are deleted.
+    await postgres.set_miss('Re:Zero  kara', Medium.ANIME, Site.KITSU)
+    assert await postgres.get_misses(
+        ['re zero kara'], Medium.ANIME
+    ) == {'re zero kara': {Site.KITSU}}
+    records = await postgres.pool.fetch(
+        'SELECT query, site FROM robotesting.miss'
+    )
+    assert [tuple(r.values()) for r in records] == [
+        ('re zero kara', Site.KITSU.value)
+    ]
+
+
+async def test_resolve_queries(postgres: PostgresController):
+    """
+    Test getting the cached data, identifiers and misses for many queries
+    at once.
+    """
+    name, id_, data = random_str(), random_str(), random_dict()
+    await postgres.set_identifier(name, Medium.ANIME, Site.ANILIST, id_)
+    await postgres.set_medium_data(id_, Medium.ANIME, Site.ANILIST, data)
+    await postgres.set_miss(name, Medium.ANIME, Site.KITSU)
+    await postgres.set_miss('Nothing', Medium.ANIME, Site.ANIDB)
+    assert await postgres.resolve_queries(
+        [name.upper(), 'nothing', 'not cached'], Medium.ANIME
+    ) == (
+        {name.upper(): ({Site.ANILIST: data}, {Site.ANILIST: id_})},
+        {name.upper(): {Site.KITSU}, 'nothing': {Site.ANIDB}}
+    )
+
+
+async def test_stale_while_revalidate(postgres: PostgresController):
+    """
+    Test expired data is served and refreshed when ``max_stale`` is set.
+    """
+    refreshed = []
+    postgres.max_stale = 3600
+    postgres.set_refresh_callback(lambda *args: refreshed.append(args))
+    id_, data = random_str(), random_dict()
+    await postgres.set_medium_data(id_, Medium.ANIME, Site.ANILIST, data)
+    sql = """
+    UPDATE robotesting.anime
+    SET cachetime=$1
+    WHERE id=$2 AND site=$3
+    """
+    await postgres.pool.execute(
+        sql, datetime.fromtimestamp(time() - 88888), id_, Site.ANILIST.value
+    )
+    assert await postgres.medium_data_by_id(
+        id_, Medium.ANIME, Site.ANILIST
+    ) == data
+    assert refreshed == [(id_, Medium.ANIME, Site.ANILIST)]
+
+    await postgres.pool.execute(
+        sql, datetime.fromtimestamp(time() - 86400 - 3601),
+        id_, Site.ANILIST.value
+    )
+    assert not await postgres.medium_data_by_id(
+        id_, Medium.ANIME, Site.ANILIST
+    )
+
+
+async def test_ttl_policy(postgres: PostgresController):
+    """
+    Test finished entries stay fresh past the default TTL.
+    """
+    id_, data = random_str(), random_dict()
+    data['status'] = 'FINISHED'
+    await postgres.set_medium_data(id_, Medium.ANIME, Site.ANILIST, data)
+    sql = """
+    UPDATE robotesting.anime
+    SET cachetime=$1
+    WHERE id=$2 AND site=$3
+    """
+    await postgres.pool.execute(
+        sql, datetime.fromtimestamp(time() - 86400 * 7),
+        id_, Site.ANILIST.value
+    )
+    assert await postgres.medium_data_by_id(
+        id_, Medium.ANIME, Site.ANILIST
+    ) == data
+
+
+async def test_bulk(postgres: PostgresController):
+    """
+    Test setting identifiers and medium data in bulk.
+    """
+    entries = random_lookup_entries()
+    await postgres.set_identifiers_bulk(
+        (name, medium, site, id_)
+        for name, value in entries.items()
+        for medium, site_vals in value.items()
+        for site, id_ in site_vals.items()
+    )
+    for name, value in entries.items():
+        for medium, site_vals in value.items():
+            res = await postgres.get_identifier(name, medium)
+            assert res == site_vals
+
+    rows = [(random_str(), medium, Site.ANILIST, random_dict())
+            for medium in (Medium.ANIME, Medium.MANGA) for _ in range(5)]
+    await postgres.set_medium_data_bulk(rows)
+    for id_, medium, site, data in rows:
+        assert await postgres.medium_data_by_id(
+            id_, medium, site
+        ) == data
+
+
+async def test_resolve_cached(postgres: PostgresController):
+    """
+    Test getting the cached data and identifiers for one search query.
+    """
+    name, data = random_str(), random_dict()
+    ids = {Site.ANILIST: random_str(), Site.ANIDB: random_str()}
+    await postgres.set_identifiers_bulk(
+        (name, Medium.ANIME, site, id_) for site, id_ in ids.items()
+    )
+    await postgres.set_medium_data(
+        ids[Site.ANILIST], Medium.ANIME, Site.ANILIST, data
+    )
+    assert await postgres.resolve_cached(
+        name.upper(), Medium.ANIME
+    ) == ({Site.ANILIST: data}, ids)
+    assert await postgres.resolve_cached(
+        random_str(), Medium.ANIME
+    ) == ({}, None)
+
+
+async def test_normalized_lookup(postgres: PostgresController):
+    """
+    Test names written in different ways find the same identifiers.
+    """
+    id_ = random_str()
+    await postgres.set_identifier(
+        'Re:Zero  kara', Medium.ANIME, Site.ANILIST, id_
+    )
+    for query in ('re zero kara', 'ＲＥ：ＺＥＲＯ KARA', 'Re: Zero - Kara'):
+        assert await postgres.get_identifier(
+            query, Medium.ANIME
+        ) == {Site.ANILIST: id_}
+
+
+async def test_pre_cache(postgres: PostgresController, synonyms):
+    """
+    Test populating the lookup and mal tables from the synonym rows, only
+    importing what changed since the revision imported last time.
+    """
+    rows = [
+        ('Steins;Gate', 'Anime',
+         '{"mal": ["Steins;Gate", 9253], "ani": 9253, "adb": "7729"}'),
+        ('Shutainzu Geeto', 'Anime',
+         '{"mal": ["Steins;Gate", 9253], "ani": 9253, "ap": null}'),
+        ('Berserk', 'Manga', '{"mal": ["Berserk", 2], "ap": "berserk"}'),
+    ]
+    synonyms(rows, 1)
+    await postgres.pre_cache(None)
+    assert await postgres.get_synonyms_revision() == 1
+    assert await postgres.get_identifier('steins gate', Medium.ANIME) == {
+        Site.MAL: '9253', Site.ANILIST: '9253', Site.ANIDB: '7729'
+    }
+    assert await postgres.get_identifier(
+        'shutainzu geeto', Medium.ANIME
+    ) == {Site.MAL: '9253', Site.ANILIST: '9253'}
+    assert await postgres.get_identifier('berserk', Medium.MANGA) == {
+        Site.MAL: '2', Site.ANIMEPLANET: 'berserk'
+    }
+    assert await postgres.get_mal_title('2', Medium.MANGA) == 'Berserk'
+
+    # Rows deleted locally show which rows a pre cache writes.
+    await postgres.pool.execute('DELETE FROM robotesting.lookup')
+    await postgres.pre_cache(None)
+    assert not await postgres.pool.fetch('SELECT * FROM robotesting.lookup')
+
+    rows[2] = ('Berserk', 'Manga', '{"mal": ["Berserk", 3]}')
+    synonyms(rows, 2)
+    await postgres.pre_cache(None)
+    assert await postgres.get_synonyms_revision() == 2
+    records = await postgres.pool.fetch(
+        'SELECT syname, site, identifier FROM robotesting.lookup'
+    )
+    assert [tuple(r.values()) for r in records] == [
+        ('Berserk', Site.MAL.value, '3')
+    ]
+
+    # Removed synonyms are removed, but not ids cached from somewhere else
+    # or MAL titles other names still have.
+    await postgres.set_identifiers_bulk([
+        ('Shutainzu Geeto', Medium.ANIME, Site.ANILIST, '9253'),
+        ('Shutainzu Geeto', Medium.ANIME, Site.KITSU, '9253'),
+        ('Steins;Gate', Medium.ANIME, Site.MAL, '9253'),
+    ])
+    synonyms(rows[:1], 3)
+    await postgres.pre_cache(None)
+    assert await postgres.get_synonyms_revision() == 3
+    records = await postgres.pool.fetch(
+        'SELECT syname, site, identifier FROM robotesting.lookup'
+    )
+    assert sorted(tuple(r.values()) for r in records) == [
+        ('Shutainzu Geeto', Site.KITSU.value, '9253'),
+        ('Steins;Gate', Site.MAL.value, '9253')
+    ]
+    assert await postgres.get_mal_title('9253', Medium.ANIME) == 'Steins;Gate'
+    assert not await postgres.get_mal_title('3', Medium.MANGA)
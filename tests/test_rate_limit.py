@@ -0,0 +1,80 @@
+from asyncio import ensure_future, get_event_loop, sleep
+
+import pytest
+
+from minoshiro.enums import Priority
+from minoshiro.rate_limit import LimitedSession, RateLimitError, RateLimiter
+
+pytestmark = pytest.mark.asyncio
+
+URL = 'https://example.com/search'
+
+
+async def test_burst():
+    """
+    Test requests within the burst size are not delayed, and requests past it
+    are paced by the rate.
+    """
+    limiter = RateLimiter({'example.com': (20, 3)})
+    loop = get_event_loop()
+    start = loop.time()
+    for _ in range(3):
+        await limiter.acquire(URL)
+    assert loop.time() - start < 0.02
+    await limiter.acquire(URL)
+    assert loop.time() - start >= 0.04
+
+
+async def test_priority():
+    """
+    Test queued interactive requests go before queued background requests.
+    """
+    limiter = RateLimiter({'example.com': (20, 1)})
+    await limiter.acquire(URL)
+    order = []
+
+    async def request(priority):
+        await limiter.acquire(URL, priority)
+        order.append(priority)
+
+    tasks = [ensure_future(request(Priority.BACKGROUND)) for _ in range(2)]
+    await sleep(0)
+    tasks.append(ensure_future(request(Priority.INTERACTIVE)))
+    for task in tasks:
+        await task
+    assert order == [Priority.INTERACTIVE, Priority.BACKGROUND,
+                     Priority.BACKGROUND]
+
+
+async def test_fail_fast():
+    """
+    Test a request fails at once when it can't be sent before its timeout.
+    """
+    limiter = RateLimiter({'example.com': (1, 1)})
+    await limiter.acquire(URL)
+    loop = get_event_loop()
+    start = loop.time()
+    with pytest.raises(RateLimitError):
+        await limiter.acquire(URL, timeout=0.5)
+    assert loop.time() - start < 0.1
+    await limiter.acquire('https://other.example.com', timeout=0)
+
+
+async def test_session_timeout():
+    """
+    Test the time a request waited is taken off its timeout.
+    """
+    timeouts = []
+
+    class Session:
+        async def get(self, url, **kwargs):
+            timeouts.append(kwargs.get('timeout'))
+
+    limiter = RateLimiter({'example.com': (10, 1)})
+    session = LimitedSession(Session(), limiter, Priority.INTERACTIVE)
+    await session.get(URL, timeout=3)
+    await session.get(URL, timeout=3)
+    await session.get(URL)
+    assert timeouts[0] == pytest.approx(3, abs=0.01)
+    assert timeouts[1] == pytest.approx(2.9, abs=0.02)
+    assert timeouts[2] is None
@@ -0,0 +1,46 @@
+from asyncio import gather, sleep
+
+import pytest
+
+from minoshiro.single_flight import SingleFlight
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_coalesce():
+    """
+    Test concurrent calls with the same key share one call.
+    """
+    flights = SingleFlight()
+    calls = []
+
+    async def func(val):
+        calls.append(val)
+        await sleep(0.05)
+        return {'val': val}
+
+    res = await gather(*(flights.do('key', func, i) for i in range(10)))
+    assert len(calls) == 1
+    assert [shared for _, shared in res].count(False) == 1
+    assert all(val is res[0][0] for val, _ in res)
+    assert not len(flights)
+
+    res, shared = await flights.do('key', func, 'new')
+    assert res == {'val': 'new'} and not shared
+    assert len(calls) == 2
+
+
+async def test_exception():
+    """
+    Test all callers get the exception raised by the shared call.
+    """
+    flights = SingleFlight()
+
+    async def func():
+        await sleep(0.05)
+        raise ValueError
+
+    res = await gather(*(flights.do('key', func) for _ in range(3)),
+                       return_exceptions=True)
+    assert all(isinstance(e, ValueError) for e in res)
+    assert not len(flights)
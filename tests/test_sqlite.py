@@ -1,11 +1,16 @@
+from asyncio import get_event_loop
 from random import choice, randint
+from sqlite3 import connect
 from time import time
 
 import pytest
 
 from minoshiro.data_controller import SqliteController
-from minoshiro.enums import Medium
-from tests import clear_sqlite, test_data_path
+from minoshiro.data_controller.sqlite_engine import SqliteEngine
+from minoshiro.data_controller.sqlite_utils import (import_synonyms,
+                                                      make_tables)
+from minoshiro.enums import Medium, Site
+from tests import clear_sqlite, synonyms, test_data_path
 from tests.utils import *
 
 pytestmark = pytest.mark.asyncio
@@ -16,6 +21,7 @@ async def sqlite_controller():
     path = str(test_data_path.joinpath('test_db'))
     res = await SqliteController.get_instance(path)
     yield res
+    await res.close()
     clear_sqlite(path)
 
 
@@ -81,3 +87,317 @@ async def test_data(sqlite_controller: SqliteController):
         )
         new_data = await sqlite_controller.get_medium_data(name, Medium.ANIME)
         assert not new_data or updated_site not in new_data
+
+
+async def test_resolve_cached_many(sqlite_controller: SqliteController):
+    """
+    Test getting cached data and identifiers for many queries at once.
+    """
+    ids = set(random_str() for _ in range(randint(5, 15)))
+    names = [f'name {i} {random_str()}' for i in ids]
+    expected = {}
+    for id_, name in zip(ids, names):
+        data, id_dict = {}, {}
+        for site in random_sites():
+            id_dict[site] = id_
+            await sqlite_controller.set_identifier(name, Medium.ANIME, site,
+                                                   id_)
+            if choice((True, False)):
+                data[site] = random_dict()
+                await sqlite_controller.set_medium_data(
+                    id_, Medium.ANIME, site, data[site]
+                )
+        expected[name.upper()] = data, id_dict
+    res = await sqlite_controller.resolve_cached_many(
+        [*expected, 'not cached'], Medium.ANIME
+    )
+    assert res == expected
+
+
+async def test_misses(sqlite_controller: SqliteController):
+    """
+    Test recording sites with no search results.
+    """
+    names = set(random_str() for _ in range(randint(5, 15)))
+    expected = {}
+    for name in names:
+        sites = set(random_sites())
+        for site in sites:
+            await sqlite_controller.set_miss(name, Medium.MANGA, site)
+        expected[f' {name.upper()} '] = sites
+    assert await sqlite_controller.get_misses(
+        expected, Medium.MANGA
+    ) == expected
+    assert not await sqlite_controller.get_misses(expected, Medium.ANIME)
+
+    await sqlite_controller.execute(
+        'UPDATE miss SET cachetime=?',
+        (int(time()) - sqlite_controller.miss_ttl - 1,)
+    )
+    assert not await sqlite_controller.get_misses(expected, Medium.MANGA)
+
+    # Misses are keyed like the lookup, and expired misses are deleted.
+    await sqlite_controller.set_miss('Re:Zero  kara', Medium.ANIME, Site.KITSU)
+    assert await sqlite_controller.get_misses(
+        ['re zero kara'], Medium.ANIME
+    ) == {'re zero kara': {Site.KITSU}}
+    assert await sqlite_controller.fetchall(
+        'SELECT query, site FROM miss'
+    ) == [('re zero kara', Site.KITSU.value)]
+
+
+async def test_resolve_queries(sqlite_controller: SqliteController,
+                               monkeypatch):
+    """
+    Test getting the cached data, identifiers and misses for many queries
+    in one read.
+    """
+    name, id_, data = random_str(), random_str(), random_dict()
+    await sqlite_controller.set_identifier(name, Medium.ANIME,
+                                           Site.ANILIST, id_)
+    await sqlite_controller.set_medium_data(id_, Medium.ANIME,
+                                            Site.ANILIST, data)
+    await sqlite_controller.set_miss(name, Medium.ANIME, Site.KITSU)
+    await sqlite_controller.set_miss('Nothing', Medium.ANIME, Site.ANIDB)
+    reads = []
+    read = SqliteEngine.read
+
+    async def count(self, func, *args):
+        reads.append(func)
+        return await read(self, func, *args)
+
+    monkeypatch.setattr(SqliteEngine, 'read', count)
+    assert await sqlite_controller.resolve_queries(
+        [name.upper(), 'nothing', 'not cached'], Medium.ANIME
+    ) == (
+        {name.upper(): ({Site.ANILIST: data}, {Site.ANILIST: id_})},
+        {name.upper(): {Site.KITSU}, 'nothing': {Site.ANIDB}}
+    )
+    assert len(reads) == 1
+
+
+async def test_stale_while_revalidate(sqlite_controller: SqliteController):
+    """
+    Test expired data is served and refreshed when ``max_stale`` is set.
+    """
+    refreshed = []
+    sqlite_controller.max_stale = 3600
+    sqlite_controller.set_refresh_callback(
+        lambda *args: refreshed.append(args)
+    )
+    id_, data = random_str(), random_dict()
+    await sqlite_controller.set_medium_data(id_, Medium.ANIME,
+                                            Site.ANILIST, data)
+    sql = 'UPDATE anime SET cachetime=? WHERE id=? AND site=?'
+    await sqlite_controller.execute(
+        sql, (int(time()) - 88888, id_, Site.ANILIST.value)
+    )
+    assert await sqlite_controller.medium_data_by_id(
+        id_, Medium.ANIME, Site.ANILIST
+    ) == data
+    assert refreshed == [(id_, Medium.ANIME, Site.ANILIST)]
+
+    await sqlite_controller.execute(
+        sql, (int(time()) - 86400 - 3601, id_, Site.ANILIST.value)
+    )
+    assert not await sqlite_controller.medium_data_by_id(
+        id_, Medium.ANIME, Site.ANILIST
+    )
+
+
+async def test_ttl_policy(sqlite_controller: SqliteController):
+    """
+    Test finished entries stay fresh past the default TTL.
+    """
+    id_, data = random_str(), random_dict()
+    data['status'] = 'FINISHED'
+    await sqlite_controller.set_medium_data(id_, Medium.ANIME, Site.ANILIST, data)
+    await sqlite_controller.execute(
+        'UPDATE anime SET cachetime=? WHERE id=? AND site=?',
+        (int(time()) - 86400 * 7, id_, Site.ANILIST.value)
+    )
+    assert await sqlite_controller.medium_data_by_id(
+        id_, Medium.ANIME, Site.ANILIST
+    ) == data
+
+
+async def test_bulk(sqlite_controller: SqliteController):
+    """
+    Test setting identifiers and medium data in bulk.
+    """
+    entries = random_lookup_entries()
+    await sqlite_controller.set_identifiers_bulk(
+        (name, medium, site, id_)
+        for name, value in entries.items()
+        for medium, site_vals in value.items()
+        for site, id_ in site_vals.items()
+    )
+    for name, value in entries.items():
+        for medium, site_vals in value.items():
+            res = await sqlite_controller.get_identifier(name, medium)
+            assert res == site_vals
+
+    rows = [(random_str(), medium, Site.ANILIST, random_dict())
+            for medium in (Medium.ANIME, Medium.MANGA) for _ in range(5)]
+    await sqlite_controller.set_medium_data_bulk(rows)
+    for id_, medium, site, data in rows:
+        assert await sqlite_controller.medium_data_by_id(
+            id_, medium, site
+        ) == data
+
+
+async def test_resolve_cached(sqlite_controller: SqliteController):
+    """
+    Test getting the cached data and identifiers for one search query.
+    """
+    name, data = random_str(), random_dict()
+    ids = {Site.ANILIST: random_str(), Site.ANIDB: random_str()}
+    await sqlite_controller.set_identifiers_bulk(
+        (name, Medium.ANIME, site, id_) for site, id_ in ids.items()
+    )
+    await sqlite_controller.set_medium_data(
+        ids[Site.ANILIST], Medium.ANIME, Site.ANILIST, data
+    )
+    assert await sqlite_controller.resolve_cached(
+        name.upper(), Medium.ANIME
+    ) == ({Site.ANILIST: data}, ids)
+    assert await sqlite_controller.resolve_cached(
+        random_str(), Medium.ANIME
+    ) == ({}, None)
+
+
+async def test_normalized_lookup(sqlite_controller: SqliteController):
+    """
+    Test names written in different ways find the same identifiers.
+    """
+    id_ = random_str()
+    await sqlite_controller.set_identifier(
+        'Re:Zero  kara', Medium.ANIME, Site.ANILIST, id_
+    )
+    for query in ('re zero kara', 'ＲＥ：ＺＥＲＯ KARA', 'Re: Zero - Kara'):
+        assert await sqlite_controller.get_identifier(
+            query, Medium.ANIME
+        ) == {Site.ANILIST: id_}
+
+
+async def test_lookup_migration():
+    """
+    Test a lookup table made before the normalized name column gets the
+    column, its index and the normalized names, only on the first start.
+    """
+    path = str(test_data_path.joinpath('test_db'))
+    with connect(path) as conn:
+        conn.execute("""
+        CREATE TABLE lookup(
+          syname VARCHAR,
+          medium INT,
+          site INT,
+          identifier VARCHAR NOT NULL,
+          PRIMARY KEY (syname, medium, site)
+        )""")
+        conn.execute(
+            'INSERT INTO lookup VALUES (?, ?, ?, ?)',
+            ('Steins;Gate', Medium.ANIME.value, Site.ANILIST.value, '1')
+        )
+    await make_tables(path, get_event_loop())
+    controller = SqliteController(path, None)
+    try:
+        assert await controller.get_identifier(
+            'steins gate', Medium.ANIME
+        ) == {Site.ANILIST: '1'}
+        plan = await controller.fetchall(
+            'EXPLAIN QUERY PLAN SELECT identifier FROM lookup '
+            'WHERE norm_name=? AND medium=?', ('steins gate', 1)
+        )
+        assert 'lookup_norm_name' in ' '.join(str(row) for row in plan)
+
+        # Later starts don't fill in the normalized names again.
+        await controller.execute('UPDATE lookup SET norm_name=NULL')
+        await make_tables(path, get_event_loop())
+        assert not await controller.get_identifier(
+            'steins gate', Medium.ANIME
+        )
+    finally:
+        await controller.close()
+        clear_sqlite(path)
+
+
+@pytest.mark.parametrize('attach', (False, True))
+async def test_pre_cache(sqlite_controller: SqliteController, synonyms,
+                         attach):
+    """
+    Test populating the lookup and mal tables from the synonym rows, only
+    importing what changed since the revision imported last time.
+    """
+    rows = [
+        ('Steins;Gate', 'Anime',
+         '{"mal": ["Steins;Gate", 9253], "ani": 9253, "adb": "7729"}'),
+        ('Shutainzu Geeto', 'Anime',
+         '{"mal": ["Steins;Gate", 9253], "ani": 9253, "ap": null}'),
+        ('Berserk', 'Manga', '{"mal": ["Berserk", 2], "ap": "berserk"}'),
+    ]
+    sqlite_controller.attach_synonyms = attach
+    synonyms(rows, 1)
+    await sqlite_controller.pre_cache(None)
+    assert await sqlite_controller.get_synonyms_revision() == 1
+    assert await sqlite_controller.get_identifier(
+        'steins gate', Medium.ANIME
+    ) == {Site.MAL: '9253', Site.ANILIST: '9253', Site.ANIDB: '7729'}
+    assert await sqlite_controller.get_identifier(
+        'shutainzu geeto', Medium.ANIME
+    ) == {Site.MAL: '9253', Site.ANILIST: '9253'}
+    assert await sqlite_controller.get_identifier(
+        'berserk', Medium.MANGA
+    ) == {Site.MAL: '2', Site.ANIMEPLANET: 'berserk'}
+    assert await sqlite_controller.get_mal_title(
+        '2', Medium.MANGA
+    ) == 'Berserk'
+
+    # Rows deleted locally show which rows a pre cache writes.
+    await sqlite_controller.execute('DELETE FROM lookup')
+    await sqlite_controller.pre_cache(None)
+    assert not await sqlite_controller.fetchall('SELECT * FROM lookup')
+
+    rows[2] = ('Berserk', 'Manga', '{"mal": ["Berserk", 3]}')
+    synonyms(rows, 2)
+    await sqlite_controller.pre_cache(None)
+    assert await sqlite_controller.get_synonyms_revision() == 2
+    assert await sqlite_controller.fetchall(
+        'SELECT syname, site, identifier FROM lookup'
+    ) == [('Berserk', Site.MAL.value, '3')]
+
+    # Removed synonyms are removed, but not ids cached from somewhere else
+    # or MAL titles other names still have.
+    await sqlite_controller.set_identifiers_bulk([
+        ('Shutainzu Geeto', Medium.ANIME, Site.ANILIST, '9253'),
+        ('Shutainzu Geeto', Medium.ANIME, Site.KITSU, '9253'),
+        ('Steins;Gate', Medium.ANIME, Site.MAL, '9253'),
+    ])
+    synonyms(rows[:1], 3)
+    await sqlite_controller.pre_cache(None)
+    assert await sqlite_controller.get_synonyms_revision() == 3
+    assert sorted(await sqlite_controller.fetchall(
+        'SELECT syname, site, identifier FROM lookup'
+    )) == [('Shutainzu Geeto', Site.KITSU.value, '9253'),
+           ('Steins;Gate', Site.MAL.value, '9253')]
+    assert await sqlite_controller.get_mal_title(
+        '9253', Medium.ANIME
+    ) == 'Steins;Gate'
+    assert not await sqlite_controller.get_mal_title('3', Medium.MANGA)
+
+
+async def test_import_synonyms_rollback(sqlite_controller: SqliteController,
+                                        synonyms):
+    """
+    Test nothing is imported if the revision can't be recorded.
+    """
+    synonyms([('Berserk', 'Manga', '{"ap": "berserk"}')], 1)
+    await sqlite_controller.execute('DROP TABLE meta')
+    with pytest.raises(Exception):
+        import_synonyms(sqlite_controller.path,
+                        test_data_path.joinpath('synonyms.db'), None, 1)
+    assert not await sqlite_controller.fetchall('SELECT * FROM lookup')
+    assert not await sqlite_controller.fetchall('SELECT * FROM mal')
+    await sqlite_controller.execute(
+        'CREATE TABLE meta(key VARCHAR PRIMARY KEY, value VARCHAR)'
+    )
@@ -0,0 +1,70 @@
+from asyncio import gather
+from sqlite3 import OperationalError
+
+import pytest
+
+from minoshiro.data_controller.sqlite_engine import SqliteEngine
+from tests import test_data_path
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+async def engine():
+    path = test_data_path.joinpath('engine_db')
+    res = SqliteEngine(str(path), readers=2)
+    await res.write(
+        lambda conn: conn.execute('CREATE TABLE t(k INT PRIMARY KEY, v INT)')
+    )
+    yield res
+    await res.close()
+    path.unlink()
+
+
+async def test_pragmas(engine: SqliteEngine):
+    """
+    Test the pragmas are set on every connection.
+    """
+    def pragmas(conn):
+        return (conn.execute('PRAGMA journal_mode').fetchone()[0],
+                conn.execute('PRAGMA synchronous').fetchone()[0])
+
+    assert await engine.read(pragmas) == ('wal', 1)
+    assert await engine.write(pragmas) == ('wal', 1)
+
+
+async def test_batched_writes(engine: SqliteEngine):
+    """
+    Test concurrent writes all land, and a failed write doesn't affect the
+    writes batched with it.
+    """
+    def insert(conn, k):
+        conn.execute('INSERT INTO t VALUES (?, ?)', (k, k * 2))
+        return k
+
+    writes = [engine.write(insert, k) for k in range(50)]
+    writes.append(engine.write(insert, 0))
+    res = await gather(*writes, return_exceptions=True)
+    assert res[:50] == list(range(50))
+    assert isinstance(res[50], Exception)
+
+    rows = await engine.read(
+        lambda conn: conn.execute('SELECT k, v FROM t ORDER BY k').fetchall()
+    )
+    assert rows == [(k, k * 2) for k in range(50)]
+
+
+async def test_connect_error():
+    """
+    Test writes fail instead of hanging when the writer connection can't be
+    opened.
+    """
+    engine = SqliteEngine(str(test_data_path.joinpath('missing', 'db')))
+    results = await gather(
+        *(engine.write(lambda conn: None) for _ in range(3)),
+        return_exceptions=True
+    )
+    assert all(isinstance(res, OperationalError) for res in results)
+    with pytest.raises(OperationalError):
+        await engine.write(lambda conn: None)
+    await engine.close()
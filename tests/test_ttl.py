@@ -0,0 +1,40 @@
+from minoshiro.data_controller.ttl import TTLPolicy
+from minoshiro.enums import Medium, Site
+
+
+def test_defaults():
+    """
+    Test the site TTL is used over the medium TTL, and the default is used
+    if neither is set.
+    """
+    policy = TTLPolicy(default=10, site_ttls={Site.KITSU: 20},
+                       medium_ttls={Medium.ANIME: 30})
+    assert policy.ttl({}, Medium.ANIME, Site.KITSU, 0) == 20
+    assert policy.ttl({}, Medium.ANIME, Site.MAL, 0) == 30
+    assert policy.ttl({}, Medium.MANGA, Site.MAL, 0) == 10
+    assert policy.ttl(None, Medium.MANGA, Site.ANILIST, 0) == 10
+
+
+def test_anilist_status():
+    """
+    Test finished Anilist entries live longer, and airing ones expire after
+    their next episode airs.
+    """
+    policy = TTLPolicy(default=10, finished_ttl=1000, airing_delay=50,
+                       min_ttl=100)
+    for status in ('FINISHED', 'CANCELLED'):
+        assert policy.ttl(
+            {'status': status}, Medium.ANIME, Site.ANILIST, 0
+        ) == 1000
+    airing = {
+        'status': 'RELEASING', 'nextAiringEpisode': {'airingAt': 5000}
+    }
+    assert policy.ttl(airing, Medium.ANIME, Site.ANILIST, 4000) == 1050
+    assert policy.ttl(airing, Medium.ANIME, Site.ANILIST, 5000) == 100
+    assert policy.ttl(
+        {'status': 'RELEASING', 'nextAiringEpisode': None},
+        Medium.ANIME, Site.ANILIST, 0
+    ) == 10
+    assert policy.ttl(
+        {'status': 'FINISHED'}, Medium.ANIME, Site.KITSU, 0
+    ) == 10
@@ -0,0 +1,103 @@
+from gzip import compress
+
+import pytest
+
+from minoshiro import upstream
+from minoshiro.web_api.ani_db import load_titles
+from .test_ani_db import XML
+
+pytestmark = pytest.mark.asyncio
+
+
+class _Content:
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for i in range(0, len(self.body), 7):
+            yield self.body[i:i + 7]
+
+
+class _Response:
+    def __init__(self, status, body=b'', headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.content = _Content(body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class _Session:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def get(self, url, range_, **kwargs):
+        self.requests.append(kwargs['headers'])
+        return self.responses.pop(0)
+
+
+@pytest.fixture()
+def anidb_path(tmp_path, monkeypatch):
+    """
+    Keep the anidb data dump in a temporary folder.
+
+    :return: the path to the data dump.
+    """
+    monkeypatch.setattr(upstream, 'data_path', tmp_path)
+    for name, file in (('__anidb_time_path', '.anidb_time'),
+                       ('__anidb_xml_path', 'anime-titles.xml'),
+                       ('__anidb_headers_path', '.anidb_headers')):
+        monkeypatch.setattr(upstream, name, tmp_path.joinpath(file))
+    return tmp_path.joinpath('anime-titles.xml')
+
+
+async def test_download_anidb(anidb_path):
+    """
+    Test the dump is decompressed on download, and not downloaded again
+    if it didn't change.
+    """
+    session = _Session(
+        _Response(200, compress(XML), {'ETag': '"abc"'}),
+        _Response(304)
+    )
+    good, first = await upstream.download_anidb(session)
+    assert not good
+    assert anidb_path.read_bytes() == XML
+    assert load_titles(anidb_path).get('steins;gate')['id'] == '2'
+
+    good, _ = await upstream.download_anidb(session, first)
+    assert good
+    assert len(session.requests) == 1
+
+    good, _ = await upstream.download_anidb(session, first - 86400)
+    assert good
+    assert session.requests == [{}, {'If-None-Match': '"abc"'}]
+    assert anidb_path.read_bytes() == XML
+    assert [p.name for p in anidb_path.parent.iterdir()
+            if p.name.startswith('.anime-titles.')] == []
+
+
+async def test_download_anidb_truncated(anidb_path):
+    """
+    Test a truncated dump, or one with trailing data, is not saved, and its
+    headers are not used for the next download.
+    """
+    session = _Session(
+        _Response(200, compress(XML)[:-10], {'ETag': '"abc"'}),
+        _Response(200, compress(XML) + b'garbage', {'ETag': '"abc"'}),
+        _Response(200, compress(XML), {'ETag': '"def"'})
+    )
+    for _ in range(2):
+        with pytest.raises(EOFError):
+            await upstream.download_anidb(session)
+        assert list(anidb_path.parent.iterdir()) == []
+
+    good, _ = await upstream.download_anidb(session)
+    assert not good
+    assert session.requests == [{}, {}, {}]
+    assert anidb_path.read_bytes() == XML
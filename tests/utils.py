@@ -1,14 +1,25 @@
 from itertools import product
 from random import choice, randint, sample
-from string import printable
+from string import ascii_lowercase, digits
 from typing import Dict, List
 
 from minoshiro.enums import Medium, Site
 
-__all__ = ['random_sites', 'random_mediums', 'random_str',
+__all__ = ['Clock', 'random_sites', 'random_mediums', 'random_str',
            'random_dict', 'random_lookup_entries']
 
 
+class Clock:
+    """
+    A clock that only moves when ``now`` is set.
+    """
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
 def __random_enum_members(enum) -> list:
     """
     Get a list of unique random members from an enum.
@@ -36,11 +47,13 @@ def random_mediums() -> List[Medium]:
 
 def random_str() -> str:
     """
-    Generate a random string.
+    Generate a random string. Different strings are never equal as
+    normalized names, so they can be used as lookup names.
     :return: the random string.
     """
     length = randint(1, 15)
-    return f'test_{"".join(choice(printable) for _ in range(length))}'
+    chars = ascii_lowercase + digits
+    return f'test_{"".join(choice(chars) for _ in range(length))}'
 
 
 def random_dict(depth=0):